@@ -3,8 +3,21 @@ RAGFlow Semantic Search - Streamlit Application
 Приложение для поиска семантически близких чанков через RAGFlow API.
 """
 
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import streamlit as st
-from ragflow_client import RAGFlowClient, RAGFlowError, Chunk
+from ragflow_client import (
+    RAGFlowError, Chunk, HedgePolicy, KnowledgeGraphCache, RetrievalCache, SupersetCache,
+    get_shared_client, rescore_chunks
+)
+from ragflow_metrics import PHASES, ClientMetrics, capture_calls
+from dataset_catalog import DatasetCatalog
+from mind_map import MindMapIndex
+from history_store import HistoryEntry, HistoryStore
 
 
 # ============================================================================
@@ -233,22 +246,108 @@ if 'client' not in st.session_state:
     st.session_state.client = None
 if 'connected' not in st.session_state:
     st.session_state.connected = False
-if 'datasets' not in st.session_state:
-    st.session_state.datasets = []
+if 'catalog' not in st.session_state:
+    st.session_state.catalog = None
 if 'search_results' not in st.session_state:
     st.session_state.search_results = []
 if 'ai_summary' not in st.session_state:
     st.session_state.ai_summary = ""
 if 'mind_map' not in st.session_state:
     st.session_state.mind_map = None
+if 'mind_map_expanded' not in st.session_state:
+    st.session_state.mind_map_expanded = set()
 if 'last_query' not in st.session_state:
     st.session_state.last_query = ""
+if 'search_weight' not in st.session_state:
+    st.session_state.search_weight = None
+if 'search_reranked' not in st.session_state:
+    st.session_state.search_reranked = False
+if 'search_limits' not in st.session_state:
+    st.session_state.search_limits = None
+if 'search_error' not in st.session_state:
+    st.session_state.search_error = None
+if 'search_timing' not in st.session_state:
+    st.session_state.search_timing = None
+if 'search_version' not in st.session_state:
+    st.session_state.search_version = 0
+if 'results_page' not in st.session_state:
+    st.session_state.results_page = 0
+if 'results_view' not in st.session_state:
+    st.session_state.results_view = None
+if 'summary_error' not in st.session_state:
+    st.session_state.summary_error = None
+if 'mind_map_error' not in st.session_state:
+    st.session_state.mind_map_error = None
+# The page size widget lives in the results fragment; re-assigning its key keeps the value
+# in runs where no results are drawn
+st.session_state.page_size = st.session_state.get('page_size', 10)
+
+
+# ============================================================================
+# Shared Resources
+# ============================================================================
+@st.cache_resource(show_spinner=False)
+def get_kg_cache() -> KnowledgeGraphCache:
+    """Кэш графов знаний на диске, общий для процесса; при старте поднимается в память."""
+    cache = KnowledgeGraphCache(path=os.environ.get("RAGFLOW_KG_CACHE_PATH", "knowledge_graph_cache.sqlite"))
+    cache.load()
+    return cache
+
+
+@st.cache_resource(show_spinner=False)
+def get_history_store() -> HistoryStore:
+    """История поисков на диске, общая для процесса."""
+    return HistoryStore(path=os.environ.get("RAGFLOW_HISTORY_PATH", "query_history.sqlite"))
+
+
+@st.cache_resource(show_spinner=False)
+def get_dataset_catalog(ragflow_url: str, api_key: str, _client) -> DatasetCatalog:
+    """Каталог датасетов, общий для всех сессий с тем же подключением; обновляется в фоне."""
+    catalog = DatasetCatalog(_client, refresh_interval=300.0)
+    # A failed first load raises, so nothing is cached for wrong credentials
+    catalog.refresh()
+    catalog.start()
+    return catalog
 
 
 # ============================================================================
 # Sidebar - Configuration
 # ============================================================================
-with st.sidebar:
+def connect(ragflow_url: str, api_key: str):
+    """Подключается к RAGFlow через общий клиент и загружает каталог датасетов."""
+    # One client per (URL, key) for the whole process: sessions share its pools and caches,
+    # and identical concurrent requests from different users go upstream once
+    client = get_shared_client(
+        ragflow_url,
+        api_key,
+        cache=RetrievalCache(),
+        superset_cache=SupersetCache(over_fetch_factor=2.0),
+        # The client serves every browser session and RAGFlow feeds a chat session's history into
+        # later answers, so each pooled session answers one question; the pool refills in the background
+        session_pool_size=4,
+        session_max_turns=1,
+        metrics=ClientMetrics(),
+        kg_cache=get_kg_cache(),
+        hedging=HedgePolicy()
+    )
+    st.session_state.catalog = get_dataset_catalog(ragflow_url, api_key, client)
+    st.session_state.client = client
+    st.session_state.connected = True
+
+
+def mark_results_stale():
+    st.session_state.results_stale = True
+
+
+@st.fragment
+def render_sidebar():
+    """
+    Настройки в боковой панели.
+    
+    Фрагмент перезапускается отдельно от страницы; всё приложение
+    перезапускается только после подключения и при изменении параметров,
+    от которых зависит уже показанная выдача.
+    """
     st.markdown("## ⚙️ Настройки подключения")
     
     ragflow_url = st.text_input(
@@ -262,154 +361,336 @@ with st.sidebar:
     if st.button("🔌 Подключиться", use_container_width=True):
         if ragflow_url and api_key:
             try:
-                client = RAGFlowClient(ragflow_url, api_key)
-                datasets = client.list_datasets()
-                st.session_state.client = client
-                st.session_state.connected = True
-                st.session_state.datasets = datasets
-                st.success("✅ Подключено!")
+                connect(ragflow_url, api_key)
+            # Not only RAGFlowError: a malformed URL fails in requests or urllib3 before any request is sent
             except Exception as e:
                 st.error(f"❌ Ошибка: {str(e)}")
+            else:
+                st.rerun()
     
     # Advanced Settings
     if st.session_state.connected:
+        catalog = st.session_state.catalog
+        st.success(f"✅ Подключено: {len(catalog)} датасетов")
         st.markdown("---")
         st.markdown("## 🚀 Продвинутые функции")
         
-        use_rerank = st.checkbox("🔄 Включить Rerank", value=False)
-        rerank_id = st.text_input("🆔 Rerank Model ID", help="ID модели переранжирования из вашего профиля") if use_rerank else None
+        if st.checkbox("🔄 Включить Rerank", value=False, key="use_rerank"):
+            st.text_input("🆔 Rerank Model ID", help="ID модели переранжирования из вашего профиля", key="rerank_id")
         
-        use_summary = st.checkbox("🤖 ИИ-резюме", value=False)
-        assistant_id = st.text_input("🤖 Assistant ID", help="ID ассистента для генерации резюме") if use_summary else None
+        if st.checkbox("🤖 ИИ-резюме", value=False, key="use_summary"):
+            st.text_input("🤖 Assistant ID", help="ID ассистента для генерации резюме", key="assistant_id")
         
-        use_kg_search = st.checkbox("🕸️ Связный поиск (KG)", value=False, help="Использовать Knowledge Graph")
-        show_mind_map = st.checkbox("🗺️ Показать Mind Map", value=False)
+        st.checkbox("🕸️ Связный поиск (KG)", value=False, help="Использовать Knowledge Graph", key="use_kg_search")
+        st.checkbox("🗺️ Показать Mind Map", value=False, key="show_mind_map")
 
         st.markdown("---")
         st.markdown("## 📚 Выбор датасетов")
-        dataset_options = {d.get('name', d.get('id')): d.get('id') for d in st.session_state.datasets}
+        dataset_options = {d.name: d.id for d in catalog.datasets}
         selected_datasets = st.multiselect("Датасеты", options=list(dataset_options.keys()), default=list(dataset_options.keys())[:1] if dataset_options else [])
         st.session_state.selected_dataset_ids = [dataset_options[name] for name in selected_datasets]
+        if st.session_state.selected_dataset_ids:
+            estimate = catalog.estimate(st.session_state.selected_dataset_ids)
+            st.caption(f"📦 {estimate.chunk_count:,} чанков в {estimate.document_count:,} документах".replace(",", " "))
+            for warning in estimate.warnings:
+                st.warning(f"⚠️ {warning}")
+        if catalog.last_error:
+            st.caption(f"⚠️ Список датасетов не обновился: {catalog.last_error}")
 
     # Search parameters
     st.markdown("---")
     st.markdown("## 🎛️ Параметры поиска")
-    top_k = st.slider("📊 Top K", 1, 50, 5)
-    similarity_threshold = st.slider("🎯 Порог", 0.0, 1.0, 0.2, 0.05)
-    vector_weight = st.slider("⚖️ Вес вектора", 0.0, 1.0, 0.3, 0.1)
-    use_highlight = st.checkbox("✨ Подсветка", value=True)
-    use_keyword = st.checkbox("🔤 Ключевые слова", value=False)
+    # These also change the results on screen (re-scored, filtered and cut locally), so moving them redraws the page
+    st.slider("📊 Top K", 1, 50, 5, key="top_k", on_change=mark_results_stale)
+    st.slider("🎯 Порог", 0.0, 1.0, 0.2, 0.05, key="similarity_threshold", on_change=mark_results_stale)
+    st.slider("⚖️ Вес вектора", 0.0, 1.0, 0.3, 0.1, key="vector_weight", on_change=mark_results_stale)
+    st.checkbox("✨ Подсветка", value=True, key="use_highlight", on_change=mark_results_stale)
+    st.checkbox("🔤 Ключевые слова", value=False, key="use_keyword")
+    
+    if st.session_state.pop("results_stale", False) and st.session_state.search_results:
+        st.rerun()
+
+
+with st.sidebar:
+    render_sidebar()
 
 
 # ============================================================================
-# Main Content
+# Rendering Helpers
 # ============================================================================
-st.markdown("<h1 class='main-header'>🔍 RAGFlow Advanced Search</h1>", unsafe_allow_html=True)
+def render_summary(slot):
+    """Панель ИИ-резюме: ответ ассистента или ошибка его получения."""
+    with slot.container():
+        if st.session_state.summary_error:
+            st.markdown("### 🤖 ИИ-резюме")
+            st.warning(f"⚠️ Не удалось получить резюме: {st.session_state.summary_error}")
+        elif st.session_state.ai_summary:
+            st.markdown("### 🤖 ИИ-резюме")
+            st.info(st.session_state.ai_summary)
 
-# Search input
-col1, col2 = st.columns([5, 1])
-with col1:
-    query = st.text_input("Запрос", label_visibility="collapsed")
-with col2:
-    search_clicked = st.button("🔎 Искать", use_container_width=True, type="primary")
 
-if search_clicked and query:
-    if not st.session_state.connected:
-        st.error("❌ Подключитесь в боковой панели")
-    elif not st.session_state.selected_dataset_ids:
-        st.error("❌ Выберите датасет")
+def render_summary_stream(slot, partial_answer: str):
+    """Панель ИИ-резюме, пока ответ ещё генерируется."""
+    with slot.container():
+        st.markdown("### 🤖 ИИ-резюме")
+        st.info(partial_answer + " ▌")
+
+
+def stream_summary(client, assistant_id: str, question: str, deltas: queue.Queue, cancel_event: threading.Event) -> str:
+    """Читает потоковое резюме в фоновом потоке и передаёт накопленный текст в очередь."""
+    answer = ""
+    for delta in client.stream_ai_summary(assistant_id, question, cancel_event=cancel_event):
+        answer = delta.answer
+        deltas.put(answer)
+    return answer
+
+
+def timed_search(client, **params):
+    """Выполняет поиск и возвращает чанки вместе с разбивкой времени по фазам."""
+    with capture_calls() as calls:
+        chunks = client.search(**params)
+    return chunks, calls[-1] if calls else None
+
+
+def render_diagnostics():
+    """Разбивка времени последнего поиска по фазам и задержки всех поисков общего клиента."""
+    timing = st.session_state.search_timing
+    if timing is None:
+        return
+    with st.expander(f"⏱️ Диагностика поиска: {timing.total * 1000:.0f} мс"):
+        rows = [
+            {"Фаза": phase, "мс": round(timing.phases[phase] * 1000, 2)}
+            for phase in PHASES if phase in timing.phases
+        ]
+        rows.append({"Фаза": "other", "мс": round(timing.other * 1000, 2)})
+        st.table(rows)
+        if timing.requests:
+            received = f"получено {timing.response_bytes / 1024:.1f} КБ"
+            if timing.transfer_bytes < timing.response_bytes:
+                received += f" (по сети {timing.transfer_bytes / 1024:.1f} КБ, сжатие ×{timing.compression_ratio:.1f})"
+            st.caption(f"HTTP-запросов: {timing.requests}, {received}")
+        else:
+            st.caption("Ответ получен из кэша без обращения к серверу")
+        
+        metrics = st.session_state.client.metrics if st.session_state.client else None
+        histogram = metrics.call_durations.get(("search", "total")) if metrics else None
+        if histogram is not None and histogram.count:
+            st.caption(
+                f"Поисков через этот сервер: {histogram.count}, "
+                f"p50 ≤ {histogram.quantile(0.5) * 1000:.0f} мс, p95 ≤ {histogram.quantile(0.95) * 1000:.0f} мс"
+            )
+        hedging = st.session_state.client.hedging if st.session_state.client else None
+        if hedging is not None and hedging.stats.hedged:
+            st.caption(
+                f"Продублировано медленных запросов: {hedging.stats.hedged}, "
+                f"дубль ответил первым в {hedging.stats.win_rate:.0%} случаев"
+            )
+
+
+# Children shown per mind map node; the rest are summarized in a caption
+MIND_MAP_PAGE = 50
+
+
+def load_mind_map(client, dataset_id: str, version) -> MindMapIndex:
+    """Загружает ментальную карту и строит её индекс в рабочем потоке."""
+    graph = client.get_mind_map(dataset_id, version)
+    mind_map = graph.get("mind_map") if graph else None
+    return MindMapIndex.from_mind_map(mind_map) if mind_map else None
+
+
+def toggle_mind_map_node(index: int):
+    expanded = st.session_state.mind_map_expanded
+    if index in expanded:
+        expanded.discard(index)
     else:
-        with st.spinner("🔄 Получение данных..."):
-            try:
-                # 1. Retrieval
-                chunks = st.session_state.client.search(
-                    question=query,
-                    dataset_ids=st.session_state.selected_dataset_ids,
-                    top_k=top_k,
-                    similarity_threshold=similarity_threshold,
-                    vector_similarity_weight=vector_weight,
-                    highlight=use_highlight,
-                    keyword=use_keyword,
-                    use_kg=use_kg_search,
-                    rerank_id=rerank_id
-                )
-                st.session_state.search_results = chunks
-                st.session_state.last_query = query
-                
-                # 2. AI Summary
-                if use_summary and assistant_id:
-                    summary_resp = st.session_state.client.get_ai_summary(assistant_id, query)
-                    st.session_state.ai_summary = summary_resp.get("data", {}).get("answer", "")
-                else:
-                    st.session_state.ai_summary = ""
-                
-                # 3. Mind Map
-                if show_mind_map:
-                    # Get for the first dataset
-                    kg_data = st.session_state.client.get_mind_map(st.session_state.selected_dataset_ids[0])
-                    st.session_state.mind_map = kg_data.get("mind_map")
-                else:
-                    st.session_state.mind_map = None
-                    
-            except Exception as e:
-                st.error(f"❌ Ошибка: {str(e)}")
+        expanded.add(index)
 
-# Display Results
-if st.session_state.search_results:
-    # 1. AI Summary Section
-    if st.session_state.ai_summary:
-        st.markdown("### 🤖 ИИ-резюме")
-        st.info(st.session_state.ai_summary)
-    
-    # 2. Mind Map Section
-    if st.session_state.mind_map:
+
+def reveal_mind_map_node(index: int):
+    """Раскрывает путь к найденному узлу."""
+    st.session_state.mind_map_expanded.update(node.index for node in st.session_state.mind_map.path(index))
+
+
+def render_mind_map_level(mind_map: MindMapIndex, parent: int):
+    """Дети узла; глубже отрисовываются только раскрытые узлы."""
+    expanded = st.session_state.mind_map_expanded
+    children = mind_map.children(parent)
+    indent = "\u2003" * mind_map.nodes[parent].depth
+    for node in children[:MIND_MAP_PAGE]:
+        if node.children:
+            marker = "▾" if node.index in expanded else "▸"
+            st.button(
+                f"{indent}{marker} {node.label} ({len(node.children)})",
+                key=f"mind_map_node_{node.index}",
+                on_click=toggle_mind_map_node,
+                args=(node.index,)
+            )
+            if node.index in expanded:
+                render_mind_map_level(mind_map, node.index)
+        else:
+            st.text(f"{indent}• {node.label}")
+    if len(children) > MIND_MAP_PAGE:
+        st.caption(f"{indent}… ещё {len(children) - MIND_MAP_PAGE} узлов")
+
+
+@st.fragment
+def mind_map_panel():
+    """Панель Mind Map: дерево с раскрытием по требованию и поиском по узлам, или ошибка загрузки."""
+    mind_map = st.session_state.mind_map
+    if st.session_state.mind_map_error:
+        st.markdown("### 🗺️ Mind Map")
+        st.warning(f"⚠️ Не удалось загрузить Mind Map: {st.session_state.mind_map_error}")
+    elif mind_map:
         st.markdown("### 🗺️ Mind Map")
-        with st.expander("Показать структуру ментальной карты"):
-            st.json(st.session_state.mind_map)
+        with st.expander(
+            f"Структура ментальной карты: {len(mind_map)} узлов",
+            expanded=bool(st.session_state.mind_map_expanded)
+        ):
+            st.caption("Узлов по уровням: " + " · ".join(
+                f"{depth}: {count}" for depth, count in enumerate(mind_map.depth_counts)
+            ))
+            term = st.text_input("🔎 Поиск по узлам", key="mind_map_search")
+            if term:
+                matches = mind_map.search(term, limit=20)
+                for node in matches:
+                    st.button(
+                        " › ".join(n.label for n in mind_map.path(node.index)[1:] or [node]),
+                        key=f"mind_map_match_{node.index}",
+                        on_click=reveal_mind_map_node,
+                        args=(node.index,)
+                    )
+                if not matches:
+                    st.caption("Узлы не найдены")
+            st.markdown(f"**{mind_map.root.label}**")
+            render_mind_map_level(mind_map, 0)
 
-    # 3. Stats
+
+def render_mind_map(slot):
+    # Expanding nodes and searching rerun only the fragment, not the page
+    with slot.container():
+        mind_map_panel()
+
+
+def results_view() -> dict:
+    """
+    Отображаемая выдача и её статистика.
+    
+    Вес вектора, порог и top_k применяются к полученным чанкам локально.
+    Пересчитывается только при новой выдаче или смене этих параметров,
+    а не на каждом перезапуске скрипта.
+    """
+    state = st.session_state
+    vector_weight = state.vector_weight
+    key = (state.search_version, vector_weight, state.similarity_threshold, state.top_k)
+    view = st.session_state.results_view
+    if view is not None and view["key"] == key:
+        return view
+    
+    results = st.session_state.search_results
+    rescored = (
+        bool(results)
+        and not st.session_state.search_reranked
+        and st.session_state.search_weight is not None
+        and vector_weight != st.session_state.search_weight
+    )
+    if rescored:
+        # Only the vector weight moved: re-score the fetched chunks locally instead of asking RAGFlow again
+        results = rescore_chunks(results, vector_weight, state.similarity_threshold, state.top_k)
+    else:
+        # A higher threshold or a lower Top K only narrows what was fetched
+        results = [c for c in results if c.similarity >= state.similarity_threshold][:state.top_k]
+    
+    # A lower threshold or a higher Top K needs chunks the search didn't fetch
+    limits = state.search_limits
+    widened = limits is not None and (state.top_k > limits[0] or state.similarity_threshold < limits[1])
+    view = {"key": key, "results": results, "rescored": rescored, "widened": widened}
+    if results:
+        similarities = [c.similarity for c in results]
+        view["avg_sim"] = sum(similarities) / len(similarities)
+        view["max_sim"] = max(similarities)
+        view["unique_docs"] = len({c.document_name for c in results})
+    st.session_state.results_view = view
+    return view
+
+
+def set_results_page(page: int):
+    st.session_state.results_page = page
+
+
+@st.fragment
+def results_panel(show_empty: bool):
+    """
+    Статистика и постраничные карточки найденных чанков.
+    
+    Листание страниц, размер страницы и подробности чанка перезапускают
+    только этот фрагмент.
+    """
+    view = results_view()
+    results = view["results"]
+    
+    if st.session_state.search_error:
+        st.error(f"❌ Ошибка: {st.session_state.search_error}")
+        return
+    
+    if not results:
+        if show_empty:
+            st.markdown("""
+            <div class="empty-state">
+                <div class="empty-state-icon">🔍</div>
+                <h3>Ничего не найдено</h3>
+                <p>Попробуйте изменить запрос или снизить порог схожести</p>
+            </div>
+            """, unsafe_allow_html=True)
+        return
+    
+    # Stats
     st.markdown("---")
+    if view["rescored"]:
+        st.caption(f"⚖️ Оценки пересчитаны локально для веса вектора {st.session_state.vector_weight:.1f}")
+    if view["widened"]:
+        st.caption("🔁 Порог ниже или Top K больше, чем при поиске: чтобы увидеть дополнительные чанки, повторите поиск")
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.markdown(f"""
         <div class="stat-card">
-            <div class="stat-value">{len(st.session_state.search_results)}</div>
+            <div class="stat-value">{len(results)}</div>
             <div class="stat-label">Найдено чанков</div>
         </div>
         """, unsafe_allow_html=True)
     
     with col2:
-        avg_sim = sum(c.similarity for c in st.session_state.search_results) / len(st.session_state.search_results) if st.session_state.search_results else 0
         st.markdown(f"""
         <div class="stat-card">
-            <div class="stat-value">{avg_sim:.1%}</div>
+            <div class="stat-value">{view["avg_sim"]:.1%}</div>
             <div class="stat-label">Средняя схожесть</div>
         </div>
         """, unsafe_allow_html=True)
     
     with col3:
-        max_sim = max(c.similarity for c in st.session_state.search_results) if st.session_state.search_results else 0
         st.markdown(f"""
         <div class="stat-card">
-            <div class="stat-value">{max_sim:.1%}</div>
+            <div class="stat-value">{view["max_sim"]:.1%}</div>
             <div class="stat-label">Макс. схожесть</div>
         </div>
         """, unsafe_allow_html=True)
     
     with col4:
-        unique_docs = len(set(c.document_name for c in st.session_state.search_results))
         st.markdown(f"""
         <div class="stat-card">
-            <div class="stat-value">{unique_docs}</div>
+            <div class="stat-value">{view["unique_docs"]}</div>
             <div class="stat-label">Документов</div>
         </div>
         """, unsafe_allow_html=True)
-
-    # 4. Chunks
-    for i, chunk in enumerate(st.session_state.search_results, 1):
+    
+    # Chunks: only the current page is sent to the browser
+    page_size = st.select_slider("📄 Чанков на странице", options=[5, 10, 20, 50], key="page_size")
+    pages = (len(results) - 1) // page_size + 1
+    page = min(st.session_state.results_page, pages - 1)
+    first = page * page_size
+    for i, chunk in enumerate(results[first:first + page_size], first + 1):
         badge_class = "" if chunk.similarity >= 0.7 else "medium" if chunk.similarity >= 0.4 else "low"
-        display_content = chunk.highlight if chunk.highlight and use_highlight else chunk.content
+        display_content = chunk.highlight if chunk.highlight and st.session_state.use_highlight else chunk.content
         st.markdown(f"""
         <div class="chunk-card">
             <div class="chunk-header">
@@ -420,8 +701,10 @@ if st.session_state.search_results:
         </div>
         """, unsafe_allow_html=True)
         
-        # Expander for raw data
-        with st.expander(f"📋 Подробности чанка #{i}"):
+        # Raw data is rendered only while the toggle is on; widget keys follow the search and the chunk,
+        # so a new search, page or re-scored order never shows another chunk's state
+        widget_id = f"{st.session_state.search_version}_{i}_{chunk.chunk_id}"
+        if st.toggle(f"📋 Подробности чанка #{i}", key=f"details_{widget_id}"):
             st.json({
                 "chunk_id": chunk.chunk_id,
                 "document_id": chunk.document_id,
@@ -431,28 +714,236 @@ if st.session_state.search_results:
                 "term_similarity": chunk.term_similarity,
                 "content_length": len(chunk.content)
             })
-            st.text_area("Полный текст", chunk.content, height=150, key=f"content_{i}")
-
-elif query and search_clicked:
-    st.markdown("""
-    <div class="empty-state">
-        <div class="empty-state-icon">🔍</div>
-        <h3>Ничего не найдено</h3>
-        <p>Попробуйте изменить запрос или снизить порог схожести</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-elif not st.session_state.connected:
-    st.info("👈 Настройте подключение к RAGFlow в боковой панели")
-
-else:
-    st.markdown("""
-    <div class="empty-state">
-        <div class="empty-state-icon">💡</div>
-        <h3>Готово к поиску</h3>
-        <p>Введите запрос и нажмите "Искать" для получения семантически близких чанков</p>
-    </div>
-    """, unsafe_allow_html=True)
+            st.text_area("Полный текст", chunk.content, height=150, key=f"content_{widget_id}")
+    
+    if pages > 1:
+        prev_col, page_col, next_col = st.columns([1, 3, 1])
+        with prev_col:
+            st.button("← Назад", key="results_prev", disabled=page == 0,
+                      on_click=set_results_page, args=(page - 1,), use_container_width=True)
+        with page_col:
+            st.markdown(
+                f"<div style='text-align: center;'>Страница {page + 1} из {pages} "
+                f"(чанки {first + 1}–{min(first + page_size, len(results))})</div>",
+                unsafe_allow_html=True
+            )
+        with next_col:
+            st.button("Вперёд →", key="results_next", disabled=page >= pages - 1,
+                      on_click=set_results_page, args=(page + 1,), use_container_width=True)
+    
+    render_diagnostics()
+
+
+def render_results(slot, show_empty: bool = False):
+    with slot.container():
+        results_panel(show_empty)
+
+
+# ============================================================================
+# Main Content
+# ============================================================================
+st.markdown("<h1 class='main-header'>🔍 RAGFlow Advanced Search</h1>", unsafe_allow_html=True)
+
+
+
+@st.fragment
+def render_search_bar():
+    """Строка поиска: набор запроса не перезапускает страницу, кнопка запускает поиск целиком."""
+    col1, col2 = st.columns([5, 1])
+    with col1:
+        st.text_input("Запрос", label_visibility="collapsed", key="query")
+    with col2:
+        if st.button("🔎 Искать", use_container_width=True, type="primary"):
+            st.session_state.search_requested = True
+            st.rerun()
+
+
+def open_history_entry(entry_id: int):
+    """Показывает сохранённый поиск из истории, не обращаясь к RAGFlow."""
+    entry = get_history_store().load(entry_id)
+    if entry is None:
+        return
+    st.session_state.search_results = entry.chunks
+    st.session_state.ai_summary = entry.summary
+    st.session_state.last_query = entry.question
+    st.session_state.search_timing = None
+    st.session_state.search_version += 1
+    st.session_state.results_page = 0
+    st.session_state.search_weight = entry.params.get("vector_similarity_weight")
+    st.session_state.search_reranked = bool(entry.params.get("rerank_id"))
+    st.session_state.search_limits = (entry.params.get("top_k", 0), entry.params.get("similarity_threshold", 0.0))
+    st.session_state.mind_map = None
+    st.session_state.search_error = None
+    st.session_state.summary_error = None
+    st.session_state.mind_map_error = None
+
+
+@st.fragment
+def render_history():
+    """История поиска: полнотекстовый поиск по прошлым вопросам и найденным чанкам."""
+    with st.expander("🕘 История поиска"):
+        history = get_history_store()
+        text = st.text_input("Поиск по истории", key="history_search", placeholder="Слова из вопроса или чанков")
+        matches = history.search(text, limit=10) if text.strip() else history.recent(limit=10)
+        if not matches:
+            st.caption("Ничего не найдено" if text.strip() else "История пуста")
+        for match in matches:
+            label = f"{time.strftime('%d.%m %H:%M', time.localtime(match.created_at))} · {match.question} ({match.chunk_count})"
+            if st.button(label, key=f"history_{match.id}", use_container_width=True):
+                open_history_entry(match.id)
+                st.rerun()
+            if match.snippet:
+                st.caption(match.snippet)
+
+
+render_search_bar()
+render_history()
+query = st.session_state.get("query", "")
+search_clicked = st.session_state.pop("search_requested", False)
+
+# Result panels are laid out up front so each one can be filled as soon as its request returns
+summary_slot = st.empty()
+mind_map_slot = st.empty()
+results_slot = st.empty()
+rendered_panels = set()
+
+
+def render_panel(panel: str, result):
+    """Сохраняет результат запроса панели в состоянии сессии и отрисовывает её."""
+    if panel == "search":
+        st.session_state.search_results, st.session_state.search_timing = result or ([], None)
+        st.session_state.search_version += 1
+        st.session_state.results_page = 0
+        st.session_state.search_weight = st.session_state.vector_weight
+        st.session_state.search_reranked = bool(rerank_id)
+        st.session_state.search_limits = (st.session_state.top_k, st.session_state.similarity_threshold)
+        render_results(results_slot, show_empty=True)
+    elif panel == "summary":
+        st.session_state.ai_summary = result or ""
+        render_summary(summary_slot)
+    else:
+        st.session_state.mind_map = result
+        st.session_state.mind_map_expanded = set()
+        render_mind_map(mind_map_slot)
+    rendered_panels.add(panel)
+
+
+if search_clicked and query:
+    if not st.session_state.connected:
+        st.error("❌ Подключитесь в боковой панели")
+    elif not st.session_state.selected_dataset_ids:
+        st.error("❌ Выберите датасет")
+    else:
+        client = st.session_state.client
+        dataset_ids = st.session_state.selected_dataset_ids
+        settings = st.session_state
+        rerank_id = settings.get("rerank_id") if settings.use_rerank else None
+        assistant_id = settings.get("assistant_id") if settings.use_summary else None
+        st.session_state.last_query = query
+        st.session_state.search_error = None
+        st.session_state.summary_error = None
+        st.session_state.mind_map_error = None
+        
+        # Retrieval, AI summary and mind map don't depend on each other, so run them in parallel
+        executor = ThreadPoolExecutor(max_workers=3)
+        summary_deltas = queue.Queue()
+        # Set when this run ends, including a rerun triggered by a new query, so the stream is dropped
+        cancel_summary = threading.Event()
+        try:
+            futures = {
+                executor.submit(
+                    timed_search,
+                    client,
+                    question=query,
+                    dataset_ids=dataset_ids,
+                    top_k=settings.top_k,
+                    similarity_threshold=settings.similarity_threshold,
+                    vector_similarity_weight=settings.vector_weight,
+                    highlight=settings.use_highlight,
+                    keyword=settings.use_keyword,
+                    use_kg=settings.use_kg_search,
+                    rerank_id=rerank_id
+                ): "search"
+            }
+            results_slot.info("🔄 Поиск чанков...")
+            
+            if assistant_id:
+                futures[executor.submit(
+                    stream_summary, client, assistant_id, query, summary_deltas, cancel_summary
+                )] = "summary"
+                summary_slot.info("🤖 Генерация ИИ-резюме...")
+            else:
+                st.session_state.ai_summary = ""
+            
+            if settings.show_mind_map:
+                # Get for the first dataset; its update_time tells whether the cached graph is still current
+                dataset = st.session_state.catalog.get(dataset_ids[0])
+                futures[executor.submit(
+                    load_mind_map, client, dataset_ids[0], dataset.update_time if dataset else None
+                )] = "mind_map"
+                mind_map_slot.info("🗺️ Загрузка Mind Map...")
+            else:
+                st.session_state.mind_map = None
+            
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                
+                # Show whatever part of the summary has streamed in so far
+                partial_answer = None
+                while not summary_deltas.empty():
+                    partial_answer = summary_deltas.get_nowait()
+                if partial_answer and "summary" not in rendered_panels:
+                    render_summary_stream(summary_slot, partial_answer)
+                
+                for future in done:
+                    panel = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = None
+                        st.session_state[f"{panel}_error"] = str(e)
+                    render_panel(panel, result)
+            
+            if not st.session_state.search_error:
+                # Written by a background thread, so the history doesn't delay the page
+                get_history_store().record(HistoryEntry(
+                    question=query,
+                    dataset_ids=list(dataset_ids),
+                    params={
+                        "top_k": settings.top_k,
+                        "similarity_threshold": settings.similarity_threshold,
+                        "vector_similarity_weight": settings.vector_weight,
+                        "highlight": settings.use_highlight,
+                        "keyword": settings.use_keyword,
+                        "use_kg": settings.use_kg_search,
+                        "rerank_id": rerank_id
+                    },
+                    chunks=st.session_state.search_results,
+                    summary=st.session_state.ai_summary
+                ))
+        finally:
+            cancel_summary.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# Display Results
+if "summary" not in rendered_panels:
+    render_summary(summary_slot)
+if "mind_map" not in rendered_panels:
+    render_mind_map(mind_map_slot)
+if "search" not in rendered_panels:
+    if st.session_state.search_results or st.session_state.search_error:
+        render_results(results_slot)
+    elif not st.session_state.connected:
+        results_slot.info("👈 Настройте подключение к RAGFlow в боковой панели")
+    else:
+        results_slot.markdown("""
+        <div class="empty-state">
+            <div class="empty-state-icon">💡</div>
+            <h3>Готово к поиску</h3>
+            <p>Введите запрос и нажмите "Искать" для получения семантически близких чанков</p>
+        </div>
+        """, unsafe_allow_html=True)
 
 
 # ============================================================================
@@ -0,0 +1,245 @@
+"""
+RAGFlow Batch Search
+Пакетный прогон запросов через RAGFlowClient.search для оценки релевантности и прогрева кэша.
+
+Пример:
+    python batch_search.py questions.jsonl results.jsonl --datasets id1,id2 --concurrency 16 --rps 50
+    python batch_search.py questions.jsonl results.jsonl --datasets id1,id2 --parquet export/
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict
+from typing import Iterator, Optional
+
+from ragflow_client import (
+    AdmissionController,
+    AdmissionLimit,
+    Priority,
+    RAGFlowClient,
+    RAGFlowError,
+    RetrievalCache,
+    request_priority,
+)
+
+
+def _parse_bool(value: str) -> bool:
+    if value.strip().lower() in ("1", "true", "yes", "y", "on"):
+        return True
+    if value.strip().lower() in ("0", "false", "no", "n", "off"):
+        return False
+    raise ValueError(f"Not a boolean: {value!r}")
+
+
+# Search parameter -> parser for overrides given as strings (every CSV column is a string)
+OVERRIDE_PARSERS = {
+    "dataset_ids": lambda value: [d.strip() for d in value.split(",") if d.strip()],
+    "top_k": int,
+    "similarity_threshold": float,
+    "vector_similarity_weight": float,
+    "rerank_id": str,
+    "use_kg": _parse_bool,
+    "keyword": _parse_bool,
+    "highlight": _parse_bool,
+}
+
+
+def read_questions(path: str) -> Iterator[dict]:
+    """
+    Читает запросы из JSONL или CSV.
+
+    Каждая запись должна содержать поле `question`; поле `id` необязательно
+    (по умолчанию используется номер строки). Поля `dataset_ids`, `top_k` и
+    другие параметры поиска переопределяют их для отдельного запроса; строковые
+    значения (все значения CSV) приводятся к типу параметра, `dataset_ids`
+    в строке перечисляются через запятую.
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+
+        for line_no, record in enumerate(records, 1):
+            if not record.get("question"):
+                continue
+            record.setdefault("id", str(line_no))
+            record["id"] = str(record["id"])
+            yield record
+
+
+def completed_ids(path: str) -> set[str]:
+    """
+    ID запросов, уже успешно записанных в файл результатов.
+
+    Запросы, завершившиеся ошибкой, при продолжении выполняются снова;
+    при чтении результатов актуальна последняя строка для каждого ID.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be cut off by a crash; that query is simply re-run
+                continue
+            if not record.get("error"):
+                done.add(str(record.get("id")))
+    return done
+
+
+def terminate_partial_line(path: str) -> None:
+    """Дописывает перевод строки, если файл оборван посреди записи."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def run_query(client: RAGFlowClient, record: dict, defaults: dict) -> dict:
+    """Выполняет один запрос и возвращает строку результата."""
+    started = time.perf_counter()
+    result = {"id": record["id"], "question": record["question"]}
+    params = dict(defaults)
+    try:
+        for name, value in record.items():
+            if name in defaults and value not in (None, ""):
+                params[name] = OVERRIDE_PARSERS[name](value) if isinstance(value, str) else value
+    except ValueError as e:
+        result["chunks"] = []
+        result["error"] = f"Invalid search parameter: {e}"
+        result["elapsed"] = 0.0
+        return result
+
+    try:
+        with request_priority(Priority.BATCH):
+            chunks = client.search(question=record["question"], **params)
+        result["chunks"] = chunks
+        result["error"] = None
+    except RAGFlowError as e:
+        result["chunks"] = []
+        result["error"] = str(e)
+    result["elapsed"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Пакетный прогон запросов через RAGFlow retrieval.")
+    parser.add_argument("input", help="Файл с запросами (.jsonl или .csv)")
+    parser.add_argument("output", help="Файл результатов (.jsonl), дописывается и используется для продолжения")
+    parser.add_argument("--url", default=os.environ.get("RAGFLOW_URL", "http://localhost:9380"), help="URL RAGFlow")
+    parser.add_argument("--api-key", default=os.environ.get("RAGFLOW_API_KEY"), help="API ключ (или RAGFLOW_API_KEY)")
+    parser.add_argument("--datasets", required=True, help="ID датасетов через запятую")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--vector-weight", type=float, default=0.3)
+    parser.add_argument("--rerank-id", default=None)
+    parser.add_argument("--use-kg", action="store_true")
+    parser.add_argument("--keyword", action="store_true")
+    parser.add_argument("--no-highlight", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=8, help="Одновременных запросов")
+    parser.add_argument("--rps", type=float, default=None, help="Максимум запросов в секунду")
+    parser.add_argument("--cache-path", default=None, help="SQLite-файл RetrievalCache для прогрева")
+    parser.add_argument("--cache-ttl", type=float, default=86400.0, help="Время жизни записей кэша в секундах")
+    parser.add_argument("--parquet", default=None, help="Каталог для выгрузки выдачи в Parquet (нужен pyarrow)")
+    parser.add_argument(
+        "--parquet-content", choices=("string", "dictionary"), default="string",
+        help="Кодирование content в Parquet-выгрузке"
+    )
+    parser.add_argument("--report-every", type=float, default=5.0, help="Интервал отчёта о прогрессе в секундах")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    if not args.api_key:
+        print("❌ API ключ не задан (--api-key или RAGFLOW_API_KEY)", file=sys.stderr)
+        return 2
+
+    defaults = {
+        "dataset_ids": [d.strip() for d in args.datasets.split(",") if d.strip()],
+        "top_k": args.top_k,
+        "similarity_threshold": args.threshold,
+        "vector_similarity_weight": args.vector_weight,
+        "rerank_id": args.rerank_id,
+        "use_kg": args.use_kg,
+        "keyword": args.keyword,
+        "highlight": not args.no_highlight,
+    }
+    cache = RetrievalCache(max_entries=args.concurrency * 4, ttl=args.cache_ttl, path=args.cache_path) if args.cache_path else None
+    # Paces retrieval at --rps; batch queries wait for a slot as long as it takes
+    admission = AdmissionController(
+        {"retrieval": AdmissionLimit(rate=args.rps, burst=1, concurrency=args.concurrency, max_queue=args.concurrency)},
+        max_wait={Priority.BATCH: None}
+    )
+    client = RAGFlowClient(args.url, args.api_key, pool_size=args.concurrency, cache=cache, admission=admission)
+    exporter = None
+    if args.parquet:
+        from chunk_export import ChunkExporter
+        exporter = ChunkExporter(args.parquet, content_encoding=args.parquet_content)
+
+    skip = completed_ids(args.output)
+    terminate_partial_line(args.output)
+    if skip:
+        print(f"↩️ Пропускаю {len(skip)} уже выполненных запросов", file=sys.stderr)
+
+    done = errors = 0
+    started = last_report = time.monotonic()
+
+    def report(final: bool = False) -> None:
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(
+            f"{'✅' if final else '⏳'} выполнено {done}, ошибок {errors}, {done / elapsed:.1f} запр/с",
+            file=sys.stderr
+        )
+
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    pending = set()
+    try:
+        with open(args.output, "a", encoding="utf-8") as out:
+            def drain(return_when: str) -> None:
+                nonlocal pending, done, errors, last_report
+                finished, pending = wait(pending, return_when=return_when)
+                for future in finished:
+                    result = future.result()
+                    if exporter is not None and not result["error"]:
+                        exporter.write(result["id"], result["question"], result["chunks"])
+                    result["chunks"] = [asdict(chunk) for chunk in result["chunks"]]
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    done += 1
+                    errors += bool(result["error"])
+                out.flush()
+                if time.monotonic() - last_report >= args.report_every:
+                    last_report = time.monotonic()
+                    report()
+
+            for record in read_questions(args.input):
+                if record["id"] in skip:
+                    continue
+                # Keep the number of queued queries bounded so huge inputs stream through
+                if len(pending) >= args.concurrency * 2:
+                    drain(FIRST_COMPLETED)
+                pending.add(executor.submit(run_query, client, record, defaults))
+
+            drain(ALL_COMPLETED)
+    finally:
+        executor.shutdown(wait=True)
+        client.close()
+        if cache is not None:
+            cache.close()
+
+    report(final=True)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+Mock RAGFlow Server
+Локальная замена эндпоинтов RAGFlow, которые использует RAGFlowClient, с настраиваемой задержкой и размером ответов.
+
+Запуск отдельно:
+    python -m benchmarks.mock_server --port 9390 --latency 0.02 --chunks 50
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class MockConfig:
+    """Параметры имитации сервера."""
+    latency: float = 0.0
+    jitter: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 0.0
+    chunks: int = 30
+    content_size: int = 1000
+    datasets: int = 20
+    mind_map_nodes: int = 200
+    stream_tokens: int = 50
+    token_delay: float = 0.0
+    etags: bool = True
+    compress: bool = False
+
+
+_KG_PATH = re.compile(r"^/api/v1/datasets/([^/]+)/knowledge_graph$")
+_SESSIONS_PATH = re.compile(r"^/api/v1/chats/([^/]+)/sessions$")
+_COMPLETIONS_PATH = re.compile(r"^/api/v1/chats/([^/]+)/sessions/([^/]+)/completions$")
+
+
+def make_chunks(
+    config: MockConfig,
+    dataset_ids: list[str],
+    page_size: int,
+    weight: float,
+    highlight: bool = True
+) -> list[dict]:
+    """Генерирует чанки в формате ответа /api/v1/retrieval, отсортированные по схожести."""
+    count = min(config.chunks, page_size)
+    body = ("lorem ipsum dolor sit amet " * (config.content_size // 27 + 1))[:config.content_size]
+    chunks = []
+    for i in range(count):
+        vector_similarity = 1.0 - i / (count + 1)
+        term_similarity = random.random()
+        dataset_id = dataset_ids[i % len(dataset_ids)] if dataset_ids else "dataset-0"
+        chunk = {
+            "id": f"{dataset_id}-chunk-{i}",
+            "content": body,
+            "content_ltks": body,
+            "document_id": f"doc-{i % 7}",
+            "document_keyword": f"document-{i % 7}.pdf",
+            "docnm_kwd": f"document-{i % 7}.pdf",
+            "kb_id": dataset_id,
+            "image_id": "",
+            "important_keywords": [],
+            "positions": [[1, 0, 0, 0, 0]],
+            "similarity": weight * vector_similarity + (1 - weight) * term_similarity,
+            "vector_similarity": vector_similarity,
+            "term_similarity": term_similarity,
+        }
+        # Like RAGFlow, the highlighted copy of content is only sent when asked for
+        if highlight:
+            chunk["highlight"] = f"<em>{body[:64]}</em>{body[64:]}"
+        chunks.append(chunk)
+    chunks.sort(key=lambda c: c["similarity"], reverse=True)
+    return chunks
+
+
+def make_mind_map(config: MockConfig) -> dict:
+    """Генерирует дерево ментальной карты примерно из `mind_map_nodes` узлов."""
+    root = {"id": "root", "children": []}
+    nodes = [root]
+    for i in range(1, config.mind_map_nodes):
+        parent = nodes[(i - 1) // 4]
+        node = {"id": f"node-{i}", "children": []}
+        parent["children"].append(node)
+        nodes.append(node)
+    return root
+
+
+class MockRAGFlowHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов mock-сервера; конфигурация берётся из server.config."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this Nagle adds ~40 ms per response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def handle(self) -> None:
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the reply: a timed-out attempt or a losing hedge
+            pass
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.config
+
+    def _delay(self) -> None:
+        delay = self.config.latency + random.uniform(0, self.config.jitter)
+        # A share of slow replies imitates a lagging replica behind the load balancer
+        if self.config.slow_rate and random.random() < self.config.slow_rate:
+            delay += self.config.slow_latency
+        if delay > 0:
+            time.sleep(delay)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _send_json(self, obj, status: int = 200, etag: bool = False) -> None:
+        body = json.dumps(obj).encode("utf-8")
+        tag = f'"{hashlib.sha1(body).hexdigest()}"' if etag else None
+        if tag and self.headers.get("If-None-Match") == tag:
+            self.send_response(304)
+            self.send_header("ETag", tag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if self.config.compress and "gzip" in self.headers.get("Accept-Encoding", "") and len(body) > 1024:
+            body = gzip.compress(body, compresslevel=6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        if tag:
+            self.send_header("ETag", tag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self._delay()
+        path = self.path.split("?", 1)[0]
+        if path == "/api/v1/system/health":
+            self._send_json({"code": 0, "data": {"status": "ok"}})
+        elif path == "/api/v1/datasets":
+            query = parse_qs(urlsplit(self.path).query)
+            page = int(query.get("page", ["1"])[0])
+            page_size = int(query.get("page_size", ["30"])[0])
+            datasets = [
+                {"id": f"dataset-{i}", "name": f"Dataset {i}", "chunk_count": 1000 * (i + 1),
+                 "document_count": 10 * (i + 1), "embedding_model": "BAAI/bge-large-zh-v1.5",
+                 "create_time": 1700000000000 + i, "update_time": 1700000000000 + i}
+                for i in range(self.config.datasets)
+            ]
+            if query.get("orderby", [""])[0] == "update_time":
+                datasets.sort(key=lambda d: d["update_time"], reverse=query.get("desc", ["true"])[0] == "true")
+            self._send_json({"code": 0, "data": datasets[(page - 1) * page_size:page * page_size]})
+        elif _KG_PATH.match(path):
+            self._send_json({"code": 0, "data": {"graph": {}, "mind_map": make_mind_map(self.config)}}, etag=self.config.etags)
+        else:
+            self._send_json({"code": 404, "message": "Not found"}, status=404)
+
+    def do_POST(self) -> None:
+        payload = self._read_json()
+        self._delay()
+        path = self.path.split("?", 1)[0]
+        if path == "/api/v1/retrieval":
+            chunks = make_chunks(
+                self.config,
+                payload.get("dataset_ids", []),
+                payload.get("page_size", 30),
+                payload.get("vector_similarity_weight", 0.3),
+                payload.get("highlight", True)
+            )
+            self._send_json({"code": 0, "data": {"chunks": chunks, "doc_aggs": [], "total": len(chunks)}})
+        elif _SESSIONS_PATH.match(path):
+            self._send_json({"code": 0, "data": {"id": uuid.uuid4().hex, "messages": []}})
+        elif _COMPLETIONS_PATH.match(path):
+            if payload.get("stream"):
+                self._stream_answer()
+            else:
+                answer = " ".join(f"token{i}" for i in range(self.config.stream_tokens))
+                self._send_json({"code": 0, "data": {"answer": answer, "reference": {}}})
+        else:
+            self._send_json({"code": 404, "message": "Not found"}, status=404)
+
+    def do_DELETE(self) -> None:
+        self._read_json()
+        self._send_json({"code": 0})
+
+    def _stream_answer(self) -> None:
+        """Отдаёт ответ чата SSE-потоком с накопительным полем answer, как RAGFlow."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        answer = ""
+        for i in range(self.config.stream_tokens):
+            answer += f"token{i} "
+            event = {"code": 0, "data": {"answer": answer, "reference": {}}}
+            self.wfile.write(f"data:{json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if self.config.token_delay:
+                time.sleep(self.config.token_delay)
+        self.wfile.write(f"data:{json.dumps({'code': 0, 'data': True})}\n\n".encode("utf-8"))
+        self.close_connection = True
+
+
+class MockRAGFlowServer:
+    """Mock-сервер RAGFlow в фоновом потоке; используется как контекстный менеджер."""
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self._server = ThreadingHTTPServer((host, port), MockRAGFlowHandler)
+        self._server.daemon_threads = True
+        self._server.config = self.config
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockRAGFlowServer":
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Обслуживает запросы в текущем потоке до прерывания."""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockRAGFlowServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock-сервер RAGFlow для бенчмарков.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9390)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа в секундах")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке в секундах")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Доля медленных ответов")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="Добавка к задержке медленного ответа в секундах")
+    parser.add_argument("--chunks", type=int, default=30, help="Максимум чанков в ответе retrieval")
+    parser.add_argument("--content-size", type=int, default=1000, help="Размер content чанка в символах")
+    parser.add_argument("--compress", action="store_true", help="Сжимать JSON-ответы gzip, если клиент его принимает")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        chunks=args.chunks,
+        content_size=args.content_size,
+        compress=args.compress
+    )
+    server = MockRAGFlowServer(config, args.host, args.port)
+    print(f"Mock RAGFlow listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
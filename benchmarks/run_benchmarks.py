@@ -0,0 +1,239 @@
+"""
+RAGFlow Client Benchmarks
+Замеры задержки (p50/p95/p99) и пропускной способности RAGFlowClient против локального mock-сервера.
+
+Примеры:
+    python -m benchmarks.run_benchmarks --latency 0.005 --output benchmarks/results/latest.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baselines/main.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from benchmarks.mock_server import MockConfig, MockRAGFlowServer, make_chunks
+from ragflow_client import HedgePolicy, RAGFlowClient, _json_loads
+from ragflow_metrics import ClientMetrics
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Перцентиль методом ближайшего ранга по отсортированному списку."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: list[float], wall_time: float) -> dict:
+    """Сводка по задержкам в миллисекундах и пропускной способности."""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "throughput_rps": round(len(values) / wall_time, 2) if wall_time > 0 else 0.0,
+    }
+
+
+def measure(call: Callable[[], object], iterations: int, warmup: int = 3) -> dict:
+    """Последовательно выполняет вызов и замеряет каждую итерацию."""
+    for _ in range(warmup):
+        call()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def measure_concurrent(call: Callable[[], object], workers: int, per_worker: int) -> dict:
+    """Выполняет вызов из нескольких потоков одновременно и замеряет общую картину."""
+    def worker() -> list[float]:
+        latencies = []
+        for _ in range(per_worker):
+            t0 = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - t0)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda _: worker(), range(workers)))
+    wall_time = time.perf_counter() - started
+    return summarize([lat for worker_lats in results for lat in worker_lats], wall_time)
+
+
+def measure_transfer(client: RAGFlowClient, call: Callable[[], object], iterations: int) -> dict:
+    """Замеряет вызов и добавляет средний объём ответа retrieval до и после распаковки."""
+    client.metrics = ClientMetrics()
+    stats = measure(call, iterations)
+    client.metrics, metrics = None, client.metrics
+    requests = max(1, metrics.request_durations[("retrieval", "total")].count)
+    stats["response_bytes"] = metrics.response_bytes.get("retrieval", 0) // requests
+    stats["transfer_bytes"] = metrics.transfer_bytes.get("retrieval", 0) // requests
+    return stats
+
+
+def run_suite(args: argparse.Namespace) -> dict:
+    """Запускает все сценарии и возвращает результаты."""
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        chunks=args.top_k,
+        content_size=args.content_size,
+        compress=args.compress
+    )
+    results = {}
+    with MockRAGFlowServer(config) as server:
+        client = RAGFlowClient(server.url, "benchmark-key", pool_size=args.workers)
+        datasets = ["dataset-0", "dataset-1"]
+
+        results["search"] = measure_transfer(
+            client,
+            lambda: client.search("benchmark question", datasets, top_k=args.top_k),
+            args.iterations
+        )
+        # Ranking-only callers: scores and ids, so the server skips the highlighted copy of content
+        results["search_projected"] = measure_transfer(
+            client,
+            lambda: client.search(
+                "benchmark question", datasets, top_k=args.top_k, fields=("chunk_id", "similarity")
+            ),
+            args.iterations
+        )
+        results["list_datasets"] = measure(client.list_datasets, args.iterations)
+        results["get_mind_map"] = measure(lambda: client.get_mind_map("dataset-0"), args.iterations)
+        results["get_ai_summary"] = measure(
+            lambda: client.get_ai_summary("assistant-0", "benchmark question"),
+            max(1, args.iterations // 4)
+        )
+        results["concurrent_search"] = measure_concurrent(
+            lambda: client.search("benchmark question", datasets, top_k=args.top_k),
+            args.workers,
+            args.iterations // args.workers or 1
+        )
+        client.close()
+
+        hedging = HedgePolicy()
+        hedged = RAGFlowClient(server.url, "benchmark-key", pool_size=args.workers, hedging=hedging)
+        results["search_hedged"] = measure(
+            lambda: hedged.search("benchmark question", datasets, top_k=args.top_k),
+            args.iterations
+        )
+        results["search_hedged"]["hedged"] = hedging.stats.hedged
+        results["search_hedged"]["hedge_wins"] = hedging.stats.hedge_wins
+        hedged.close()
+
+    # Decoding cost is measured without the network on a large synthetic response
+    large = MockConfig(chunks=args.large_chunks, content_size=args.content_size)
+    raw = json.dumps({"code": 0, "data": {"chunks": make_chunks(large, ["dataset-0"], args.large_chunks, 0.3)}}).encode()
+    decoder = RAGFlowClient("http://127.0.0.1:9", "benchmark-key")
+    results["extract_chunks_large"] = measure(
+        lambda: decoder.extract_chunks(_json_loads(raw)),
+        max(1, args.iterations // 4)
+    )
+    results["extract_chunks_large"]["payload_bytes"] = len(raw)
+    results["extract_chunks_projected"] = measure(
+        lambda: decoder.extract_chunks(_json_loads(raw), fields=("chunk_id", "similarity")),
+        max(1, args.iterations // 4)
+    )
+    decoder.close()
+    return results
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Сравнивает результаты с базовой линией.
+
+    Returns:
+        Описания регрессий: рост p95 или падение пропускной способности больше чем на tolerance
+    """
+    regressions = []
+    for name, stats in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if base["p95_ms"] and stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']} → {stats['p95_ms']} ms")
+        if base["throughput_rps"] and stats["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} → {stats['throughput_rps']} rps")
+    return regressions
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарки RAGFlowClient против mock-сервера.")
+    parser.add_argument("--iterations", type=int, default=200, help="Итераций на сценарий")
+    parser.add_argument("--workers", type=int, default=16, help="Потоков в сценарии concurrent_search")
+    parser.add_argument("--latency", type=float, default=0.002, help="Задержка mock-сервера в секундах")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке в секундах")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Доля медленных ответов mock-сервера")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="Добавка к задержке медленного ответа в секундах")
+    parser.add_argument("--top-k", type=int, default=50, help="Чанков в ответе retrieval")
+    parser.add_argument("--content-size", type=int, default=2000, help="Размер content чанка в символах")
+    parser.add_argument("--compress", action="store_true", help="Mock-сервер сжимает ответы gzip")
+    parser.add_argument("--large-chunks", type=int, default=1000, help="Чанков в сценарии extract_chunks_large")
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "latest.json"), help="Куда сохранить результаты")
+    parser.add_argument("--baseline", default=None, help="JSON с базовой линией для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение относительно базовой линии")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+            "mock": asdict(MockConfig(
+                latency=args.latency,
+                jitter=args.jitter,
+                slow_rate=args.slow_rate,
+                slow_latency=args.slow_latency,
+                chunks=args.top_k,
+                content_size=args.content_size,
+                compress=args.compress
+            )),
+        },
+        "results": run_suite(args),
+    }
+
+    for name, stats in report["results"].items():
+        print(
+            f"{name:22} p50 {stats['p50_ms']:9.3f} ms  p95 {stats['p95_ms']:9.3f} ms  "
+            f"p99 {stats['p99_ms']:9.3f} ms  {stats['throughput_rps']:9.1f} rps"
+        )
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты сохранены в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"❌ Регрессия: {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("✅ Регрессий относительно базовой линии нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
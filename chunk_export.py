@@ -0,0 +1,253 @@
+"""
+RAGFlow Chunk Export
+Выгрузка выдачи RAGFlow в Arrow record batches и Parquet-файлы, разбитые по запросам и датасетам.
+
+Пример:
+    exporter = ChunkExporter("export/")
+    exporter.write("q1", question, client.iter_chunks(question, dataset_ids, limit=10_000))
+    table = open_export("export/").to_table(filter=pc.field("similarity") > 0.5)
+"""
+
+import itertools
+import os
+import shutil
+import tempfile
+from typing import Iterable, Iterator, Optional
+from urllib.parse import quote
+
+from ragflow_client import Chunk
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, only needed for the export itself
+    pa = None
+
+
+# Value pyarrow's hive partitioning reads back as null (chunks without a dataset id)
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+CONTENT_ENCODINGS = ("string", "dictionary")
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("Chunk export needs pyarrow: pip install pyarrow")
+
+
+def chunk_schema(content_encoding: str = "string", partition_columns: bool = True) -> "pa.Schema":
+    """
+    Схема Arrow для выдачи.
+    
+    Оценки хранятся как float64, повторяющиеся строки (вопрос, документ,
+    датасет) — словарём. content хранится строкой или словарём: словарь
+    выгоден, когда одни и те же чанки находят многие запросы.
+    
+    Args:
+        content_encoding: "string" или "dictionary"
+        partition_columns: Включать query_id и dataset_id; в Parquet-файлах
+            выгрузки их нет, значения берутся из путей разделов
+    """
+    _require_pyarrow()
+    if content_encoding not in CONTENT_ENCODINGS:
+        raise ValueError(f"Unknown content encoding: {content_encoding}")
+    text = pa.dictionary(pa.int32(), pa.string())
+    fields = []
+    if partition_columns:
+        fields += [pa.field("query_id", pa.string(), nullable=False), pa.field("dataset_id", pa.string())]
+    fields += [
+        pa.field("question", text, nullable=False),
+        pa.field("rank", pa.int32(), nullable=False),
+        pa.field("chunk_id", pa.string(), nullable=False),
+        pa.field("document_id", text, nullable=False),
+        pa.field("document_name", text, nullable=False),
+        pa.field("similarity", pa.float64(), nullable=False),
+        pa.field("vector_similarity", pa.float64(), nullable=False),
+        pa.field("term_similarity", pa.float64(), nullable=False),
+        pa.field("content", text if content_encoding == "dictionary" else pa.string(), nullable=False),
+        pa.field("highlight", pa.string()),
+    ]
+    return pa.schema(fields)
+
+
+def to_record_batch(
+    chunks: list[Chunk],
+    question: str,
+    ranks: Optional[Iterable[int]] = None,
+    query_id: Optional[str] = None,
+    content_encoding: str = "string"
+) -> "pa.RecordBatch":
+    """
+    Строит record batch из списка чанков.
+    
+    Args:
+        chunks: Чанки одного запроса
+        question: Текст запроса
+        ranks: Позиции чанков в выдаче (None — 0, 1, 2, ...)
+        query_id: ID запроса; если задан, в batch входят столбцы query_id и dataset_id
+        content_encoding: "string" или "dictionary"
+    """
+    schema = chunk_schema(content_encoding, partition_columns=query_id is not None)
+    columns = {
+        "question": [question] * len(chunks),
+        "rank": list(ranks) if ranks is not None else list(range(len(chunks))),
+    }
+    if query_id is not None:
+        columns["query_id"] = [query_id] * len(chunks)
+    for name in schema.names:
+        if name not in columns:
+            columns[name] = [getattr(chunk, name) for chunk in chunks]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(columns[f.name], type=f.type) for f in schema],
+        schema=schema
+    )
+
+
+def iter_record_batches(
+    chunks: Iterable[Chunk],
+    question: str,
+    query_id: str,
+    batch_size: int = 10_000,
+    content_encoding: str = "string"
+) -> Iterator["pa.RecordBatch"]:
+    """
+    Превращает поток чанков (например, iter_chunks) в record batches по batch_size строк.
+    
+    В памяти одновременно находится не больше одного batch, поэтому выдачу
+    любой длины можно собрать в pa.Table.from_batches или передать дальше.
+    """
+    chunks = iter(chunks)
+    rank = 0
+    while batch := list(itertools.islice(chunks, batch_size)):
+        yield to_record_batch(batch, question, range(rank, rank + len(batch)), query_id, content_encoding)
+        rank += len(batch)
+
+
+def _segment(name: str, value: Optional[str]) -> str:
+    """Каталог раздела в стиле Hive; значение кодируется как в URI, как ожидает pyarrow."""
+    return f"{name}={quote(value, safe='') if value is not None else NULL_PARTITION}"
+
+
+class ChunkExporter:
+    """
+    Запись выдачи в Parquet с разделами по запросу и датасету.
+    
+    Файлы лежат в root/query_id=<id>/dataset_id=<id>/part-0.parquet: выдача
+    запроса пишется потоково, по batch_size чанков на группу строк, и каждый
+    раздел дописывается своим ParquetWriter. Выдача собирается в скрытом
+    (с точкой в имени) каталоге и встаёт на место каталога запроса, только
+    когда все файлы записаны: читатели не видят неполную выдачу, а при сбое
+    остаётся прежняя. Повторная запись того же query_id заменяет его разделы.
+    """
+    
+    def __init__(
+        self,
+        root: str,
+        batch_size: int = 10_000,
+        content_encoding: str = "string",
+        compression: str = "zstd"
+    ):
+        """
+        Args:
+            root: Каталог выгрузки
+            batch_size: Сколько чанков собирать в одну группу строк
+            content_encoding: Кодирование content в Arrow: "string" или "dictionary"
+            compression: Сжатие Parquet ("zstd", "snappy", "gzip", "none")
+        """
+        self.schema = chunk_schema(content_encoding, partition_columns=False)
+        self.root = root
+        self.batch_size = batch_size
+        self.content_encoding = content_encoding
+        self.compression = compression
+        self.rows_written = 0
+        self.queries_written = 0
+        os.makedirs(root, exist_ok=True)
+    
+    def write(self, query_id: str, question: str, chunks: Iterable[Chunk]) -> int:
+        """
+        Записывает выдачу одного запроса.
+        
+        Args:
+            query_id: ID запроса, имя раздела
+            question: Текст запроса
+            chunks: Чанки в порядке выдачи; генератор читается потоково
+        
+        Returns:
+            Число записанных чанков
+        """
+        segment = _segment("query_id", query_id)
+        query_dir = os.path.join(self.root, segment)
+        # The new export is built in a hidden directory next to the old one and swapped in once complete
+        staging_dir = tempfile.mkdtemp(prefix=f".{segment}.", dir=self.root)
+        writers: dict[Optional[str], pq.ParquetWriter] = {}
+        chunks = iter(chunks)
+        rank = 0
+        try:
+            try:
+                while batch := list(itertools.islice(chunks, self.batch_size)):
+                    by_dataset: dict[Optional[str], tuple[list[Chunk], list[int]]] = {}
+                    for chunk in batch:
+                        group, ranks = by_dataset.setdefault(chunk.dataset_id, ([], []))
+                        group.append(chunk)
+                        ranks.append(rank)
+                        rank += 1
+                    for dataset_id, (group, ranks) in by_dataset.items():
+                        writer = writers.get(dataset_id)
+                        if writer is None:
+                            dataset_dir = os.path.join(staging_dir, _segment("dataset_id", dataset_id))
+                            os.makedirs(dataset_dir)
+                            writer = writers[dataset_id] = pq.ParquetWriter(
+                                os.path.join(dataset_dir, "part-0.parquet"), self.schema,
+                                compression=self.compression
+                            )
+                        writer.write_batch(
+                            to_record_batch(group, question, ranks, content_encoding=self.content_encoding)
+                        )
+            finally:
+                for writer in writers.values():
+                    writer.close()
+            self._swap(staging_dir, query_dir)
+        except BaseException:
+            # The previous export of this query stays in place
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        self.rows_written += rank
+        self.queries_written += 1
+        return rank
+    
+    @staticmethod
+    def _swap(staging_dir: str, query_dir: str) -> None:
+        """Ставит готовый каталог запроса на место прежнего; пустая выдача тоже заменяет прежнюю."""
+        if not os.path.exists(query_dir):
+            os.replace(staging_dir, query_dir)
+            return
+        # A non-empty directory can't be replaced in one rename, so the old one is moved aside first
+        retired_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(query_dir)}.old.", dir=os.path.dirname(query_dir))
+        os.replace(query_dir, os.path.join(retired_dir, "export"))
+        try:
+            os.replace(staging_dir, query_dir)
+        except OSError:
+            os.replace(os.path.join(retired_dir, "export"), query_dir)
+            raise
+        finally:
+            shutil.rmtree(retired_dir, ignore_errors=True)
+
+
+def open_export(root: str) -> "ds.Dataset":
+    """
+    Открывает выгрузку как набор данных Arrow.
+    
+    Файлы отображаются в память, а не читаются целиком; query_id и dataset_id
+    восстанавливаются из путей разделов и годятся для фильтров, которые
+    отбрасывают лишние файлы без чтения.
+    """
+    _require_pyarrow()
+    partitioning = ds.partitioning(
+        pa.schema([pa.field("query_id", pa.string()), pa.field("dataset_id", pa.string())]),
+        flavor="hive"
+    )
+    return ds.dataset(
+        root, format="parquet", partitioning=partitioning, filesystem=pafs.LocalFileSystem(use_mmap=True)
+    )
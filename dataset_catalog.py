@@ -0,0 +1,235 @@
+"""
+RAGFlow Dataset Catalog
+Кэш списка датасетов RAGFlow: параллельная постраничная загрузка, фоновое обновление и индексы по ID и названию.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from ragflow_client import RAGFlowClient, RAGFlowError
+
+
+@dataclass
+class DatasetInfo:
+    """Метаданные датасета из списка /api/v1/datasets."""
+    id: str
+    name: str
+    chunk_count: int = 0
+    document_count: int = 0
+    embedding_model: Optional[str] = None
+    update_time: int = 0
+    raw: dict = field(default_factory=dict, repr=False)
+    
+    @classmethod
+    def from_api(cls, data: dict) -> "DatasetInfo":
+        return cls(
+            id=data.get("id", ""),
+            name=data.get("name") or data.get("id", ""),
+            chunk_count=data.get("chunk_count") or data.get("chunk_num") or 0,
+            document_count=data.get("document_count") or data.get("doc_num") or 0,
+            embedding_model=data.get("embedding_model") or data.get("embd_id"),
+            update_time=data.get("update_time") or 0,
+            raw=data
+        )
+
+
+@dataclass
+class SelectionEstimate:
+    """Оценка стоимости поиска по набору датасетов."""
+    datasets: int
+    chunk_count: int
+    document_count: int
+    embedding_models: list[str]
+    warnings: list[str] = field(default_factory=list)
+
+
+class DatasetCatalog:
+    """
+    Каталог датасетов RAGFlow.
+    
+    Полная загрузка запрашивает страницы списка параллельно. Фоновое
+    обновление по умолчанию инкрементальное: датасеты читаются в порядке
+    убывания update_time до первого уже известного изменения. Удалённые
+    датасеты обнаруживаются периодической полной загрузкой. Индексы по ID
+    и названию заменяются целиком, поэтому читать каталог можно из любого
+    потока без блокировок.
+    """
+    
+    def __init__(
+        self,
+        client: RAGFlowClient,
+        page_size: int = 100,
+        max_workers: int = 8,
+        refresh_interval: float = 300.0,
+        full_refresh_every: int = 12,
+        chunk_warning: int = 1_000_000
+    ):
+        """
+        Args:
+            client: Клиент RAGFlow
+            page_size: Датасетов на странице запроса
+            max_workers: Сколько страниц запрашивать одновременно
+            refresh_interval: Интервал фонового обновления в секундах
+            full_refresh_every: Каждое какое фоновое обновление выполняется полностью
+            chunk_warning: Сколько чанков в выбранных датасетах считать дорогим поиском
+        """
+        self.client = client
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.refresh_interval = refresh_interval
+        self.full_refresh_every = max(1, full_refresh_every)
+        self.chunk_warning = chunk_warning
+        self.last_refresh: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._by_id: dict[str, DatasetInfo] = {}
+        self._by_name: dict[str, DatasetInfo] = {}
+        self._sorted: list[DatasetInfo] = []
+        self._watermark = 0
+        self._refreshes = 0
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def datasets(self) -> list[DatasetInfo]:
+        """Все датасеты, отсортированные по названию (список не копируется, менять его нельзя)."""
+        return self._sorted
+    
+    def get(self, dataset_id: str) -> Optional[DatasetInfo]:
+        """Датасет по ID."""
+        return self._by_id.get(dataset_id)
+    
+    def by_name(self, name: str) -> Optional[DatasetInfo]:
+        """Датасет по названию."""
+        return self._by_name.get(name)
+    
+    def __len__(self) -> int:
+        return len(self._by_id)
+    
+    def __contains__(self, dataset_id: str) -> bool:
+        return dataset_id in self._by_id
+    
+    def _fetch_page(self, page: int, orderby: Optional[str] = None) -> list[dict]:
+        return self.client.list_datasets(
+            page=page, page_size=self.page_size, orderby=orderby, desc=True if orderby else None
+        )
+    
+    def _fetch_all(self) -> list[dict]:
+        """Загружает все страницы: первую отдельно, остальные окнами по max_workers."""
+        first = self._fetch_page(1)
+        datasets = list(first)
+        if len(first) < self.page_size:
+            return datasets
+        
+        page = 2
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ragflow-catalog") as pool:
+            while True:
+                # The total isn't reported, so a window of pages is requested speculatively
+                window = list(pool.map(self._fetch_page, range(page, page + self.max_workers)))
+                for rows in window:
+                    datasets.extend(rows)
+                    if len(rows) < self.page_size:
+                        return datasets
+                page += self.max_workers
+    
+    def _fetch_changed(self) -> list[dict]:
+        """Загружает датасеты, изменённые после последнего обновления."""
+        changed = []
+        page = 1
+        while True:
+            rows = self._fetch_page(page, orderby="update_time")
+            for row in rows:
+                if (row.get("update_time") or 0) <= self._watermark and row.get("id") in self._by_id:
+                    return changed
+                changed.append(row)
+            if len(rows) < self.page_size:
+                return changed
+            page += 1
+    
+    def refresh(self, full: bool = True) -> int:
+        """
+        Обновляет каталог.
+        
+        Args:
+            full: Полная загрузка; иначе запрашиваются только изменившиеся датасеты
+        
+        Returns:
+            Число добавленных, изменённых и удалённых датасетов
+        
+        Raises:
+            RAGFlowError: Если список получить не удалось (каталог остаётся прежним)
+        """
+        with self._refresh_lock:
+            full = full or not self._by_id
+            rows = self._fetch_all() if full else self._fetch_changed()
+            infos = [DatasetInfo.from_api(row) for row in rows if row.get("id")]
+            
+            if full:
+                by_id = {info.id: info for info in infos}
+                changes = len(by_id.keys() ^ self._by_id.keys()) + sum(
+                    1 for info in infos
+                    if info.id in self._by_id and info.update_time != self._by_id[info.id].update_time
+                )
+            else:
+                by_id = dict(self._by_id)
+                by_id.update((info.id, info) for info in infos)
+                changes = len(infos)
+            
+            self._by_id = by_id
+            self._by_name = {info.name: info for info in by_id.values()}
+            # Sorted once per refresh: the sidebar reads this on every rerun
+            self._sorted = sorted(by_id.values(), key=lambda d: d.name.lower())
+            self._watermark = max((info.update_time for info in by_id.values()), default=0)
+            self.last_refresh = time.time()
+            self.last_error = None
+            return changes
+    
+    def start(self) -> None:
+        """Запускает фоновое обновление каталога."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ragflow-catalog-refresh", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        """Останавливает фоновое обновление."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.client.timeout)
+            self._thread = None
+    
+    def _run(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            self._refreshes += 1
+            try:
+                self.refresh(full=self._refreshes % self.full_refresh_every == 0)
+            except RAGFlowError as e:
+                # Keep serving the last good catalog; the next cycle tries again
+                self.last_error = str(e)
+    
+    def estimate(self, dataset_ids: Iterable[str]) -> SelectionEstimate:
+        """
+        Оценивает поиск по выбранным датасетам и предупреждает о дорогих
+        или несовместимых комбинациях.
+        """
+        infos = [info for info in (self._by_id.get(i) for i in dataset_ids) if info is not None]
+        models = sorted({info.embedding_model for info in infos if info.embedding_model})
+        estimate = SelectionEstimate(
+            datasets=len(infos),
+            chunk_count=sum(info.chunk_count for info in infos),
+            document_count=sum(info.document_count for info in infos),
+            embedding_models=models
+        )
+        if len(models) > 1:
+            estimate.warnings.append(
+                f"Датасеты используют разные модели эмбеддингов ({', '.join(models)}), RAGFlow отклонит такой поиск"
+            )
+        if estimate.chunk_count > self.chunk_warning:
+            estimate.warnings.append(
+                f"Поиск по {estimate.chunk_count:,} чанкам может быть медленным".replace(",", " ")
+            )
+        return estimate
@@ -0,0 +1,340 @@
+"""
+RAGFlow Query History
+Локальная история поисков: запросы, параметры, найденные чанки и ИИ-резюме в SQLite с полнотекстовым поиском по вопросам и содержимому чанков.
+"""
+
+import json
+import queue
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from ragflow_client import Chunk
+
+
+_TOKEN = re.compile(r"\w+")
+
+# Chunk attributes stored as columns of the chunks table, in insert order
+_CHUNK_COLUMNS = (
+    "chunk_id", "document_id", "document_name", "dataset_id",
+    "similarity", "vector_similarity", "term_similarity", "content", "highlight",
+)
+
+
+@dataclass
+class HistoryEntry:
+    """Сохранённый поиск: вопрос, параметры, выдача и резюме."""
+    question: str
+    dataset_ids: list[str]
+    params: dict
+    chunks: list[Chunk]
+    summary: str = ""
+    created_at: float = field(default_factory=time.time)
+    id: Optional[int] = None
+
+
+@dataclass
+class HistoryMatch:
+    """Строка списка истории: поиск без выдачи и фрагмент, совпавший с запросом."""
+    id: int
+    question: str
+    created_at: float
+    chunk_count: int
+    snippet: str = ""
+
+
+class HistoryStore:
+    """
+    История поисков в SQLite-файле.
+    
+    record() только ставит запись в очередь: фоновый поток пишет записи
+    пачками по `batch_size` в одной транзакции, поэтому запись не задерживает
+    ответ пользователю. Вопросы, резюме и содержимое чанков индексируются
+    FTS5; если SQLite собран без FTS5, поиск выполняется через LIKE.
+    Хранится не больше `max_entries` последних поисков.
+    """
+    
+    def __init__(
+        self,
+        path: str = "query_history.sqlite",
+        batch_size: int = 32,
+        flush_interval: float = 1.0,
+        max_pending: int = 1000,
+        max_entries: Optional[int] = 10_000
+    ):
+        """
+        Args:
+            path: Путь к SQLite-файлу
+            batch_size: Сколько записей писать в одной транзакции
+            flush_interval: Сколько секунд копить пачку после первой записи
+            max_pending: Предел очереди записи; сверх него записи отбрасываются
+            max_entries: Сколько последних поисков хранить (None — без ограничения)
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.dropped = 0
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        # Readers and the writer thread use separate connections; WAL lets them work concurrently
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self.full_text = self._create_schema()
+        self._writer_db = sqlite3.connect(path, check_same_thread=False)
+        self._thread = threading.Thread(target=self._run, name="ragflow-history-writer", daemon=True)
+        self._thread.start()
+    
+    def _create_schema(self) -> bool:
+        """Создаёт таблицы; возвращает False, если FTS5 недоступен."""
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS queries (
+                id INTEGER PRIMARY KEY,
+                created_at REAL NOT NULL,
+                question TEXT NOT NULL,
+                dataset_ids TEXT NOT NULL,
+                params TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_queries_created_at ON queries (created_at);
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                query_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                document_id TEXT NOT NULL,
+                document_name TEXT NOT NULL,
+                dataset_id TEXT,
+                similarity REAL NOT NULL,
+                vector_similarity REAL NOT NULL,
+                term_similarity REAL NOT NULL,
+                content TEXT NOT NULL,
+                highlight TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_query ON chunks (query_id, position);
+        """)
+        try:
+            self._db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS queries_fts USING fts5(
+                    question, summary, content='queries', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                    content, document_name, content='chunks', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+            """)
+        except sqlite3.OperationalError:
+            return False
+        return True
+    
+    def record(self, entry: HistoryEntry) -> bool:
+        """
+        Ставит поиск в очередь на запись.
+        
+        Returns:
+            False, если очередь переполнена и запись отброшена
+        """
+        try:
+            self._pending.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+    
+    def flush(self) -> None:
+        """Ждёт, пока все поставленные в очередь записи окажутся в файле."""
+        self._pending.join()
+    
+    def _run(self) -> None:
+        while True:
+            entry = self._pending.get()
+            if entry is None:
+                self._pending.task_done()
+                return
+            batch = [entry]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+            try:
+                self._write(batch)
+            except sqlite3.Error:
+                # History is best effort: a failed batch must not stop later writes
+                self.dropped += len(batch)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._pending.task_done()
+            if stop:
+                return
+    
+    def _write(self, batch: list[HistoryEntry]) -> None:
+        db = self._writer_db
+        with db:
+            for entry in batch:
+                cursor = db.execute(
+                    "INSERT INTO queries (created_at, question, dataset_ids, params, summary, chunk_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        entry.created_at, entry.question, json.dumps(entry.dataset_ids),
+                        json.dumps(entry.params, ensure_ascii=False), entry.summary or "", len(entry.chunks)
+                    )
+                )
+                entry.id = cursor.lastrowid
+                for position, chunk in enumerate(entry.chunks):
+                    db.execute(
+                        f"INSERT INTO chunks (query_id, position, {', '.join(_CHUNK_COLUMNS)}) "
+                        f"VALUES (?, ?, {', '.join('?' * len(_CHUNK_COLUMNS))})",
+                        (entry.id, position, *(getattr(chunk, name) for name in _CHUNK_COLUMNS))
+                    )
+                if self.full_text:
+                    db.execute(
+                        "INSERT INTO queries_fts (rowid, question, summary) VALUES (?, ?, ?)",
+                        (entry.id, entry.question, entry.summary or "")
+                    )
+                    if entry.chunks:
+                        db.execute(
+                            "INSERT INTO chunks_fts (rowid, content, document_name) "
+                            "SELECT id, content, document_name FROM chunks WHERE query_id = ?",
+                            (entry.id,)
+                        )
+            if self.max_entries is not None:
+                self._prune(db)
+    
+    def _prune(self, db: sqlite3.Connection) -> None:
+        """Удаляет самые старые поиски сверх max_entries."""
+        row = db.execute(
+            "SELECT id FROM queries ORDER BY id DESC LIMIT 1 OFFSET ?", (self.max_entries,)
+        ).fetchone()
+        if row is None:
+            return
+        if self.full_text:
+            # External-content FTS tables are cleaned with the 'delete' command and the original values
+            db.execute(
+                "INSERT INTO queries_fts (queries_fts, rowid, question, summary) "
+                "SELECT 'delete', id, question, summary FROM queries WHERE id <= ?", (row[0],)
+            )
+            db.execute(
+                "INSERT INTO chunks_fts (chunks_fts, rowid, content, document_name) "
+                "SELECT 'delete', id, content, document_name FROM chunks WHERE query_id <= ?", (row[0],)
+            )
+        db.execute("DELETE FROM chunks WHERE query_id <= ?", (row[0],))
+        db.execute("DELETE FROM queries WHERE id <= ?", (row[0],))
+    
+    @staticmethod
+    def _match_expression(text: str) -> Optional[str]:
+        """Запрос FTS5: все слова, последнее — как префикс."""
+        words = _TOKEN.findall(text)
+        if not words:
+            return None
+        return " ".join(f'"{word}"' for word in words) + "*"
+    
+    def recent(self, limit: int = 20) -> list[HistoryMatch]:
+        """Последние поиски, новые первыми."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, question, created_at, chunk_count FROM queries ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [HistoryMatch(*row) for row in rows]
+    
+    def search(self, text: str, limit: int = 20) -> list[HistoryMatch]:
+        """
+        Ищет поиски, в вопросе, резюме или найденных чанках которых есть все слова text.
+        
+        Returns:
+            До limit поисков: сначала совпадения в вопросах и резюме, затем в чанках,
+            внутри группы — по релевантности
+        """
+        if not self.full_text:
+            return self._search_like(text, limit)
+        expression = self._match_expression(text)
+        if expression is None:
+            return []
+        with self._lock:
+            by_question = self._db.execute(
+                "SELECT q.id, q.question, q.created_at, q.chunk_count, "
+                "snippet(queries_fts, 1, '**', '**', '…', 12) "
+                "FROM queries_fts JOIN queries q ON q.id = queries_fts.rowid "
+                "WHERE queries_fts MATCH ? ORDER BY rank LIMIT ?",
+                (expression, limit)
+            ).fetchall()
+            by_chunk = self._db.execute(
+                "SELECT q.id, q.question, q.created_at, q.chunk_count, "
+                "snippet(chunks_fts, 0, '**', '**', '…', 12) "
+                "FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid JOIN queries q ON q.id = c.query_id "
+                "WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?",
+                (expression, limit * 5)
+            ).fetchall()
+        
+        matches: dict[int, HistoryMatch] = {}
+        for row in by_question + by_chunk:
+            if row[0] not in matches and len(matches) < limit:
+                matches[row[0]] = HistoryMatch(*row)
+        return list(matches.values())
+    
+    def _search_like(self, text: str, limit: int) -> list[HistoryMatch]:
+        """Поиск без FTS5: подстрока в вопросе или содержимом чанков."""
+        pattern = f"%{text.strip()}%"
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, question, created_at, chunk_count FROM queries "
+                "WHERE question LIKE ? OR summary LIKE ? "
+                "OR id IN (SELECT query_id FROM chunks WHERE content LIKE ?) "
+                "ORDER BY id DESC LIMIT ?",
+                (pattern, pattern, pattern, limit)
+            ).fetchall()
+        return [HistoryMatch(*row) for row in rows]
+    
+    def load(self, entry_id: int) -> Optional[HistoryEntry]:
+        """Сохранённый поиск целиком, с чанками в исходном порядке."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT created_at, question, dataset_ids, params, summary FROM queries WHERE id = ?", (entry_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            chunk_rows = self._db.execute(
+                f"SELECT {', '.join(_CHUNK_COLUMNS)} FROM chunks WHERE query_id = ? ORDER BY position",
+                (entry_id,)
+            ).fetchall()
+        created_at, question, dataset_ids, params, summary = row
+        return HistoryEntry(
+            question=question,
+            dataset_ids=json.loads(dataset_ids),
+            params=json.loads(params),
+            chunks=[Chunk(**dict(zip(_CHUNK_COLUMNS, values))) for values in chunk_rows],
+            summary=summary,
+            created_at=created_at,
+            id=entry_id
+        )
+    
+    def clear(self) -> None:
+        """Удаляет всю историю."""
+        self.flush()
+        with self._lock:
+            tables = ("queries", "chunks") + (("queries_fts", "chunks_fts") if self.full_text else ())
+            for table in tables:
+                self._db.execute(f"DELETE FROM {table}")
+            self._db.commit()
+    
+    def close(self) -> None:
+        """Дописывает очередь и закрывает файл."""
+        self._pending.put(None)
+        self._thread.join()
+        self._writer_db.close()
+        self._db.close()
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
@@ -0,0 +1,120 @@
+"""
+RAGFlow Mind Map Index
+Индексированное дерево ментальной карты: доступ к детям узла, поиск по названиям и число узлов на каждом уровне.
+"""
+
+import bisect
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+_TOKEN = re.compile(r"\w+")
+
+
+@dataclass(slots=True)
+class MindMapNode:
+    """Узел ментальной карты."""
+    index: int
+    label: str
+    depth: int
+    parent: Optional[int]
+    children: list[int] = field(default_factory=list)
+
+
+class MindMapIndex:
+    """
+    Ментальная карта RAGFlow, разобранная в плоский список узлов.
+    
+    Узлы нумеруются в порядке обхода в ширину, корень имеет индекс 0.
+    Для поиска строится инвертированный индекс слов названий, поэтому
+    запрос не обходит дерево целиком.
+    """
+    
+    def __init__(self, nodes: list[MindMapNode]):
+        self.nodes = nodes
+        self.depth_counts: list[int] = []
+        self._postings: dict[str, list[int]] = {}
+        for node in nodes:
+            if node.depth == len(self.depth_counts):
+                self.depth_counts.append(0)
+            self.depth_counts[node.depth] += 1
+            for token in set(_TOKEN.findall(node.label.casefold())):
+                self._postings.setdefault(token, []).append(node.index)
+        self._tokens = sorted(self._postings)
+    
+    @staticmethod
+    def node_label(node: dict) -> str:
+        """Название узла: RAGFlow кладёт текст узла в поле id."""
+        return str(node.get("id") or node.get("name") or node.get("label") or "")
+    
+    @classmethod
+    def from_mind_map(cls, mind_map: dict) -> "MindMapIndex":
+        """
+        Строит индекс из поля mind_map ответа knowledge_graph.
+        
+        Обход итеративный, поэтому глубина дерева не ограничена стеком вызовов.
+        """
+        nodes = [MindMapNode(0, cls.node_label(mind_map), 0, None)]
+        pending = [(0, mind_map)]
+        position = 0
+        while position < len(pending):
+            parent_index, raw = pending[position]
+            position += 1
+            parent = nodes[parent_index]
+            for child in raw.get("children") or []:
+                if not isinstance(child, dict):
+                    continue
+                node = MindMapNode(len(nodes), cls.node_label(child), parent.depth + 1, parent_index)
+                nodes.append(node)
+                parent.children.append(node.index)
+                pending.append((node.index, child))
+        return cls(nodes)
+    
+    @property
+    def root(self) -> MindMapNode:
+        return self.nodes[0]
+    
+    def __len__(self) -> int:
+        return len(self.nodes)
+    
+    def children(self, index: int) -> list[MindMapNode]:
+        """Непосредственные дети узла."""
+        return [self.nodes[i] for i in self.nodes[index].children]
+    
+    def path(self, index: int) -> list[MindMapNode]:
+        """Путь от корня до узла включительно."""
+        path = []
+        node: Optional[MindMapNode] = self.nodes[index]
+        while node is not None:
+            path.append(node)
+            node = self.nodes[node.parent] if node.parent is not None else None
+        return path[::-1]
+    
+    def _prefix_matches(self, prefix: str) -> set[int]:
+        """Узлы, в названии которых есть слово, начинающееся с prefix."""
+        matches = set()
+        position = bisect.bisect_left(self._tokens, prefix)
+        while position < len(self._tokens) and self._tokens[position].startswith(prefix):
+            matches.update(self._postings[self._tokens[position]])
+            position += 1
+        return matches
+    
+    def search(self, query: str, limit: int = 50) -> list[MindMapNode]:
+        """
+        Ищет узлы, содержащие все слова запроса (последнее — как префикс).
+        
+        Returns:
+            До limit узлов: сначала менее глубокие, затем в порядке обхода
+        """
+        words = _TOKEN.findall(query.casefold())
+        if not words:
+            return []
+        matches: Optional[set[int]] = None
+        for i, word in enumerate(words):
+            found = self._prefix_matches(word) if i == len(words) - 1 else set(self._postings.get(word, ()))
+            matches = found if matches is None else matches & found
+            if not matches:
+                return []
+        # Breadth-first numbering already orders by depth
+        return [self.nodes[i] for i in sorted(matches)[:limit]]
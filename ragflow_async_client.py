@@ -0,0 +1,508 @@
+"""
+RAGFlow Async API Client
+Асинхронный клиент RAGFlow API на asyncio/aiohttp для встраивания в async-сервисы.
+"""
+
+import asyncio
+import time
+from contextlib import nullcontext
+from typing import Iterable, Optional
+
+import aiohttp
+
+from ragflow_client import (
+    RETRY_STATUSES,
+    Chunk,
+    CircuitOpenError,
+    FanOutResult,
+    HedgePolicy,
+    LatencyTracker,
+    RAGFlowError,
+    RetrievalCache,
+    _BaseRAGFlowClient,
+    _group_datasets,
+    _json_loads,
+    merge_top_k,
+)
+from ragflow_metrics import (
+    ClientMetrics,
+    endpoint_label,
+    instrumented,
+    record_connect,
+    tag_datasets,
+    timed_phase,
+    track_exchange,
+)
+
+
+# Ошибки транспорта, которые оборачиваются в RAGFlowError
+_TRANSPORT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+async def _on_connection_create_start(session, context, params) -> None:
+    context.connect_started = time.perf_counter()
+
+
+async def _on_connection_create_end(session, context, params) -> None:
+    record_connect(time.perf_counter() - context.connect_started)
+
+
+def _timing_trace_config() -> aiohttp.TraceConfig:
+    """TraceConfig, сообщающий время установки новых соединений в метрики."""
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    return trace_config
+
+
+class AsyncRAGFlowClient(_BaseRAGFlowClient):
+    """
+    Асинхронный клиент для работы с RAGFlow HTTP API.
+    
+    Повторяет интерфейс RAGFlowClient, но все сетевые методы — корутины.
+    Все запросы клиента идут через один пул соединений aiohttp, поэтому
+    тысячи одновременных запросов обслуживаются одним event loop.
+    """
+    
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        timeout: int = 30,
+        pool_size: int = 100,
+        keep_alive: bool = True,
+        max_retries: int = 2,
+        backoff_factor: float = 0.5,
+        backoff_max: float = 10.0,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        max_concurrency: Optional[int] = None,
+        session: Optional[aiohttp.ClientSession] = None,
+        cache: Optional[RetrievalCache] = None,
+        metrics: Optional[ClientMetrics] = None,
+        latency: Optional[LatencyTracker] = None,
+        hedging: Optional[HedgePolicy] = None,
+        compression: bool = True
+    ):
+        """
+        Инициализация асинхронного клиента RAGFlow.
+        
+        Args:
+            base_url: URL адрес RAGFlow сервера (например, "http://localhost:9380")
+            api_key: API ключ для авторизации
+            timeout: Таймаут запросов в секундах
+            pool_size: Максимальное число соединений в пуле (0 — без ограничения)
+            keep_alive: Переиспользовать соединения между запросами
+            max_retries: Число повторов идемпотентных запросов
+            backoff_factor: Базовая задержка экспоненциального backoff в секундах
+            backoff_max: Максимальная задержка между повторами в секундах
+            failure_threshold: Ошибок подряд до размыкания предохранителя (0 — отключить)
+            recovery_timeout: Время в секундах до пробного запроса после размыкания
+            max_concurrency: Максимум одновременно выполняемых запросов (None — без ограничения)
+            session: Готовая aiohttp-сессия, если пул нужно разделить с другим кодом
+            cache: Кэш ответов retrieval (может быть общим с RAGFlowClient)
+            metrics: Сборщик метрик задержки по фазам запросов (None — не собирать);
+                время соединения замеряется только в сессии, созданной клиентом
+            latency: Распределение задержек по эндпоинтам для адаптивных таймаутов
+                (может быть общим с RAGFlowClient)
+            hedging: Политика дублирования медленных запросов retrieval (None — не дублировать)
+            compression: Принимать сжатые ответы (gzip/deflate, br при установленном
+                Brotli); False — только без сжатия
+        """
+        super().__init__(
+            base_url, api_key, timeout, keep_alive, max_retries,
+            backoff_factor, backoff_max, failure_threshold, recovery_timeout, metrics,
+            latency, hedging, compression
+        )
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self._session = session
+        self._owns_session = session is None
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает сессию, создавая её в текущем event loop при первом обращении."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, force_close=not self.keep_alive)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[_timing_trace_config()]
+            )
+            self._owns_session = True
+        return self._session
+    
+    async def close(self) -> None:
+        """Закрывает пул соединений, если он принадлежит клиенту."""
+        if self._session is not None and self._owns_session and not self._session.closed:
+            await self._session.close()
+    
+    async def __aenter__(self) -> "AsyncRAGFlowClient":
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+    
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        idempotent: bool = False,
+        decode: bool = True,
+        **kwargs
+    ) -> Optional[dict]:
+        """
+        Выполняет HTTP-запрос и возвращает разобранный JSON (None при decode=False).
+        
+        Политика повторов, адаптивные таймауты и предохранитель те же, что у RAGFlowClient.
+        
+        Raises:
+            CircuitOpenError: Если предохранитель разомкнут
+            RAGFlowError: Если тело ответа не JSON
+            aiohttp.ClientError: Если все попытки неудачны или статус ответа ошибочный
+        """
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        session = self._get_session()
+        endpoint = endpoint_label(path) if self.latency is not None else None
+        fixed_timeout = "timeout" in kwargs
+        
+        for attempt in range(attempts):
+            final = attempt + 1 >= attempts
+            adaptive = False
+            if endpoint is not None and not fixed_timeout:
+                attempt_timeout = self._attempt_timeout(endpoint, final)
+                adaptive = attempt_timeout < self.timeout
+                kwargs["timeout"] = aiohttp.ClientTimeout(total=attempt_timeout)
+            allowed = False
+            try:
+                async with self._semaphore if self._semaphore is not None else nullcontext():
+                    # Asked only once a slot is free, so a request waiting for one never holds the probe
+                    if not self.circuit_breaker.allow():
+                        raise CircuitOpenError(f"RAGFlow is unavailable, circuit open: {self.base_url}")
+                    allowed = True
+                    retry_after, data = await self._send(session, method, path, final, endpoint, decode, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # Running out of an adaptive timeout says the reply is late, not that the backend is down,
+                # so the next attempt goes out right away and the breaker isn't charged
+                late = adaptive and isinstance(e, asyncio.TimeoutError)
+                if not late:
+                    self.circuit_breaker.record_failure()
+                if final:
+                    raise
+                if not late:
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                continue
+            except BaseException:
+                # Cancelled (a fan-out latency budget, a losing hedge) or failed before the server's answer
+                # was seen: the next request becomes the probe. Once answered the breaker is no longer half open.
+                if allowed:
+                    self.circuit_breaker.release()
+                raise
+            
+            if retry_after is not None:
+                await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+                continue
+            return data
+    
+    async def _send(
+        self,
+        session: aiohttp.ClientSession,
+        method: str,
+        path: str,
+        final: bool,
+        endpoint: Optional[str],
+        decode: bool = True,
+        **kwargs
+    ) -> tuple:
+        """
+        Отправляет один запрос и полностью читает ответ, освобождая соединение.
+        
+        Попытка замеряется по фазам: соединение, ожидание заголовков ответа,
+        загрузка тела и разбор JSON (при decode=False тело не разбирается).
+        Если передан endpoint, длительность попытки добавляется
+        в распределение задержек клиента.
+        
+        Returns:
+            Пара (Retry-After, данные): если запрос нужно повторить, первый элемент
+            не None (пустая строка при отсутствии заголовка)
+        """
+        started = time.perf_counter()
+        phases = {}
+        body = b""
+        transfer_bytes = None
+        error = None
+        try:
+            with track_exchange() as phases:
+                async with session.request(method, f"{self.base_url}{path}", **kwargs) as response:
+                    phases["ttfb"] = time.perf_counter() - started - phases.get("connect", 0.0)
+                    if response.status >= 400:
+                        error = f"http_{response.status}"
+                    # 429 means the backend is alive but busy, so it doesn't trip the breaker
+                    if response.status >= 500:
+                        self.circuit_breaker.record_failure()
+                    else:
+                        self.circuit_breaker.record_success()
+                    
+                    if response.status in RETRY_STATUSES and not final:
+                        return response.headers.get("Retry-After", ""), None
+                    response.raise_for_status()
+                    body_started = time.perf_counter()
+                    body = await response.read()
+                    phases["transfer"] = time.perf_counter() - body_started
+                    # Bytes received before decompression; older aiohttp doesn't count them
+                    transfer_bytes = getattr(response.content, "total_raw_bytes", None)
+            if endpoint is not None:
+                self.latency.observe(endpoint, time.perf_counter() - started)
+        except _TRANSPORT_ERRORS as e:
+            error = error or type(e).__name__
+            raise
+        finally:
+            self._record_exchange(path, phases, len(body), error, transfer_bytes)
+        
+        if not decode:
+            return None, None
+        with timed_phase("decode"):
+            try:
+                return None, _json_loads(body)
+            except ValueError as e:
+                # A 200 with a non-JSON body, e.g. an HTML page from a proxy in front of RAGFlow
+                raise RAGFlowError(f"Invalid response from {endpoint_label(path)}: {str(e)}")
+    
+    async def _hedged_request(self, method: str, path: str, **kwargs) -> dict:
+        """
+        Идемпотентный запрос с дублированием по политике hedging.
+        
+        Возвращается первый успешный ответ, проигравший запрос отменяется.
+        """
+        delay = self._hedge_delay(path)
+        if delay is None:
+            return await self._request(method, path, idempotent=True, **kwargs)
+        
+        attempts = [asyncio.ensure_future(self._request(method, path, idempotent=True, **kwargs))]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and self.hedging.acquire():
+                attempts.append(asyncio.ensure_future(self._request(method, path, idempotent=True, **kwargs)))
+            pending = set(attempts)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in attempts if t in done and t.exception() is None), None)
+        finally:
+            for task in attempts:
+                if task is not winner:
+                    task.cancel()
+        if winner is None:
+            return attempts[0].result()
+        if len(attempts) > 1:
+            self.hedging.record_winner(winner is attempts[1])
+        return winner.result()
+    
+    async def test_connection(self) -> bool:
+        """
+        Проверяет подключение к RAGFlow серверу.
+        
+        Returns:
+            True если подключение успешно
+        """
+        try:
+            # Like RAGFlowClient, only the status counts: the body isn't parsed
+            await self._request("GET", "/api/v1/system/health", idempotent=True, decode=False)
+            return True
+        except (*_TRANSPORT_ERRORS, RAGFlowError):
+            return False
+    
+    @instrumented
+    async def list_datasets(
+        self,
+        page: Optional[int] = None,
+        page_size: Optional[int] = None,
+        orderby: Optional[str] = None,
+        desc: Optional[bool] = None
+    ) -> list[dict]:
+        """
+        Получает список датасетов. Параметры как у RAGFlowClient.list_datasets.
+        
+        Returns:
+            Список датасетов с их ID, названиями и метаданными
+        """
+        try:
+            data = await self._request(
+                "GET", "/api/v1/datasets", idempotent=True,
+                params=self._dataset_list_params(page, page_size, orderby, desc)
+            )
+        except _TRANSPORT_ERRORS as e:
+            raise RAGFlowError(f"Connection error: {str(e)}")
+        
+        if data.get("code") != 0:
+            raise RAGFlowError(f"API Error: {data.get('message')}")
+        return data.get("data", [])
+    
+    @instrumented
+    async def retrieve_chunks(
+        self,
+        question: str,
+        dataset_ids: list[str],
+        document_ids: Optional[list[str]] = None,
+        similarity_threshold: float = 0.2,
+        vector_similarity_weight: float = 0.3,
+        top_k: int = 10,
+        page: int = 1,
+        page_size: int = 30,
+        highlight: bool = True,
+        keyword: bool = False,
+        use_kg: bool = False,
+        rerank_id: Optional[str] = None
+    ) -> dict:
+        """
+        Получение семантически близких чанков по запросу.
+        """
+        tag_datasets(dataset_ids)
+        payload = self._retrieval_payload(
+            question, dataset_ids, document_ids, similarity_threshold, vector_similarity_weight,
+            top_k, page, page_size, highlight, keyword, use_kg, rerank_id
+        )
+        
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(payload, self.cache_namespace)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        try:
+            data = await self._hedged_request("POST", "/api/v1/retrieval", json=payload)
+        except _TRANSPORT_ERRORS as e:
+            raise RAGFlowError(f"Request failed: {str(e)}")
+
+        if cache_key is not None and data.get("code") == 0:
+            self.cache.put(cache_key, dataset_ids, data)
+        return data
+    
+    @instrumented
+    async def get_mind_map(self, dataset_id: str) -> dict:
+        """
+        Получает данные ментальной карты для датасета.
+        """
+        tag_datasets([dataset_id])
+        try:
+            data = await self._request("GET", f"/api/v1/datasets/{dataset_id}/knowledge_graph", idempotent=True)
+        except _TRANSPORT_ERRORS as e:
+            raise RAGFlowError(f"Failed to fetch mind map: {str(e)}")
+        
+        if data.get("code") != 0:
+            raise RAGFlowError(f"API Error: {data.get('message')}")
+        return data.get("data", {})
+    
+    @instrumented
+    async def get_ai_summary(self, assistant_id: str, question: str, session_id: Optional[str] = None) -> dict:
+        """
+        Генерирует ИИ-резюме через чат-ассистента.
+        """
+        # 1. Create session if not provided
+        if not session_id:
+            try:
+                s_data = await self._request("POST", f"/api/v1/chats/{assistant_id}/sessions")
+            except _TRANSPORT_ERRORS as e:
+                raise RAGFlowError(f"Session creation failed: {str(e)}")
+            if s_data.get("code") != 0:
+                raise RAGFlowError(f"Failed to create session: {s_data.get('message')}")
+            session_id = s_data.get("data", {}).get("id")
+        
+        # 2. Ask question
+        chat_path = f"/api/v1/chats/{assistant_id}/sessions/{session_id}/completions"
+        payload = {
+            "question": question,
+            "stream": False
+        }
+        try:
+            return await self._request("POST", chat_path, json=payload)
+        except _TRANSPORT_ERRORS as e:
+            raise RAGFlowError(f"Summary request failed: {str(e)}")
+    
+    @instrumented
+    async def fan_out_search(
+        self,
+        question: str,
+        dataset_ids: list[str],
+        top_k: int = 5,
+        similarity_threshold: float = 0.2,
+        group_size: int = 1,
+        latency_budget: Optional[float] = None,
+        **kwargs
+    ) -> FanOutResult:
+        """
+        Параллельный поиск: отдельный запрос на каждую группу датасетов
+        и слияние результатов в общий top_k. Параметры как у
+        RAGFlowClient.fan_out_search.
+        """
+        tag_datasets(dataset_ids)
+        tasks = {
+            asyncio.ensure_future(self.search(
+                question=question,
+                dataset_ids=group,
+                top_k=top_k,
+                similarity_threshold=similarity_threshold,
+                **kwargs
+            )): group
+            for group in _group_datasets(dataset_ids, group_size)
+        }
+        done, pending = await asyncio.wait(tasks, timeout=latency_budget)
+        
+        result = FanOutResult(chunks=[])
+        chunk_lists = []
+        for task in pending:
+            task.cancel()
+            result.timed_out.extend(tasks[task])
+        if pending:
+            # Let the cancelled requests unwind, so a breaker probe among them is released before returning
+            await asyncio.wait(pending)
+        for task in done:
+            try:
+                chunk_lists.append(task.result())
+            except RAGFlowError as e:
+                for dataset_id in tasks[task]:
+                    result.failed[dataset_id] = str(e)
+        
+        if not chunk_lists and result.failed and not result.timed_out:
+            raise RAGFlowError(f"All dataset requests failed: {next(iter(result.failed.values()))}")
+        
+        result.chunks = merge_top_k(chunk_lists, top_k)
+        return result
+    
+    @instrumented
+    async def search(
+        self,
+        question: str,
+        dataset_ids: list[str],
+        top_k: int = 5,
+        similarity_threshold: float = 0.2,
+        fan_out: bool = False,
+        fields: Optional[Iterable[str]] = None,
+        **kwargs
+    ) -> list[Chunk]:
+        """
+        Упрощённый метод поиска чанков.
+        
+        Без "highlight" в fields подсветка не запрашивается у сервера.
+        """
+        fields, kwargs = self._projection(fields, kwargs)
+        if fan_out and len(dataset_ids) > 1:
+            result = await self.fan_out_search(
+                question, dataset_ids, top_k=top_k, similarity_threshold=similarity_threshold,
+                fields=fields, **kwargs
+            )
+            return result.chunks
+        
+        response = await self.retrieve_chunks(
+            question=question,
+            dataset_ids=dataset_ids,
+            top_k=top_k,
+            page_size=top_k,
+            similarity_threshold=similarity_threshold,
+            **kwargs
+        )
+        return self.extract_chunks(response, fields)
@@ -3,12 +3,52 @@ RAGFlow API Client
 Модуль для взаимодействия с RAGFlow API для получения семантически близких чанков.
 """
 
+import atexit
+import contextvars
+import functools
+import hashlib
+import heapq
+import inspect
+import json
+import math
+import random
+import sqlite3
+import threading
+import time
 import requests
-from typing import Optional
-from dataclasses import dataclass
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from enum import IntEnum
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional
+from dataclasses import dataclass, field, replace
 
+from ragflow_metrics import (
+    ClientMetrics,
+    current_call,
+    endpoint_label,
+    instrumented,
+    record_connect,
+    tag_datasets,
+    timed_phase,
+    track_exchange,
+)
 
-@dataclass
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # optional speed-up, the stdlib parser is the fallback
+    _json_loads = json.loads
+
+
+# HTTP-статусы, при которых идемпотентный запрос имеет смысл повторить
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+@dataclass(slots=True)
 class Chunk:
     """Представление чанка из RAGFlow."""
     content: str
@@ -19,17 +59,1670 @@ class Chunk:
     document_name: str
     chunk_id: str
     highlight: Optional[str] = None
+    dataset_id: Optional[str] = None
+
+
+# Chunk attribute -> (key in the retrieval payload, value when missing or not requested)
+CHUNK_FIELDS = {
+    "content": ("content", ""),
+    "similarity": ("similarity", 0.0),
+    "vector_similarity": ("vector_similarity", 0.0),
+    "term_similarity": ("term_similarity", 0.0),
+    "document_id": ("document_id", ""),
+    "document_name": ("document_keyword", "Unknown"),
+    "chunk_id": ("id", ""),
+    "highlight": ("highlight", None),
+    "dataset_id": ("kb_id", None),
+}
+
+
+@dataclass
+class SummaryDelta:
+    """Фрагмент потокового ИИ-резюме."""
+    text: str
+    answer: str
+    reference: Optional[dict] = None
+    done: bool = False
+
+
+@dataclass
+class FanOutResult:
+    """Результат параллельного поиска по датасетам."""
+    chunks: list[Chunk]
+    timed_out: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    
+    @property
+    def partial(self) -> bool:
+        """True, если часть датасетов не ответила."""
+        return bool(self.timed_out or self.failed)
+
+
+def merge_top_k(chunk_lists: Iterable[list[Chunk]], top_k: int) -> list[Chunk]:
+    """
+    K-way слияние списков чанков по убыванию similarity.
+    
+    Дубликаты по chunk_id отбрасываются (остаётся вариант с наибольшей
+    схожестью), результат обрезается до top_k.
+    """
+    ordered = [sorted(chunks, key=lambda c: c.similarity, reverse=True) for chunks in chunk_lists]
+    merged = []
+    seen = set()
+    for chunk in heapq.merge(*ordered, key=lambda c: c.similarity, reverse=True):
+        if chunk.chunk_id in seen:
+            continue
+        seen.add(chunk.chunk_id)
+        merged.append(chunk)
+        if len(merged) >= top_k:
+            break
+    return merged
+
+
+def rescore_chunks(
+    chunks: list[Chunk],
+    vector_similarity_weight: float,
+    similarity_threshold: float = 0.0,
+    top_k: Optional[int] = None
+) -> list[Chunk]:
+    """
+    Пересчитывает гибридную схожесть для нового веса вектора без запроса к серверу.
+    
+    RAGFlow считает similarity = w * vector_similarity + (1 - w) * term_similarity,
+    поэтому из сохранённых компонент оценку можно получить локально. Результат
+    пересортирован, отфильтрован по порогу и обрезан до top_k. Для выдачи,
+    прошедшей Rerank, формула неприменима.
+    
+    Args:
+        chunks: Чанки с заполненными vector_similarity и term_similarity
+        vector_similarity_weight: Новый вес векторного сходства
+        similarity_threshold: Порог схожести после пересчёта
+        top_k: Максимум чанков в результате (None — без ограничения)
+        
+    Returns:
+        Новые объекты Chunk; исходный список не изменяется
+    """
+    w = vector_similarity_weight
+    scores = [w * c.vector_similarity + (1 - w) * c.term_similarity for c in chunks]
+    order = sorted(range(len(chunks)), key=scores.__getitem__, reverse=True)
+    rescored = [
+        replace(chunks[i], similarity=scores[i])
+        for i in order
+        if scores[i] >= similarity_threshold
+    ]
+    return rescored[:top_k] if top_k is not None else rescored
+
+
+def _group_datasets(dataset_ids: list[str], group_size: int) -> list[list[str]]:
+    """Разбивает список датасетов на группы для параллельных запросов."""
+    group_size = max(1, group_size)
+    return [dataset_ids[i:i + group_size] for i in range(0, len(dataset_ids), group_size)]
+
+
+class RAGFlowError(Exception):
+    """Исключение для ошибок RAGFlow API."""
+    pass
+
+
+class CircuitOpenError(RAGFlowError):
+    """Запрос отклонён без обращения к серверу: предохранитель разомкнут."""
+    pass
+
+
+class AdmissionRejectedError(RAGFlowError):
+    """Запрос отклонён клиентским контролем допуска без обращения к серверу."""
+    pass
+
+
+class _StreamCancelled(Exception):
+    """Потоковый ответ прерван вызывающей стороной."""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель (circuit breaker) для запросов к RAGFlow.
+    
+    После `failure_threshold` ошибок подряд цепь размыкается, и в течение
+    `recovery_timeout` секунд все запросы отклоняются сразу. Затем пропускается
+    один пробный запрос: успех замыкает цепь, ошибка снова её размыкает.
+    Пробный запрос, который не дошёл до сервера, возвращается через release;
+    если за `probe_timeout` секунд он так и не завершился, пропускается следующий.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        probe_timeout: Optional[float] = None
+    ):
+        """
+        Args:
+            failure_threshold: Число ошибок подряд до размыкания (0 — отключить)
+            recovery_timeout: Время в секундах до пробного запроса
+            probe_timeout: Сколько секунд ждать исхода пробного запроса
+                (None — столько же, сколько recovery_timeout)
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.probe_timeout = probe_timeout if probe_timeout is not None else recovery_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        """Текущее состояние цепи."""
+        return self._state
+    
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if (
+                self._state == self.OPEN and now - self._opened_at >= self.recovery_timeout
+                # A probe that never reported back must not keep the circuit half open for good
+                or self._state == self.HALF_OPEN and now - self._probe_started >= self.probe_timeout
+            ):
+                # Let exactly one probe request through
+                self._state = self.HALF_OPEN
+                self._probe_started = now
+                return True
+            return False
+    
+    def record_success(self) -> None:
+        """Отмечает успешный ответ сервера."""
+        with self._lock:
+            self._failures = 0
+            self._state = self.CLOSED
+    
+    def record_failure(self) -> None:
+        """Отмечает сбой соединения или ответ 5xx."""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self.failure_threshold > 0 and self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+    
+    def release(self) -> None:
+        """
+        Возвращает пробный запрос, не получивший ответа сервера (отменён или
+        отклонён до отправки): следующий запрос снова станет пробным.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                # The recovery timeout has already run out, so the next allow() hands out a new probe
+                self._state = self.OPEN
+
+
+class LatencyTracker:
+    """
+    Скользящее распределение задержек по эндпоинтам.
+    
+    Хранит последние `window` замеров каждого эндпоинта и выводит из них
+    адаптивный таймаут попытки: квантиль `timeout_quantile`, умноженный
+    на `timeout_factor`, но не меньше `min_timeout` и не больше
+    фиксированного таймаута клиента. Пока замеров меньше `min_samples`,
+    действует фиксированный таймаут.
+    """
+    
+    def __init__(
+        self,
+        window: int = 256,
+        min_samples: int = 20,
+        timeout_quantile: float = 0.99,
+        timeout_factor: float = 2.0,
+        min_timeout: float = 1.0
+    ):
+        """
+        Args:
+            window: Сколько последних замеров хранить на эндпоинт
+            min_samples: Сколько замеров нужно, чтобы доверять распределению
+            timeout_quantile: Квантиль, от которого считается таймаут
+            timeout_factor: Во сколько раз таймаут больше квантиля
+            min_timeout: Нижняя граница таймаута в секундах
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.timeout_quantile = timeout_quantile
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self._samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, endpoint: str, seconds: float) -> None:
+        """Добавляет замер длительности запроса к эндпоинту."""
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append(seconds)
+    
+    def quantile(self, endpoint: str, q: float) -> Optional[float]:
+        """Квантиль задержки эндпоинта или None, если замеров пока мало."""
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    
+    def timeout_for(self, endpoint: str, ceiling: float) -> float:
+        """Таймаут попытки для эндпоинта, не больше ceiling."""
+        q = self.quantile(endpoint, self.timeout_quantile)
+        if q is None:
+            return ceiling
+        return min(ceiling, max(self.min_timeout, q * self.timeout_factor))
+
+
+@dataclass
+class HedgeStats:
+    """Счётчики дублирования запросов."""
+    eligible: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    budget_exhausted: int = 0
+    
+    @property
+    def win_rate(self) -> float:
+        """Доля дублей, ответивших раньше основного запроса."""
+        return self.hedge_wins / self.hedged if self.hedged else 0.0
+
+
+class HedgePolicy:
+    """
+    Политика дублирования (hedging) идемпотентных запросов retrieval.
+    
+    Если ответ не пришёл за время, равное квантилю `quantile` задержки
+    эндпоинта, отправляется второй такой же запрос, и используется тот
+    ответ, что придёт первым. Дубли ограничены бюджетом: каждый запрос,
+    который можно было продублировать, добавляет `budget` жетона (не
+    больше `max_tokens`), каждый дубль тратит один.
+    """
+    
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        budget: float = 0.05,
+        max_tokens: float = 10.0,
+        min_delay: float = 0.02
+    ):
+        """
+        Args:
+            quantile: Квантиль задержки, после которого отправляется дубль
+            budget: Доля запросов, которые можно дублировать в среднем
+            max_tokens: Запас дублей на случай всплеска медленных ответов
+            min_delay: Минимальная задержка перед дублем в секундах
+        """
+        self.quantile = quantile
+        self.budget = budget
+        self.max_tokens = max_tokens
+        self.min_delay = min_delay
+        self.stats = HedgeStats()
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+    
+    def delay(self, latency: LatencyTracker, endpoint: str) -> Optional[float]:
+        """
+        Через сколько секунд дублировать запрос к эндпоинту.
+        
+        Returns:
+            None, если распределение задержек ещё не набрано
+        """
+        q = latency.quantile(endpoint, self.quantile)
+        if q is None:
+            return None
+        with self._lock:
+            self.stats.eligible += 1
+            self._tokens = min(self.max_tokens, self._tokens + self.budget)
+        return max(self.min_delay, q)
+    
+    def acquire(self) -> bool:
+        """Списывает жетон на дубль; False, если бюджет исчерпан."""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.stats.hedged += 1
+                return True
+            self.stats.budget_exhausted += 1
+            return False
+    
+    def record_winner(self, hedge: bool) -> None:
+        """Отмечает, какой из двух запросов ответил первым."""
+        if hedge:
+            with self._lock:
+                self.stats.hedge_wins += 1
+
+
+class Priority(IntEnum):
+    """Полосы приоритета допуска: меньшее значение обслуживается раньше."""
+    INTERACTIVE = 0
+    BATCH = 1
+    BACKGROUND = 2
+
+
+_request_priority: contextvars.ContextVar[tuple[Priority, Optional[float]]] = contextvars.ContextVar(
+    "ragflow_request_priority", default=(Priority.INTERACTIVE, None)
+)
+
+
+@contextmanager
+def request_priority(priority: Priority, max_wait: Optional[float] = None) -> Iterator[None]:
+    """
+    Задаёт полосу приоритета для запросов клиентов внутри блока (в текущем потоке).
+    
+    Args:
+        priority: Полоса приоритета
+        max_wait: Сколько секунд запрос может ждать допуска (None — значение
+            AdmissionController для этой полосы)
+    """
+    token = _request_priority.set((priority, max_wait))
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+@dataclass
+class AdmissionLimit:
+    """Лимиты одного класса эндпоинтов."""
+    rate: Optional[float] = None
+    burst: Optional[int] = None
+    concurrency: Optional[int] = None
+    max_queue: int = 64
+
+
+class _AdmissionWaiter:
+    """Запрос в очереди допуска; упорядочивается по приоритету, затем по времени прихода."""
+    
+    __slots__ = ("priority", "seq", "rejected")
+    
+    def __init__(self, priority: Priority, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.rejected: Optional[str] = None
+    
+    def __lt__(self, other: "_AdmissionWaiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _AdmissionGate:
+    """
+    Ведро жетонов и семафор одного класса эндпоинтов с очередью по приоритетам.
+    
+    Слот получает только голова очереди, поэтому запросы более высокого
+    приоритета всегда обгоняют ждущие запросы более низкого.
+    """
+    
+    def __init__(self, name: str, limit: AdmissionLimit, metrics: Optional[ClientMetrics]):
+        self.name = name
+        self.rate = limit.rate
+        self.burst = limit.burst or max(1, math.ceil(limit.rate or 1))
+        self.concurrency = limit.concurrency
+        self.max_queue = limit.max_queue
+        self.metrics = metrics
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._queue: list[_AdmissionWaiter] = []
+        self._seq = 0
+        self._cond = threading.Condition()
+    
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+    
+    def _refill(self, now: float) -> None:
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def _has_capacity(self) -> bool:
+        return (
+            (self.concurrency is None or self.in_flight < self.concurrency)
+            and (not self.rate or self._tokens >= 1)
+        )
+    
+    def _estimated_wait(self, priority: Priority) -> float:
+        """Оценка ожидания жетона: столько запросов впереди, сколько их не ниже по приоритету."""
+        if not self.rate:
+            return 0.0
+        ahead = sum(1 for waiter in self._queue if waiter.priority <= priority)
+        return max(0.0, (ahead + 1 - self._tokens) / self.rate)
+    
+    def _report_depth(self) -> None:
+        if self.metrics is not None:
+            for priority in Priority:
+                depth = sum(1 for waiter in self._queue if waiter.priority == priority)
+                self.metrics.record_queue_depth(self.name, priority.name.lower(), depth)
+    
+    def _reject(self, priority: Priority, reason: str) -> None:
+        self.rejected += 1
+        if self.metrics is not None:
+            self.metrics.record_admission(self.name, priority.name.lower(), 0.0, reason)
+        raise AdmissionRejectedError(f"Request rejected by client admission control ({reason}): {self.name}")
+    
+    def _remove(self, waiter: _AdmissionWaiter) -> None:
+        self._queue.remove(waiter)
+        heapq.heapify(self._queue)
+        self._report_depth()
+        self._cond.notify_all()
+    
+    def acquire(self, priority: Priority, max_wait: Optional[float]) -> float:
+        """
+        Ждёт слот и жетон.
+        
+        Returns:
+            Время ожидания в секундах
+        
+        Raises:
+            AdmissionRejectedError: Если очередь полна или слот не освободится до дедлайна
+        """
+        started = time.monotonic()
+        with self._cond:
+            self._refill(started)
+            if not self._queue and self._has_capacity():
+                self._grant(priority, 0.0)
+                return 0.0
+            
+            if len(self._queue) >= self.max_queue:
+                victim = max(self._queue)
+                if victim.priority <= priority:
+                    self._reject(priority, "queue_full")
+                # A full queue makes room for higher-priority requests by dropping the newest lowest-priority one
+                victim.rejected = "evicted"
+                self._remove(victim)
+            if max_wait is not None and self._estimated_wait(priority) > max_wait:
+                self._reject(priority, "deadline")
+            
+            deadline = started + max_wait if max_wait is not None else None
+            self._seq += 1
+            waiter = _AdmissionWaiter(priority, self._seq)
+            heapq.heappush(self._queue, waiter)
+            self._report_depth()
+            try:
+                while True:
+                    if waiter.rejected:
+                        self._reject(priority, waiter.rejected)
+                    now = time.monotonic()
+                    self._refill(now)
+                    head = self._queue[0] is waiter
+                    if head and self._has_capacity():
+                        heapq.heappop(self._queue)
+                        self._report_depth()
+                        self._grant(priority, now - started)
+                        # The next waiter may be able to go too
+                        self._cond.notify_all()
+                        return now - started
+                    
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - now
+                        if timeout <= 0:
+                            self._remove(waiter)
+                            self._reject(priority, "deadline")
+                    if head and self.rate and self._tokens < 1 and (
+                        self.concurrency is None or self.in_flight < self.concurrency
+                    ):
+                        # Nobody notifies when a token accrues, so the head wakes up for it
+                        refill_in = (1 - self._tokens) / self.rate
+                        timeout = refill_in if timeout is None else min(timeout, refill_in)
+                    self._cond.wait(timeout)
+            except BaseException:
+                if waiter in self._queue:
+                    self._remove(waiter)
+                raise
+    
+    def _grant(self, priority: Priority, waited: float) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        if self.rate:
+            self._tokens -= 1
+        if self.metrics is not None:
+            self.metrics.record_admission(self.name, priority.name.lower(), waited, None)
+    
+    def release(self) -> None:
+        """Возвращает слот после завершения запроса."""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+class AdmissionController:
+    """
+    Клиентский контроль допуска запросов к RAGFlow.
+    
+    Для каждого класса эндпоинтов (retrieval, ответы чата) действуют ведро
+    жетонов (`rate` запросов в секунду с запасом `burst`) и ограничение
+    одновременных запросов (`concurrency`). Запросы сверх лимита ждут в
+    очереди длиной `max_queue`, упорядоченной по приоритету (`Priority`,
+    задаётся через `request_priority`). Запрос отклоняется
+    AdmissionRejectedError сразу, если очередь полна или по оценке он не
+    дождётся жетона до своего дедлайна, и позже, если дедлайн истёк в
+    очереди. Остальные эндпоинты не ограничиваются.
+    
+    Один контроллер должен обслуживать всех клиентов с одним URL и
+    ключом, см. get_admission_controller.
+    """
+    
+    DEFAULT_LIMITS = {
+        "retrieval": AdmissionLimit(rate=20.0, burst=40, concurrency=8),
+        "chat": AdmissionLimit(rate=2.0, burst=5, concurrency=4),
+    }
+    DEFAULT_MAX_WAIT = {
+        Priority.INTERACTIVE: 10.0,
+        Priority.BATCH: 60.0,
+        Priority.BACKGROUND: 120.0,
+    }
+    
+    def __init__(
+        self,
+        limits: Optional[dict[str, AdmissionLimit]] = None,
+        max_wait: Optional[dict[Priority, Optional[float]]] = None,
+        metrics: Optional[ClientMetrics] = None
+    ):
+        """
+        Args:
+            limits: Лимиты по классам эндпоинтов "retrieval" и "chat"
+                (None — DEFAULT_LIMITS; класс без лимитов не ограничивается)
+            max_wait: Предельное ожидание в очереди по полосам приоритета
+                (None в значении — ждать без ограничения)
+            metrics: Куда записывать ожидание, отказы и глубину очередей
+        
+        Raises:
+            ValueError: Если rate не положителен или burst, concurrency,
+                max_queue меньше 1
+        """
+        self.limits = dict(self.DEFAULT_LIMITS if limits is None else limits)
+        for name, limit in self.limits.items():
+            if limit.rate is not None and limit.rate <= 0:
+                raise ValueError(f"Admission rate must be positive: {name}")
+            for setting in ("burst", "concurrency"):
+                if getattr(limit, setting) is not None and getattr(limit, setting) < 1:
+                    raise ValueError(f"Admission {setting} must be at least 1: {name}")
+            if limit.max_queue < 1:
+                raise ValueError(f"Admission max_queue must be at least 1: {name}")
+        self.max_wait = {**self.DEFAULT_MAX_WAIT, **(max_wait or {})}
+        self.metrics = metrics
+        self._gates = {name: _AdmissionGate(name, limit, metrics) for name, limit in self.limits.items()}
+    
+    @staticmethod
+    def classify(path: str) -> Optional[str]:
+        """Класс эндпоинта по пути запроса."""
+        if path == "/api/v1/retrieval":
+            return "retrieval"
+        if path.endswith("/completions"):
+            return "chat"
+        return None
+    
+    @contextmanager
+    def slot(self, path: str) -> Iterator[None]:
+        """Держит слот класса эндпоинта на время запроса; ожидание учитывается в фазе queue."""
+        gate = self._gates.get(self.classify(path))
+        if gate is None:
+            yield
+            return
+        priority, max_wait = _request_priority.get()
+        with timed_phase("queue"):
+            gate.acquire(priority, self.max_wait.get(priority) if max_wait is None else max_wait)
+        try:
+            yield
+        finally:
+            gate.release()
+    
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Текущее состояние по классам: глубина очереди, запросы в работе, допущено и отклонено."""
+        return {
+            name: {
+                "queue_depth": gate.queue_depth,
+                "in_flight": gate.in_flight,
+                "admitted": gate.admitted,
+                "rejected": gate.rejected,
+            }
+            for name, gate in self._gates.items()
+        }
+
+
+@dataclass
+class CacheStats:
+    """Счётчики кэша."""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    
+    @property
+    def hit_rate(self) -> float:
+        """Доля попаданий среди всех обращений."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class RetrievalCache:
+    """
+    Кэш ответов /api/v1/retrieval.
+    
+    Ключ — нормализованный запрос (регистр и пробелы не учитываются) вместе
+    со всеми параметрами поиска. В памяти хранится не более `max_entries`
+    записей с вытеснением по LRU, каждая живёт `ttl` секунд. Если указан
+    `path`, записи дублируются в SQLite-файл и переживают перезапуск.
+    """
+    
+    def __init__(self, max_entries: int = 512, ttl: float = 300.0, path: Optional[str] = None):
+        """
+        Args:
+            max_entries: Максимум записей в памяти
+            ttl: Время жизни записи в секундах
+            path: Путь к SQLite-файлу для хранения на диске (None — только память)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, tuple[float, list[str], dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS retrieval_cache (
+                    key TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL,
+                    value TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS retrieval_cache_datasets (
+                    key TEXT NOT NULL,
+                    dataset_id TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_retrieval_cache_datasets
+                    ON retrieval_cache_datasets (dataset_id);
+            """)
+            self._purge_expired()
+    
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Приводит запрос к каноническому виду: нижний регистр, одиночные пробелы."""
+        return " ".join(question.split()).casefold()
+    
+    @classmethod
+    def make_key(cls, payload: dict, namespace: str = "") -> str:
+        """
+        Ключ кэша для тела запроса retrieval.
+        
+        Args:
+            payload: Тело запроса
+            namespace: Сервер и учётные данные клиента (см. cache_namespace клиента),
+                чтобы общий кэш не отдавал одному клиенту ответы, полученные другим
+        """
+        normalized = dict(payload)
+        normalized["_namespace"] = namespace
+        normalized["question"] = cls.normalize_question(payload.get("question", ""))
+        normalized["dataset_ids"] = sorted(payload.get("dataset_ids") or [])
+        normalized["document_ids"] = sorted(payload.get("document_ids") or [])
+        raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[dict]:
+        """Возвращает сохранённый ответ или None, если записи нет или она устарела."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, _, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return value
+                del self._entries[key]
+            
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT expires_at, value FROM retrieval_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[0] > now:
+                    value = json.loads(row[1])
+                    dataset_ids = [r[0] for r in self._db.execute(
+                        "SELECT dataset_id FROM retrieval_cache_datasets WHERE key = ?", (key,)
+                    )]
+                    self._store(key, row[0], dataset_ids, value)
+                    self.stats.hits += 1
+                    return value
+            
+            self.stats.misses += 1
+            return None
+    
+    def put(self, key: str, dataset_ids: list[str], value: dict) -> None:
+        """Сохраняет ответ для ключа."""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires_at, list(dataset_ids), value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO retrieval_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                    (key, expires_at, json.dumps(value, ensure_ascii=False))
+                )
+                self._db.execute("DELETE FROM retrieval_cache_datasets WHERE key = ?", (key,))
+                self._db.executemany(
+                    "INSERT INTO retrieval_cache_datasets (key, dataset_id) VALUES (?, ?)",
+                    [(key, dataset_id) for dataset_id in dataset_ids]
+                )
+                self._db.commit()
+    
+    def invalidate_dataset(self, dataset_id: str) -> int:
+        """
+        Удаляет все записи, в которых участвовал датасет (например, после переиндексации).
+        
+        Returns:
+            Число удалённых записей в памяти
+        """
+        with self._lock:
+            keys = [key for key, (_, dataset_ids, _) in self._entries.items() if dataset_id in dataset_ids]
+            for key in keys:
+                del self._entries[key]
+            if self._db is not None:
+                self._db.execute(
+                    "DELETE FROM retrieval_cache WHERE key IN "
+                    "(SELECT key FROM retrieval_cache_datasets WHERE dataset_id = ?)",
+                    (dataset_id,)
+                )
+                self._db.execute(
+                    "DELETE FROM retrieval_cache_datasets WHERE key NOT IN (SELECT key FROM retrieval_cache)"
+                )
+                self._db.commit()
+            return len(keys)
+    
+    def clear(self) -> None:
+        """Полностью очищает кэш."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM retrieval_cache")
+                self._db.execute("DELETE FROM retrieval_cache_datasets")
+                self._db.commit()
+    
+    def close(self) -> None:
+        """Закрывает SQLite-файл."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _store(self, key: str, expires_at: float, dataset_ids: list[str], value: dict) -> None:
+        """Кладёт запись в память и вытесняет самые старые сверх лимита."""
+        self._entries[key] = (expires_at, dataset_ids, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+    
+    def _purge_expired(self) -> None:
+        """Удаляет устаревшие записи из SQLite-файла."""
+        self._db.execute("DELETE FROM retrieval_cache WHERE expires_at <= ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM retrieval_cache_datasets WHERE key NOT IN (SELECT key FROM retrieval_cache)"
+        )
+        self._db.commit()
+
+
+@dataclass
+class _Superset:
+    """Самая широкая выдача, полученная для отпечатка запроса."""
+    chunks: list[Chunk]
+    top_k: int
+    similarity_threshold: float
+    document_ids: Optional[frozenset]
+    exhausted: bool
+    expires_at: float
+
+
+class SupersetCache:
+    """
+    Кэш «надмножеств» выдачи для search.
+    
+    Для отпечатка запроса (вопрос, датасеты, вес вектора, Rerank, KG и прочие
+    параметры, кроме top_k, порога и document_ids) хранится самая широкая
+    полученная выдача. Более узкий запрос — меньший top_k, более высокий порог,
+    подмножество документов — обслуживается из неё в памяти. На промахе клиент
+    запрашивает в `over_fetch_factor` раз больше чанков, чтобы следующие
+    сужения тоже попадали в кэш.
+    """
+    
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 300.0,
+        over_fetch_factor: float = 1.0,
+        max_fetch: int = 1024
+    ):
+        """
+        Args:
+            max_entries: Максимум отпечатков в памяти (LRU)
+            ttl: Время жизни выдачи в секундах
+            over_fetch_factor: Во сколько раз запрашивать больше чанков, чем нужно
+            max_fetch: Верхняя граница размера запрашиваемой выдачи
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.over_fetch_factor = max(1.0, over_fetch_factor)
+        self.max_fetch = max_fetch
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, _Superset] = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def fingerprint(question: str, dataset_ids: list[str], **params) -> str:
+        """Отпечаток запроса без параметров, которые только сужают выдачу."""
+        params.pop("document_ids", None)
+        params.pop("similarity_threshold", None)
+        params.pop("top_k", None)
+        params["question"] = RetrievalCache.normalize_question(question)
+        params["dataset_ids"] = sorted(dataset_ids)
+        raw = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def fetch_size(self, top_k: int) -> int:
+        """Сколько чанков запрашивать у сервера для заданного top_k."""
+        return max(top_k, min(self.max_fetch, math.ceil(top_k * self.over_fetch_factor)))
+    
+    def lookup(
+        self,
+        fingerprint: str,
+        top_k: int,
+        similarity_threshold: float,
+        document_ids: Optional[list[str]] = None
+    ) -> Optional[list[Chunk]]:
+        """
+        Возвращает выдачу из сохранённого надмножества или None,
+        если запрос его расширяет.
+        """
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None or entry.expires_at <= time.time():
+                self._entries.pop(fingerprint, None)
+                self.stats.misses += 1
+                return None
+            
+            wanted = frozenset(document_ids) if document_ids else None
+            covers_documents = entry.document_ids is None or (wanted is not None and wanted <= entry.document_ids)
+            if not covers_documents or similarity_threshold < entry.similarity_threshold:
+                self.stats.misses += 1
+                return None
+            
+            subset = [
+                c for c in entry.chunks
+                if c.similarity >= similarity_threshold and (wanted is None or c.document_id in wanted)
+            ]
+            # A short slice is only complete if the server had nothing more to give
+            if len(subset) < top_k and not entry.exhausted:
+                self.stats.misses += 1
+                return None
+            
+            self._entries.move_to_end(fingerprint)
+            self.stats.hits += 1
+            return subset[:top_k]
+    
+    def store(
+        self,
+        fingerprint: str,
+        chunks: list[Chunk],
+        top_k: int,
+        similarity_threshold: float,
+        document_ids: Optional[list[str]] = None
+    ) -> None:
+        """Сохраняет выдачу, полученную с сервера для top_k чанков."""
+        with self._lock:
+            self._entries[fingerprint] = _Superset(
+                chunks=list(chunks),
+                top_k=top_k,
+                similarity_threshold=similarity_threshold,
+                document_ids=frozenset(document_ids) if document_ids else None,
+                exhausted=len(chunks) < top_k,
+                expires_at=time.time() + self.ttl
+            )
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+    
+    def clear(self) -> None:
+        """Полностью очищает кэш."""
+        with self._lock:
+            self._entries.clear()
+
+
+@dataclass
+class _GraphEntry:
+    """Сохранённый ответ knowledge_graph с данными для ревалидации."""
+    data: dict
+    size: int
+    content_hash: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    version: Optional[str]
+    validated_at: float
+
+
+class KnowledgeGraphCache:
+    """
+    Кэш ответов /api/v1/datasets/{id}/knowledge_graph по датасетам.
+    
+    Запись считается свежей, если совпадает версия датасета (например,
+    update_time из списка датасетов) или с последней проверки прошло меньше
+    `ttl` секунд. Несвежая запись проверяется условным запросом
+    (If-None-Match / If-Modified-Since); если сервер всё же прислал граф
+    целиком, совпадение хеша содержимого избавляет от повторного разбора.
+    Объём в памяти ограничен `max_bytes` (LRU по размеру ответа). Если
+    указан `path`, графы хранятся в SQLite-файле и переживают перезапуск.
+    """
+    
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0, path: Optional[str] = None):
+        """
+        Args:
+            max_bytes: Максимальный суммарный размер ответов в памяти
+            ttl: Сколько секунд запись без версии считается свежей без проверки
+            path: Путь к SQLite-файлу для хранения на диске (None — только память)
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.revalidations = 0
+        self.total_bytes = 0
+        self._entries: OrderedDict[str, _GraphEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS knowledge_graph_cache (
+                    dataset_id TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    version TEXT,
+                    validated_at REAL NOT NULL
+                )
+            """)
+            self._db.commit()
+    
+    @staticmethod
+    def content_hash(body: bytes) -> str:
+        """Хеш тела ответа для сравнения без разбора JSON."""
+        return hashlib.sha256(body).hexdigest()
+    
+    def load(self) -> int:
+        """
+        Загружает в память графы из SQLite-файла, начиная с недавно проверенных.
+        
+        Returns:
+            Число загруженных графов
+        """
+        if self._db is None:
+            return 0
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT dataset_id, body, content_hash, etag, last_modified, version, validated_at "
+                "FROM knowledge_graph_cache ORDER BY validated_at DESC"
+            ).fetchall()
+            loaded = 0
+            for dataset_id, body, content_hash, etag, last_modified, version, validated_at in rows:
+                if dataset_id in self._entries or self.total_bytes + len(body) > self.max_bytes:
+                    continue
+                entry = self._decode(body, content_hash, etag, last_modified, version, validated_at)
+                if entry is None:
+                    continue
+                self._entries[dataset_id] = entry
+                self._entries.move_to_end(dataset_id, last=False)
+                self.total_bytes += entry.size
+                loaded += 1
+            return loaded
+    
+    def lookup(self, dataset_id: str, version: Optional[str] = None) -> tuple[Optional[_GraphEntry], bool]:
+        """
+        Ищет граф датасета в памяти, затем на диске.
+        
+        Returns:
+            Пара (запись или None, свежая ли она); свежую запись можно отдать без запроса
+        """
+        version = None if version is None else str(version)
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT body, content_hash, etag, last_modified, version, validated_at "
+                    "FROM knowledge_graph_cache WHERE dataset_id = ?", (dataset_id,)
+                ).fetchone()
+                if row is not None:
+                    entry = self._decode(*row)
+                    if entry is not None:
+                        self._store(dataset_id, entry)
+            if entry is None:
+                self.stats.misses += 1
+                return None, False
+            
+            self._entries.move_to_end(dataset_id)
+            if version is not None:
+                fresh = entry.version == version
+            else:
+                fresh = time.time() - entry.validated_at < self.ttl
+            if fresh:
+                self.stats.hits += 1
+            return entry, fresh
+    
+    def put(
+        self,
+        dataset_id: str,
+        data: dict,
+        body: bytes,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        version: Optional[str] = None
+    ) -> None:
+        """Сохраняет граф датасета вместе с заголовками для условных запросов."""
+        version = None if version is None else str(version)
+        entry = _GraphEntry(
+            data=data,
+            size=len(body),
+            content_hash=self.content_hash(body),
+            etag=etag,
+            last_modified=last_modified,
+            version=version,
+            validated_at=time.time()
+        )
+        with self._lock:
+            self._store(dataset_id, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO knowledge_graph_cache "
+                    "(dataset_id, body, content_hash, etag, last_modified, version, validated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (dataset_id, body, entry.content_hash, etag, last_modified, version, entry.validated_at)
+                )
+                self._db.commit()
+    
+    def revalidated(self, dataset_id: str, version: Optional[str] = None) -> None:
+        """Отмечает, что сервер подтвердил актуальность сохранённого графа."""
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                return
+            entry.validated_at = time.time()
+            if version is not None:
+                entry.version = str(version)
+            self.revalidations += 1
+            if self._db is not None:
+                self._db.execute(
+                    "UPDATE knowledge_graph_cache SET validated_at = ?, version = ? WHERE dataset_id = ?",
+                    (entry.validated_at, entry.version, dataset_id)
+                )
+                self._db.commit()
+    
+    def invalidate(self, dataset_id: str) -> None:
+        """Удаляет граф датасета."""
+        with self._lock:
+            entry = self._entries.pop(dataset_id, None)
+            if entry is not None:
+                self.total_bytes -= entry.size
+            if self._db is not None:
+                self._db.execute("DELETE FROM knowledge_graph_cache WHERE dataset_id = ?", (dataset_id,))
+                self._db.commit()
+    
+    def clear(self) -> None:
+        """Полностью очищает кэш."""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM knowledge_graph_cache")
+                self._db.commit()
+    
+    def close(self) -> None:
+        """Закрывает SQLite-файл."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @staticmethod
+    def _decode(body: bytes, content_hash: str, etag, last_modified, version, validated_at) -> Optional[_GraphEntry]:
+        """Восстанавливает запись из SQLite; повреждённое тело пропускается."""
+        try:
+            data = _json_loads(body).get("data", {})
+        except (ValueError, AttributeError):
+            return None
+        return _GraphEntry(data, len(body), content_hash, etag, last_modified, version, validated_at)
+    
+    def _store(self, dataset_id: str, entry: _GraphEntry) -> None:
+        """Кладёт запись в память и вытесняет давно не использованные сверх лимита байт."""
+        previous = self._entries.pop(dataset_id, None)
+        if previous is not None:
+            self.total_bytes -= previous.size
+        if entry.size > self.max_bytes:
+            # A graph bigger than the whole budget stays on disk only
+            return
+        self._entries[dataset_id] = entry
+        self.total_bytes += entry.size
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.stats.evictions += 1
+
+
+@dataclass
+class _PooledSession:
+    """Сессия чата в пуле."""
+    session_id: str
+    created_at: float
+    turns: int = 0
+
+
+class ChatSessionPool:
+    """
+    Пул «тёплых» сессий чата одного ассистента.
+    
+    Вместо создания новой сессии на каждый вопрос сессии выдаются в аренду
+    параллельным вызовам и возвращаются в пул. Сессия выводится из оборота
+    после `max_turns` вопросов или по достижении возраста `max_age` секунд,
+    чтобы история диалога не разрасталась. Выведенные сессии удаляются на
+    сервере пачками, оставшиеся — при закрытии пула.
+    """
+    
+    def __init__(
+        self,
+        create_session: Callable[[], str],
+        delete_sessions: Callable[[list[str]], None],
+        max_idle: int = 4,
+        max_turns: int = 10,
+        max_age: float = 1800.0,
+        delete_batch_size: int = 20
+    ):
+        """
+        Args:
+            create_session: Создаёт сессию на сервере и возвращает её ID
+            delete_sessions: Удаляет на сервере сессии с указанными ID
+            max_idle: Сколько свободных сессий держать в пуле
+            max_turns: После скольких вопросов сессия выводится из оборота
+            max_age: Максимальный возраст сессии в секундах
+            delete_batch_size: Сколько выведенных сессий копить до удаления
+        """
+        self._create_session = create_session
+        self._delete_sessions = delete_sessions
+        self.max_idle = max_idle
+        self.max_turns = max_turns
+        self.max_age = max_age
+        self.delete_batch_size = delete_batch_size
+        self._idle: deque[_PooledSession] = deque()
+        self._retired: list[str] = []
+        self._closed = False
+        self._warming = 0
+        self._lock = threading.Lock()
+    
+    def prewarm(self, count: int) -> None:
+        """
+        Заранее создаёт сессии, чтобы вопросы не ждали их создания.
+        
+        Безопасен при одновременных вызовах: свободных и создаваемых сессий
+        вместе не больше min(count, max_idle).
+        """
+        while True:
+            with self._lock:
+                if self._closed or len(self._idle) + self._warming >= min(count, self.max_idle):
+                    return
+                self._warming += 1
+            try:
+                session = _PooledSession(self._create_session(), time.monotonic())
+            finally:
+                with self._lock:
+                    self._warming -= 1
+            with self._lock:
+                if not self._closed:
+                    self._idle.append(session)
+                    continue
+            # The pool was closed while the session was being created
+            self._delete_sessions([session.session_id])
+            return
+    
+    @contextmanager
+    def lease(self) -> Iterator[str]:
+        """
+        Выдаёт ID сессии на время блока with.
+        
+        Если блок завершился исключением, сессия считается испорченной и
+        выводится из оборота.
+        """
+        session = self._acquire()
+        try:
+            yield session.session_id
+        except BaseException:
+            self._release(session, healthy=False)
+            raise
+        else:
+            self._release(session, healthy=True)
+    
+    def close(self) -> None:
+        """Удаляет на сервере все сессии пула одним запросом."""
+        with self._lock:
+            self._closed = True
+            ids = self._retired + [s.session_id for s in self._idle]
+            self._retired = []
+            self._idle.clear()
+        if ids:
+            self._delete_sessions(ids)
+    
+    def _acquire(self) -> _PooledSession:
+        """Берёт свободную сессию из пула или создаёт новую."""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                session = self._idle.popleft()
+                if now - session.created_at < self.max_age:
+                    return session
+                self._retired.append(session.session_id)
+        return _PooledSession(self._create_session(), now)
+    
+    def _release(self, session: _PooledSession, healthy: bool) -> None:
+        """Возвращает сессию в пул или выводит её из оборота."""
+        session.turns += 1
+        to_delete = []
+        with self._lock:
+            reusable = (
+                healthy
+                and not self._closed
+                and session.turns < self.max_turns
+                and time.monotonic() - session.created_at < self.max_age
+                and len(self._idle) < self.max_idle
+            )
+            if reusable:
+                self._idle.append(session)
+            else:
+                self._retired.append(session.session_id)
+            if self._closed or len(self._retired) >= self.delete_batch_size:
+                to_delete, self._retired = self._retired, []
+        if to_delete:
+            try:
+                self._delete_sessions(to_delete)
+            except RAGFlowError:
+                # Cleanup is best effort; the sessions will be retried at close()
+                with self._lock:
+                    self._retired.extend(to_delete)
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вызовов (singleflight).
+    
+    Пока вызов с некоторым ключом выполняется, повторные вызовы с тем же
+    ключом из других потоков не идут на сервер, а ждут его результата или
+    исключения. Завершённые вызовы не кэшируются.
+    """
+    
+    def __init__(self):
+        self._in_flight: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+    
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Выполняет fn или присоединяется к уже выполняющемуся вызову с тем же ключом.
+        
+        Returns:
+            Результат fn (один и тот же объект для всех объединённых вызовов)
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+def _key_default(value: Any) -> Any:
+    """Сериализация аргументов, которые json не поддерживает, для ключа SingleFlight."""
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+
+def _coalesced(method: Callable) -> Callable:
+    """
+    Объединяет одинаковые одновременные вызовы метода через SingleFlight клиента.
+    
+    Ключ — имя метода и все аргументы со значениями по умолчанию. Списки в
+    результате копируются, чтобы вызывающие не делили один изменяемый объект.
+    """
+    signature = inspect.signature(method)
+    
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.single_flight is None:
+            return method(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        arguments.pop("self")
+        key = (method.__name__, json.dumps(arguments, sort_keys=True, default=_key_default))
+        result = self.single_flight.do(key, lambda: method(self, *args, **kwargs))
+        return list(result) if isinstance(result, list) else result
+    return wrapper
 
 
-class RAGFlowError(Exception):
-    """Исключение для ошибок RAGFlow API."""
-    pass
+def _close_response(future: Future) -> None:
+    """Закрывает ответ завершившегося запроса, который больше никому не нужен."""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    """HTTP-соединение, сообщающее время установки (DNS + TCP) в метрики."""
+    
+    def connect(self) -> None:
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            record_connect(time.perf_counter() - started)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS-соединение, сообщающее время установки (DNS + TCP + TLS) в метрики."""
+    
+    def connect(self) -> None:
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            record_connect(time.perf_counter() - started)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter, пулы которого замеряют установку новых соединений."""
+    
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class _BaseRAGFlowClient:
+    """Общие настройки, построение запросов и разбор ответов для синхронного и асинхронного клиентов."""
+    
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        timeout: int = 30,
+        keep_alive: bool = True,
+        max_retries: int = 2,
+        backoff_factor: float = 0.5,
+        backoff_max: float = 10.0,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        metrics: Optional[ClientMetrics] = None,
+        latency: Optional[LatencyTracker] = None,
+        hedging: Optional[HedgePolicy] = None,
+        compression: bool = True
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        if not keep_alive:
+            self.headers["Connection"] = "close"
+        # Both HTTP stacks offer gzip/deflate by default (plus br/zstd when their decoders are installed)
+        # and decompress the body as it is read; identity turns that off where the CPU matters more
+        if not compression:
+            self.headers["Accept-Encoding"] = "identity"
+        self.compression = compression
+        # Keys of a shared RetrievalCache are scoped by server and API key; only a hash of the key is kept
+        self.cache_namespace = f"{self.base_url} {hashlib.sha256(api_key.encode('utf-8')).hexdigest()}"
+        # A probe can't take longer than one request, so a lost probe is replaced after that
+        self.circuit_breaker = CircuitBreaker(failure_threshold, recovery_timeout, max(recovery_timeout, timeout))
+        self.metrics = metrics
+        # Hedging needs a latency distribution to pick its delay
+        self.latency = latency if latency is not None or hedging is None else LatencyTracker()
+        self.hedging = hedging
+    
+    def _record_exchange(
+        self,
+        path: str,
+        phases: dict[str, float],
+        response_bytes: int,
+        error: Optional[str],
+        transfer_bytes: Optional[int] = None
+    ) -> None:
+        """
+        Учитывает фазы одного HTTP-обмена в текущем вызове и в метриках клиента.
+        
+        response_bytes — размер тела после распаковки, transfer_bytes — сколько
+        байт пришло по сети (None — без сжатия, столько же).
+        """
+        if transfer_bytes is None:
+            transfer_bytes = response_bytes
+        call = current_call()
+        if call is not None:
+            call.add_exchange(phases, response_bytes, transfer_bytes)
+        if self.metrics is not None:
+            self.metrics.record_request(endpoint_label(path), phases, response_bytes, error, transfer_bytes)
+    
+    def _attempt_timeout(self, endpoint: str, final: bool) -> float:
+        """
+        Таймаут попытки запроса: адаптивный для всех попыток, кроме последней.
+        
+        Последняя попытка (и единственная у неидемпотентных запросов, например
+        ответов чата) всегда получает полный timeout клиента, поэтому
+        адаптивный таймаут не отклоняет запросы, которые уложились бы в него.
+        """
+        if final or self.latency is None:
+            return self.timeout
+        return self.latency.timeout_for(endpoint, self.timeout)
+    
+    def _hedge_delay(self, path: str) -> Optional[float]:
+        """Через сколько секунд дублировать запрос, или None, если дублировать не нужно."""
+        if self.hedging is None:
+            return None
+        return self.hedging.delay(self.latency, endpoint_label(path))
+    
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Задержка перед повтором: Retry-After от сервера либо
+        экспоненциальный backoff с полным джиттером.
+        """
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+    
+    @staticmethod
+    def _dataset_list_params(
+        page: Optional[int],
+        page_size: Optional[int],
+        orderby: Optional[str],
+        desc: Optional[bool]
+    ) -> dict:
+        """Параметры запроса списка датасетов; незаданные не передаются."""
+        params = {"page": page, "page_size": page_size, "orderby": orderby}
+        params = {k: v for k, v in params.items() if v is not None}
+        if desc is not None:
+            params["desc"] = "true" if desc else "false"
+        return params
+    
+    @staticmethod
+    def _retrieval_payload(
+        question: str,
+        dataset_ids: list[str],
+        document_ids: Optional[list[str]],
+        similarity_threshold: float,
+        vector_similarity_weight: float,
+        top_k: int,
+        page: int,
+        page_size: int,
+        highlight: bool,
+        keyword: bool,
+        use_kg: bool,
+        rerank_id: Optional[str]
+    ) -> dict:
+        """Формирует тело запроса к /api/v1/retrieval."""
+        payload = {
+            "question": question,
+            "dataset_ids": dataset_ids,
+            "similarity_threshold": similarity_threshold,
+            "vector_similarity_weight": vector_similarity_weight,
+            "top_k": top_k,
+            "page": page,
+            "page_size": page_size,
+            "highlight": highlight,
+            "keyword": keyword,
+            "use_kg": use_kg
+        }
+        
+        if document_ids:
+            payload["document_ids"] = document_ids
+        if rerank_id:
+            payload["rerank_id"] = rerank_id
+        return payload
+    
+    @staticmethod
+    def _projection(fields: Optional[Iterable[str]], kwargs: dict) -> tuple[Optional[frozenset], dict]:
+        """
+        Проекция выдачи на атрибуты Chunk со стороны сервера.
+        
+        RAGFlow не умеет отдавать выборочные поля чанка, но подсветку
+        (копию content с разметкой) присылает только по highlight=True,
+        поэтому без "highlight" в fields она не запрашивается.
+        
+        Returns:
+            Пара (fields как frozenset, параметры retrieve_chunks)
+        """
+        if fields is None:
+            return None, kwargs
+        fields = frozenset(fields)
+        if "highlight" not in fields and kwargs.get("highlight", True):
+            kwargs = {**kwargs, "highlight": False}
+        return fields, kwargs
+    
+    def extract_chunks(self, retrieval_response: dict, fields: Optional[Iterable[str]] = None) -> list[Chunk]:
+        """
+        Извлекает список чанков из ответа API.
+        
+        Args:
+            retrieval_response: Ответ от API retrieval
+            fields: Какие атрибуты Chunk заполнять (None — все); остальные
+                получают значения по умолчанию, например "" вместо content
+            
+        Returns:
+            Список объектов Chunk
+        """
+        if retrieval_response.get("code") != 0:
+            raise RAGFlowError(f"API Error: {retrieval_response.get('message')}")
+        
+        with timed_phase("extract"):
+            return self._build_chunks(retrieval_response.get("data", {}).get("chunks", []), fields)
+    
+    @staticmethod
+    def _build_chunks(chunks_data: list[dict], fields: Optional[Iterable[str]]) -> list[Chunk]:
+        """Строит объекты Chunk из сырых чанков ответа."""
+        if fields is None:
+            # Positional construction is the hot path at large top_k
+            return [
+                Chunk(
+                    chunk.get("content", ""),
+                    chunk.get("similarity", 0.0),
+                    chunk.get("vector_similarity", 0.0),
+                    chunk.get("term_similarity", 0.0),
+                    chunk.get("document_id", ""),
+                    chunk.get("document_keyword", "Unknown"),
+                    chunk.get("id", ""),
+                    chunk.get("highlight"),
+                    chunk.get("kb_id")
+                )
+                for chunk in chunks_data
+            ]
+        
+        wanted = set(fields)
+        unknown = wanted - CHUNK_FIELDS.keys()
+        if unknown:
+            raise ValueError(f"Unknown Chunk fields: {', '.join(sorted(unknown))}")
+        specs = [(key, default, name in wanted) for name, (key, default) in CHUNK_FIELDS.items()]
+        return [
+            Chunk(*[chunk.get(key, default) if keep else default for key, default, keep in specs])
+            for chunk in chunks_data
+        ]
 
 
-class RAGFlowClient:
+class RAGFlowClient(_BaseRAGFlowClient):
     """Клиент для работы с RAGFlow HTTP API."""
     
-    def __init__(self, base_url: str, api_key: str, timeout: int = 30):
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        timeout: int = 30,
+        pool_size: int = 10,
+        keep_alive: bool = True,
+        max_retries: int = 2,
+        backoff_factor: float = 0.5,
+        backoff_max: float = 10.0,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        cache: Optional[RetrievalCache] = None,
+        superset_cache: Optional[SupersetCache] = None,
+        session_pool_size: int = 0,
+        session_max_turns: int = 10,
+        session_max_age: float = 1800.0,
+        metrics: Optional[ClientMetrics] = None,
+        coalesce: bool = False,
+        kg_cache: Optional[KnowledgeGraphCache] = None,
+        latency: Optional[LatencyTracker] = None,
+        hedging: Optional[HedgePolicy] = None,
+        admission: Optional[AdmissionController] = None,
+        compression: bool = True
+    ):
         """
         Инициализация клиента RAGFlow.
         
@@ -37,14 +1730,241 @@ class RAGFlowClient:
             base_url: URL адрес RAGFlow сервера (например, "http://localhost:9380")
             api_key: API ключ для авторизации
             timeout: Таймаут запросов в секундах
+            pool_size: Максимальное число соединений в пуле
+            keep_alive: Переиспользовать соединения между запросами
+            max_retries: Число повторов идемпотентных запросов
+            backoff_factor: Базовая задержка экспоненциального backoff в секундах
+            backoff_max: Максимальная задержка между повторами в секундах
+            failure_threshold: Ошибок подряд до размыкания предохранителя (0 — отключить)
+            recovery_timeout: Время в секундах до пробного запроса после размыкания
+            cache: Кэш ответов retrieval (None — без кэширования)
+            superset_cache: Кэш надмножеств выдачи для search (None — не использовать)
+            session_pool_size: Сколько свободных сессий чата держать на ассистента
+                (0 — создавать новую сессию на каждый вопрос)
+            session_max_turns: После скольких вопросов сессия чата заменяется новой
+            session_max_age: Максимальный возраст сессии чата в секундах
+            metrics: Сборщик метрик задержки по фазам запросов (None — не собирать)
+            coalesce: Объединять одинаковые одновременные вызовы search,
+                list_datasets и get_mind_map в один запрос к серверу
+            kg_cache: Кэш ответов knowledge_graph для get_mind_map (None — без кэширования)
+            latency: Распределение задержек по эндпоинтам для адаптивных таймаутов
+                повторяемых попыток (None — всегда фиксированный timeout)
+            hedging: Политика дублирования медленных запросов retrieval
+                (None — не дублировать); без latency клиент заводит свой трекер
+            admission: Контроль допуска запросов retrieval и ответов чата
+                (None — без ограничений); см. get_admission_controller
+            compression: Принимать сжатые ответы (gzip/deflate, br и zstd при
+                установленных brotli и zstandard); False — только без сжатия
         """
-        self.base_url = base_url.rstrip('/')
-        self.api_key = api_key
-        self.timeout = timeout
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
+        super().__init__(
+            base_url, api_key, timeout, keep_alive, max_retries,
+            backoff_factor, backoff_max, failure_threshold, recovery_timeout, metrics,
+            latency, hedging, compression
+        )
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = _TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool_size = pool_size
+        self.cache = cache
+        self.superset_cache = superset_cache
+        self.kg_cache = kg_cache
+        self.session_pool_size = session_pool_size
+        self.session_max_turns = session_max_turns
+        self.session_max_age = session_max_age
+        self._session_pools: dict[str, ChatSessionPool] = {}
+        self._session_pools_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self.single_flight = SingleFlight() if coalesce else None
+        self.admission = admission
+    
+    def close(self) -> None:
+        """
+        Удаляет сессии чата из пулов и закрывает пул соединений
+        и пул потоков параллельных запросов.
+        """
+        with self._session_pools_lock:
+            pools, self._session_pools = list(self._session_pools.values()), {}
+        for pool in pools:
+            try:
+                pool.close()
+            except RAGFlowError:
+                pass
+        for executor in (self._executor, self._hedge_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._hedge_executor = None
+        self.session.close()
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Пул потоков для параллельных запросов, по размеру совпадает с пулом соединений."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.pool_size, thread_name_prefix="ragflow-fanout"
+                )
+            return self._executor
+    
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        """
+        Пул потоков для продублированных запросов.
+        
+        Отдельный от пула fan-out: поиск из потока fan-out ждёт свои
+        попытки, и в общем пуле они могли бы не дождаться свободного потока.
+        """
+        with self._executor_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=self.pool_size * 2, thread_name_prefix="ragflow-hedge"
+                )
+            return self._hedge_executor
+    
+    def __enter__(self) -> "RAGFlowClient":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+    
+    def _admission_slot(self, path: str):
+        """Слот контроля допуска для запроса (пустой контекст, если контроля нет)."""
+        return self.admission.slot(path) if self.admission is not None else nullcontext()
+    
+    def _request(self, method: str, path: str, idempotent: bool = False, **kwargs) -> requests.Response:
+        """
+        Выполняет HTTP-запрос через пул соединений.
+        
+        Идемпотентные запросы повторяются при сбоях соединения и ответах
+        429/5xx. Пока предохранитель разомкнут, запрос сразу отклоняется.
+        Каждая попытка замеряется по фазам: соединение, ожидание заголовков
+        ответа (TTFB) и загрузка тела (для stream=True тело не читается);
+        сжатое тело распаковывается по мере чтения.
+        Если у клиента есть latency, попытки кроме последней ограничены
+        адаптивным таймаутом. Каждая попытка ждёт допуска у admission и
+        только после него спрашивает предохранитель; потоковый ответ держит
+        слот вызывающая сторона.
+        
+        Raises:
+            CircuitOpenError: Если предохранитель разомкнут
+            AdmissionRejectedError: Если попытку не допустил контроль допуска
+            requests.RequestException: Если все попытки неудачны
+        """
+        url = f"{self.base_url}{path}"
+        stream = kwargs.pop("stream", False)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        latency = self.latency if not stream else None
+        endpoint = endpoint_label(path) if latency is not None else None
+        fixed_timeout = "timeout" in kwargs
+        
+        for attempt in range(attempts):
+            if not fixed_timeout:
+                kwargs["timeout"] = (
+                    self.timeout if latency is None else self._attempt_timeout(endpoint, attempt + 1 >= attempts)
+                )
+            adaptive = not fixed_timeout and kwargs["timeout"] < self.timeout
+            phases = {}
+            allowed = False
+            try:
+                with self._admission_slot(path) if not stream else nullcontext():
+                    # The breaker is asked only once admitted, so a request rejected or still queued
+                    # by admission control never holds the probe
+                    if not self.circuit_breaker.allow():
+                        raise CircuitOpenError(f"RAGFlow is unavailable, circuit open: {self.base_url}")
+                    allowed = True
+                    started = time.perf_counter()
+                    # Headers and body are read separately so time to first byte and transfer can be told apart
+                    with track_exchange() as phases:
+                        response = self.session.request(method, url, stream=True, **kwargs)
+                    phases["ttfb"] = time.perf_counter() - started - phases.get("connect", 0.0)
+                    if not stream:
+                        body_started = time.perf_counter()
+                        response.content
+                        phases["transfer"] = time.perf_counter() - body_started
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record_exchange(path, phases, 0, type(e).__name__)
+                # Running out of an adaptive timeout says the reply is late, not that the backend is down,
+                # so the next attempt goes out right away and the breaker isn't charged
+                late = adaptive and isinstance(e, requests.Timeout)
+                if not late:
+                    self.circuit_breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+                if not late:
+                    time.sleep(self._backoff_delay(attempt))
+                continue
+            except requests.RequestException as e:
+                # Any other transport error (a broken chunked body, undecodable content, ...) isn't retried
+                # but still counts against the breaker, so a probe that hit it is settled
+                self._record_exchange(path, phases, 0, type(e).__name__)
+                self.circuit_breaker.record_failure()
+                raise
+            except BaseException:
+                # Interrupted before the server's answer was seen: the next request becomes the probe
+                if allowed:
+                    self.circuit_breaker.release()
+                raise
+            
+            self._record_exchange(
+                path, phases, 0 if stream else len(response.content),
+                f"http_{response.status_code}" if response.status_code >= 400 else None,
+                # Bytes pulled off the socket, before the Content-Encoding is undone
+                0 if stream else response.raw.tell()
+            )
+            if latency is not None and response.status_code < 400:
+                latency.observe(endpoint, time.perf_counter() - started)
+            
+            # 429 means the backend is alive but busy, so it doesn't trip the breaker
+            if response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+            
+            if response.status_code in RETRY_STATUSES and attempt + 1 < attempts:
+                delay = self._backoff_delay(attempt, response.headers.get("Retry-After"))
+                response.close()
+                time.sleep(delay)
+                continue
+            return response
+        
+        return response
+    
+    def _hedged_request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Идемпотентный запрос с дублированием по политике hedging.
+        
+        Если ответ не пришёл за задержку политики и бюджет позволяет,
+        отправляется второй такой же запрос; возвращается первый успешный
+        ответ. Проигравший запрос отменяется, если ещё не начался, иначе
+        его ответ закрывается по завершении (прервать идущий запрос
+        requests не позволяет).
+        """
+        delay = self._hedge_delay(path)
+        if delay is None:
+            return self._request(method, path, idempotent=True, **kwargs)
+        
+        executor = self._get_hedge_executor()
+        attempt = functools.partial(self._request, method, path, True, **kwargs)
+        # Each attempt runs in the caller's context so its phases count towards the caller's call timing
+        attempts = [executor.submit(contextvars.copy_context().run, attempt)]
+        done, _ = wait(attempts, timeout=delay)
+        if not done and self.hedging.acquire():
+            attempts.append(executor.submit(contextvars.copy_context().run, attempt))
+        pending = set(attempts)
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((f for f in attempts if f in done and f.exception() is None), None)
+        if winner is None:
+            return attempts[0].result()
+        
+        for loser in attempts:
+            if loser is not winner and not loser.cancel():
+                loser.add_done_callback(_close_response)
+        if len(attempts) > 1:
+            self.hedging.record_winner(winner is attempts[1])
+        return winner.result()
     
     def test_connection(self) -> bool:
         """
@@ -54,25 +1974,40 @@ class RAGFlowClient:
             True если подключение успешно
         """
         try:
-            url = f"{self.base_url}/api/v1/system/health"
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
+            response = self._request("GET", "/api/v1/system/health", idempotent=True)
             return response.status_code == 200
-        except requests.RequestException:
+        except (requests.RequestException, RAGFlowError):
             return False
     
-    def list_datasets(self) -> list[dict]:
+    @instrumented
+    @_coalesced
+    def list_datasets(
+        self,
+        page: Optional[int] = None,
+        page_size: Optional[int] = None,
+        orderby: Optional[str] = None,
+        desc: Optional[bool] = None
+    ) -> list[dict]:
         """
-        Получает список всех датасетов.
+        Получает список датасетов.
+        
+        Args:
+            page: Номер страницы (None — значение сервера по умолчанию)
+            page_size: Размер страницы
+            orderby: Поле сортировки ("create_time" или "update_time")
+            desc: Сортировать по убыванию
         
         Returns:
-            Список датасетов с их ID и названиями
+            Список датасетов с их ID, названиями и метаданными
         """
-        url = f"{self.base_url}/api/v1/datasets"
-        
         try:
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
+            response = self._request(
+                "GET", "/api/v1/datasets", idempotent=True,
+                params=self._dataset_list_params(page, page_size, orderby, desc)
+            )
             response.raise_for_status()
-            data = response.json()
+            with timed_phase("decode"):
+                data = response.json()
             
             if data.get("code") != 0:
                 raise RAGFlowError(f"API Error: {data.get('message')}")
@@ -81,6 +2016,7 @@ class RAGFlowClient:
         except requests.RequestException as e:
             raise RAGFlowError(f"Connection error: {str(e)}")
     
+    @instrumented
     def retrieve_chunks(
         self,
         question: str,
@@ -98,130 +2034,524 @@ class RAGFlowClient:
     ) -> dict:
         """
         Получение семантически близких чанков по запросу.
-        """
-        url = f"{self.base_url}/api/v1/retrieval"
         
-        payload = {
-            "question": question,
-            "dataset_ids": dataset_ids,
-            "similarity_threshold": similarity_threshold,
-            "vector_similarity_weight": vector_similarity_weight,
-            "top_k": top_k,
-            "page": page,
-            "page_size": page_size,
-            "highlight": highlight,
-            "keyword": keyword,
-            "use_kg": use_kg
-        }
+        Если клиенту передан кэш, успешные ответы сохраняются в нём,
+        а повторные запросы с теми же параметрами обслуживаются из кэша.
+        """
+        tag_datasets(dataset_ids)
+        payload = self._retrieval_payload(
+            question, dataset_ids, document_ids, similarity_threshold, vector_similarity_weight,
+            top_k, page, page_size, highlight, keyword, use_kg, rerank_id
+        )
         
-        if document_ids:
-            payload["document_ids"] = document_ids
-        if rerank_id:
-            payload["rerank_id"] = rerank_id
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(payload, self.cache_namespace)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
         
         try:
-            response = requests.post(
-                url, 
-                headers=self.headers, 
-                json=payload, 
-                timeout=self.timeout
-            )
+            response = self._hedged_request("POST", "/api/v1/retrieval", json=payload)
             response.raise_for_status()
-            return response.json()
+            with timed_phase("decode"):
+                data = _json_loads(response.content)
         except requests.RequestException as e:
             raise RAGFlowError(f"Request failed: {str(e)}")
+        except ValueError as e:
+            raise RAGFlowError(f"Invalid retrieval response: {str(e)}")
+        
+        if cache_key is not None and data.get("code") == 0:
+            self.cache.put(cache_key, dataset_ids, data)
+        return data
 
-    def get_mind_map(self, dataset_id: str) -> dict:
+    @instrumented
+    @_coalesced
+    def get_mind_map(self, dataset_id: str, version: Optional[str] = None) -> dict:
         """
         Получает данные ментальной карты для датасета.
+        
+        Если клиенту передан kg_cache, свежий граф отдаётся из кэша без
+        запроса, а устаревший проверяется условным запросом.
+        
+        Args:
+            dataset_id: ID датасета
+            version: Версия датасета (например, update_time); пока она не
+                изменилась, граф из кэша не перепроверяется
         """
-        url = f"{self.base_url}/api/v1/datasets/{dataset_id}/knowledge_graph"
+        tag_datasets([dataset_id])
+        cache = self.kg_cache
+        entry = None
+        headers = {}
+        if cache is not None:
+            entry, fresh = cache.lookup(dataset_id, version)
+            if fresh:
+                return entry.data
+            if entry is not None and entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry is not None and entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        
         try:
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
+            response = self._request(
+                "GET", f"/api/v1/datasets/{dataset_id}/knowledge_graph", idempotent=True, headers=headers
+            )
+            if response.status_code == 304 and entry is not None:
+                cache.revalidated(dataset_id, version)
+                return entry.data
             response.raise_for_status()
-            data = response.json()
+            body = response.content
+            if entry is not None and cache.content_hash(body) == entry.content_hash:
+                # Same graph sent in full: skip parsing and keep the cached object
+                cache.revalidated(dataset_id, version)
+                return entry.data
+            with timed_phase("decode"):
+                data = _json_loads(body)
             if data.get("code") != 0:
                 raise RAGFlowError(f"API Error: {data.get('message')}")
-            return data.get("data", {})
         except requests.RequestException as e:
             raise RAGFlowError(f"Failed to fetch mind map: {str(e)}")
+        except ValueError as e:
+            raise RAGFlowError(f"Invalid knowledge graph response: {str(e)}")
+        
+        graph = data.get("data", {})
+        if cache is not None:
+            cache.put(
+                dataset_id, graph, body,
+                response.headers.get("ETag"), response.headers.get("Last-Modified"), version
+            )
+        return graph
+
+    def _create_chat_session(self, assistant_id: str) -> str:
+        """Создаёт сессию чата с ассистентом и возвращает её ID."""
+        try:
+            s_resp = self._request("POST", f"/api/v1/chats/{assistant_id}/sessions")
+            s_resp.raise_for_status()
+            s_data = s_resp.json()
+            if s_data.get("code") != 0:
+                raise RAGFlowError(f"Failed to create session: {s_data.get('message')}")
+            return s_data.get("data", {}).get("id")
+        except requests.RequestException as e:
+            raise RAGFlowError(f"Session creation failed: {str(e)}")
+
+    def delete_chat_sessions(self, assistant_id: str, session_ids: list[str]) -> None:
+        """Удаляет сессии чата ассистента одним запросом."""
+        try:
+            response = self._request("DELETE", f"/api/v1/chats/{assistant_id}/sessions", json={"ids": session_ids})
+            response.raise_for_status()
+            data = response.json()
+            if data.get("code") != 0:
+                raise RAGFlowError(f"Failed to delete sessions: {data.get('message')}")
+        except requests.RequestException as e:
+            raise RAGFlowError(f"Session deletion failed: {str(e)}")
+
+    def session_pool(self, assistant_id: str) -> ChatSessionPool:
+        """Возвращает пул сессий чата для ассистента, создавая его при первом обращении."""
+        with self._session_pools_lock:
+            pool = self._session_pools.get(assistant_id)
+            if pool is None:
+                pool = ChatSessionPool(
+                    create_session=lambda: self._create_chat_session(assistant_id),
+                    delete_sessions=lambda ids: self.delete_chat_sessions(assistant_id, ids),
+                    max_idle=self.session_pool_size,
+                    max_turns=self.session_max_turns,
+                    max_age=self.session_max_age
+                )
+                self._session_pools[assistant_id] = pool
+            return pool
+
+    @contextmanager
+    def _chat_session(self, assistant_id: str, session_id: Optional[str]) -> Iterator[str]:
+        """Сессия для вопроса: переданная явно, арендованная из пула или новая."""
+        if session_id:
+            yield session_id
+        elif self.session_pool_size > 0:
+            pool = self.session_pool(assistant_id)
+            with pool.lease() as leased_id:
+                yield leased_id
+            # Replacements for retired sessions are created off the caller's path,
+            # so even single-use sessions (session_max_turns=1) stay warm
+            self._get_executor().submit(pool.prewarm, self.session_pool_size)
+        else:
+            yield self._create_chat_session(assistant_id)
 
+    @instrumented
     def get_ai_summary(self, assistant_id: str, question: str, session_id: Optional[str] = None) -> dict:
         """
         Генерирует ИИ-резюме через чат-ассистента.
+        
+        Без session_id сессия берётся из пула (если session_pool_size > 0)
+        или создаётся заново.
         """
-        # 1. Create session if not provided
-        if not session_id:
-            session_url = f"{self.base_url}/api/v1/chats/{assistant_id}/sessions"
-            try:
-                s_resp = requests.post(session_url, headers=self.headers, timeout=self.timeout)
-                s_resp.raise_for_status()
-                s_data = s_resp.json()
-                if s_data.get("code") != 0:
-                    raise RAGFlowError(f"Failed to create session: {s_data.get('message')}")
-                session_id = s_data.get("data", {}).get("id")
-            except requests.RequestException as e:
-                raise RAGFlowError(f"Session creation failed: {str(e)}")
+        with self._chat_session(assistant_id, session_id) as session_id:
+            return self._ask_chat(assistant_id, session_id, question)
 
-        # 2. Ask question
-        chat_url = f"{self.base_url}/api/v1/chats/{assistant_id}/sessions/{session_id}/completions"
+    def _ask_chat(self, assistant_id: str, session_id: str, question: str) -> dict:
+        """Задаёт вопрос в сессии чата без потоковой передачи."""
+        chat_path = f"/api/v1/chats/{assistant_id}/sessions/{session_id}/completions"
         payload = {
             "question": question,
             "stream": False
         }
         try:
-            response = requests.post(chat_url, headers=self.headers, json=payload, timeout=self.timeout)
+            response = self._request("POST", chat_path, json=payload)
             response.raise_for_status()
-            return response.json()
+            with timed_phase("decode"):
+                return response.json()
         except requests.RequestException as e:
             raise RAGFlowError(f"Summary request failed: {str(e)}")
 
-    def extract_chunks(self, retrieval_response: dict) -> list[Chunk]:
+    def stream_ai_summary(
+        self,
+        assistant_id: str,
+        question: str,
+        session_id: Optional[str] = None,
+        cancel_event: Optional[threading.Event] = None
+    ) -> Iterator[SummaryDelta]:
         """
-        Извлекает список чанков из ответа API.
+        Потоковое ИИ-резюме: разбирает SSE-поток эндпоинта completions.
         
         Args:
-            retrieval_response: Ответ от API retrieval
+            assistant_id: ID чат-ассистента
+            question: Вопрос
+            session_id: ID сессии (если не передан, берётся из пула или создаётся новая)
+            cancel_event: При установке события поток закрывается, генератор завершается
             
-        Returns:
-            Список объектов Chunk
+        Yields:
+            SummaryDelta с новым фрагментом текста, накопленным ответом и ссылками;
+            последний элемент имеет done=True
         """
-        if retrieval_response.get("code") != 0:
-            raise RAGFlowError(f"API Error: {retrieval_response.get('message')}")
+        try:
+            with self._chat_session(assistant_id, session_id) as session_id:
+                yield from self._stream_chat(assistant_id, session_id, question, cancel_event)
+                if cancel_event is not None and cancel_event.is_set():
+                    # The server may still append the cut-off answer to this session, so don't reuse it
+                    raise _StreamCancelled()
+        except _StreamCancelled:
+            return
+
+    def _stream_chat(
+        self,
+        assistant_id: str,
+        session_id: str,
+        question: str,
+        cancel_event: Optional[threading.Event]
+    ) -> Iterator[SummaryDelta]:
+        """Задаёт вопрос в сессии чата и разбирает SSE-поток ответа."""
+        chat_path = f"/api/v1/chats/{assistant_id}/sessions/{session_id}/completions"
+        payload = {
+            "question": question,
+            "stream": True
+        }
+        # A streamed answer holds its admission slot until the stream ends
+        with self._admission_slot(chat_path):
+            try:
+                response = self._request("POST", chat_path, json=payload, stream=True)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                raise RAGFlowError(f"Summary request failed: {str(e)}")
+
+            answer = ""
+            reference = None
+            # SSE is always UTF-8; without a charset requests would fall back to Latin-1 or bytes
+            response.encoding = "utf-8"
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if cancel_event is not None and cancel_event.is_set():
+                        return
+                    if not line or not line.startswith("data:"):
+                        continue
+
+                    try:
+                        message = _json_loads(line[len("data:"):])
+                    except ValueError as e:
+                        raise RAGFlowError(f"Invalid summary stream event: {str(e)}")
+                    if not isinstance(message, dict):
+                        raise RAGFlowError(f"Invalid summary stream event: {line[:100]}")
+                    if message.get("code") != 0:
+                        raise RAGFlowError(f"API Error: {message.get('message')}")
+                    data = message.get("data")
+                    # The server closes the stream with `"data": true`
+                    if data is True:
+                        break
+                    if not isinstance(data, dict):
+                        continue
+
+                    # RAGFlow sends the cumulative answer; incremental servers send only the new piece
+                    chunk = data.get("answer", "")
+                    text = chunk[len(answer):] if chunk.startswith(answer) else chunk
+                    answer = chunk if chunk.startswith(answer) else answer + chunk
+                    reference = data.get("reference") or reference
+                    if text:
+                        yield SummaryDelta(text=text, answer=answer, reference=reference)
+            except requests.RequestException as e:
+                raise RAGFlowError(f"Summary stream failed: {str(e)}")
+            finally:
+                response.close()
+
+        yield SummaryDelta(text="", answer=answer, reference=reference, done=True)
+
+    def iter_chunks(
+        self,
+        question: str,
+        dataset_ids: list[str],
+        page_size: int = 100,
+        limit: Optional[int] = None,
+        similarity_threshold: float = 0.2,
+        top_k: int = 1024,
+        prefetch: bool = True,
+        fields: Optional[Iterable[str]] = None,
+        **kwargs
+    ) -> Iterator[Chunk]:
+        """
+        Ленивый обход выдачи постранично.
         
-        chunks_data = retrieval_response.get("data", {}).get("chunks", [])
+        Пока вызывающий код обрабатывает текущую страницу, следующая
+        загружается в фоне, поэтому в памяти находятся не более двух страниц.
         
-        return [
-            Chunk(
-                content=chunk.get("content", ""),
-                similarity=chunk.get("similarity", 0.0),
-                vector_similarity=chunk.get("vector_similarity", 0.0),
-                term_similarity=chunk.get("term_similarity", 0.0),
-                document_id=chunk.get("document_id", ""),
-                document_name=chunk.get("document_keyword", "Unknown"),
-                chunk_id=chunk.get("id", ""),
-                highlight=chunk.get("highlight")
+        Args:
+            question: Поисковый запрос
+            dataset_ids: Список ID датасетов
+            page_size: Размер страницы
+            limit: Максимум чанков (None — пока сервер отдаёт результаты)
+            similarity_threshold: Порог схожести; обход прекращается на первом чанке ниже порога
+            top_k: Число кандидатов, из которых сервер формирует страницы
+            prefetch: Загружать следующую страницу заранее
+            fields: Какие атрибуты Chunk заполнять (None — все); без "highlight"
+                подсветка не запрашивается у сервера
+            **kwargs: Остальные параметры retrieve_chunks
+            
+        Yields:
+            Объекты Chunk в порядке убывания схожести
+        """
+        fields, kwargs = self._projection(fields, kwargs)
+        
+        def fetch(page: int) -> tuple[list[Chunk], Optional[int]]:
+            response = self.retrieve_chunks(
+                question=question,
+                dataset_ids=dataset_ids,
+                similarity_threshold=similarity_threshold,
+                top_k=top_k,
+                page=page,
+                page_size=page_size,
+                **kwargs
             )
-            for chunk in chunks_data
-        ]
+            return self.extract_chunks(response, fields), response.get("data", {}).get("total")
+
+        executor = self._get_executor() if prefetch else None
+        page = 1
+        produced = 0
+        next_page = None
+        try:
+            chunks, total = fetch(page)
+            while chunks:
+                fetched = page * page_size
+                has_more = len(chunks) == page_size and (total is None or fetched < total)
+                if has_more and (limit is None or fetched < limit) and executor is not None:
+                    # The prefetch keeps the caller's priority lane and call timing
+                    next_page = executor.submit(contextvars.copy_context().run, fetch, page + 1)
+
+                for chunk in chunks:
+                    if chunk.similarity < similarity_threshold or (limit is not None and produced >= limit):
+                        return
+                    produced += 1
+                    yield chunk
+
+                if not has_more or (limit is not None and produced >= limit):
+                    return
+                page += 1
+                if next_page is not None:
+                    chunks, total = next_page.result()
+                    next_page = None
+                else:
+                    chunks, total = fetch(page)
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    @instrumented
+    def fan_out_search(
+        self,
+        question: str,
+        dataset_ids: list[str],
+        top_k: int = 5,
+        similarity_threshold: float = 0.2,
+        group_size: int = 1,
+        latency_budget: Optional[float] = None,
+        **kwargs
+    ) -> FanOutResult:
+        """
+        Параллельный поиск: отдельный запрос на каждую группу датасетов
+        и слияние результатов в общий top_k.
+        
+        Args:
+            question: Поисковый запрос
+            dataset_ids: Список ID датасетов
+            top_k: Размер итоговой выдачи
+            similarity_threshold: Порог схожести
+            group_size: Сколько датасетов отправлять в одном запросе
+            latency_budget: Сколько секунд ждать ответов; не успевшие датасеты
+                попадают в FanOutResult.timed_out
+            **kwargs: Остальные параметры retrieve_chunks
+            
+        Returns:
+            FanOutResult с объединёнными чанками и списком неответивших датасетов
+        
+        Raises:
+            RAGFlowError: Если все запросы завершились ошибкой
+        """
+        tag_datasets(dataset_ids)
+        executor = self._get_executor()
+        # Each request runs in the caller's context, so it keeps the priority lane and counts towards the call timing
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run,
+                self.search,
+                question=question,
+                dataset_ids=group,
+                top_k=top_k,
+                similarity_threshold=similarity_threshold,
+                **kwargs
+            ): group
+            for group in _group_datasets(dataset_ids, group_size)
+        }
+        done, not_done = wait(futures, timeout=latency_budget)
+        
+        result = FanOutResult(chunks=[])
+        chunk_lists = []
+        for future in not_done:
+            future.cancel()
+            result.timed_out.extend(futures[future])
+        for future in done:
+            try:
+                chunk_lists.append(future.result())
+            except RAGFlowError as e:
+                for dataset_id in futures[future]:
+                    result.failed[dataset_id] = str(e)
+        
+        if not chunk_lists and result.failed and not result.timed_out:
+            raise RAGFlowError(f"All dataset requests failed: {next(iter(result.failed.values()))}")
+        
+        result.chunks = merge_top_k(chunk_lists, top_k)
+        return result
     
+    @instrumented
+    @_coalesced
     def search(
         self,
         question: str,
         dataset_ids: list[str],
         top_k: int = 5,
         similarity_threshold: float = 0.2,
+        fan_out: bool = False,
+        fields: Optional[Iterable[str]] = None,
         **kwargs
     ) -> list[Chunk]:
         """
         Упрощённый метод поиска чанков.
+        
+        При fan_out=True датасеты опрашиваются параллельно через fan_out_search;
+        отчёт о неответивших датасетах доступен только через fan_out_search.
+        Если задан superset_cache, сужение уже выполненного запроса
+        обслуживается без обращения к серверу. fields ограничивает заполняемые
+        атрибуты Chunk (см. extract_chunks); без "highlight" в fields подсветка
+        не запрашивается у сервера. При coalesce=True одинаковые одновременные
+        вызовы получают общий результат одного запроса.
         """
+        fields, kwargs = self._projection(fields, kwargs)
+        if fan_out and len(dataset_ids) > 1:
+            return self.fan_out_search(
+                question, dataset_ids, top_k=top_k, similarity_threshold=similarity_threshold,
+                fields=fields, **kwargs
+            ).chunks
+        
+        superset = self.superset_cache
+        if superset is None or "page" in kwargs:
+            response = self.retrieve_chunks(
+                question=question,
+                dataset_ids=dataset_ids,
+                top_k=top_k,
+                page_size=top_k,
+                similarity_threshold=similarity_threshold,
+                **kwargs
+            )
+            return self.extract_chunks(response, fields)
+        
+        if fields is not None:
+            # Slicing the superset needs scores and document ids
+            fields = set(fields) | {"similarity", "document_id", "chunk_id"}
+        fingerprint = superset.fingerprint(
+            question, dataset_ids, fields=sorted(fields) if fields is not None else None, **kwargs
+        )
+        document_ids = kwargs.get("document_ids")
+        cached = superset.lookup(fingerprint, top_k, similarity_threshold, document_ids)
+        if cached is not None:
+            return cached
+        
+        fetch_k = superset.fetch_size(top_k)
         response = self.retrieve_chunks(
             question=question,
             dataset_ids=dataset_ids,
-            top_k=top_k,
-            page_size=top_k,
+            top_k=fetch_k,
+            page_size=fetch_k,
             similarity_threshold=similarity_threshold,
             **kwargs
         )
-        return self.extract_chunks(response)
+        chunks = self.extract_chunks(response, fields)
+        superset.store(fingerprint, chunks, fetch_k, similarity_threshold, document_ids)
+        return chunks[:top_k]
+
+
+_shared_clients: dict[tuple[str, str], RAGFlowClient] = {}
+_shared_clients_lock = threading.Lock()
+_admission_controllers: dict[tuple[str, str], AdmissionController] = {}
+_admission_controllers_lock = threading.Lock()
+
+
+def get_shared_client(base_url: str, api_key: str, **kwargs) -> RAGFlowClient:
+    """
+    Общий на весь процесс клиент для пары (URL, API ключ).
+    
+    Первый вызов создаёт клиента с переданными параметрами конструктора
+    (по умолчанию с coalesce=True и общим для пары AdmissionController);
+    последующие вызовы с той же парой возвращают его же, а kwargs
+    игнорируют. Клиенты закрываются при завершении процесса.
+    
+    Returns:
+        Потокобезопасный RAGFlowClient, разделяемый всеми вызывающими
+    """
+    key = (base_url.rstrip('/'), api_key)
+    with _shared_clients_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            if not _shared_clients:
+                atexit.register(_close_shared_clients)
+            kwargs.setdefault("coalesce", True)
+            if "admission" not in kwargs:
+                kwargs["admission"] = get_admission_controller(base_url, api_key, metrics=kwargs.get("metrics"))
+            client = _shared_clients[key] = RAGFlowClient(base_url, api_key, **kwargs)
+        return client
+
+
+def get_admission_controller(base_url: str, api_key: str, **kwargs) -> AdmissionController:
+    """
+    Общий на весь процесс контроль допуска для пары (URL, API ключ).
+    
+    Лимиты сервера и ключа общие для всех клиентов, поэтому все клиенты
+    пары должны получать допуск у одного контроллера. Первый вызов создаёт
+    его с переданными параметрами конструктора, последующие kwargs игнорируют.
+    """
+    key = (base_url.rstrip('/'), api_key)
+    with _admission_controllers_lock:
+        controller = _admission_controllers.get(key)
+        if controller is None:
+            controller = _admission_controllers[key] = AdmissionController(**kwargs)
+        return controller
+
+
+def _close_shared_clients() -> None:
+    with _shared_clients_lock:
+        clients = list(_shared_clients.values())
+        _shared_clients.clear()
+    for client in clients:
+        client.close()
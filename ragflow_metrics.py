@@ -0,0 +1,422 @@
+"""
+RAGFlow Client Metrics
+Замеры фаз запросов клиентов RAGFlow (соединение, ожидание ответа, загрузка, разбор) и экспорт гистограмм в формате Prometheus.
+"""
+
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, Optional
+
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Фазы в порядке выполнения: ожидание в очереди допуска, соединение (DNS/TCP/TLS),
+# ожидание заголовков ответа, загрузка тела, разбор JSON, построение объектов Chunk
+PHASES = ("queue", "connect", "ttfb", "transfer", "decode", "extract")
+
+# Path segments that follow these names are ids and are collapsed in endpoint labels
+_ID_PARENTS = frozenset({"datasets", "chats", "sessions", "documents"})
+
+
+# Guards CallTiming updates from the worker threads of one call
+_timing_lock = threading.Lock()
+
+
+@dataclass
+class CallTiming:
+    """Разбивка времени одного вызова метода клиента по фазам."""
+    method: str
+    started_at: float
+    total: float = 0.0
+    phases: dict[str, float] = field(default_factory=dict)
+    requests: int = 0
+    response_bytes: int = 0
+    transfer_bytes: int = 0
+    datasets: list[str] = field(default_factory=list)
+    error: Optional[str] = None
+    
+    def add(self, phase: str, seconds: float) -> None:
+        """Добавляет время к фазе (повторы и несколько запросов суммируются)."""
+        with _timing_lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+    
+    def add_exchange(self, phases: dict[str, float], response_bytes: int, transfer_bytes: int) -> None:
+        """Учитывает один HTTP-обмен вызова; запросы fan-out и дубли приходят из разных потоков."""
+        with _timing_lock:
+            self.requests += 1
+            self.response_bytes += response_bytes
+            self.transfer_bytes += transfer_bytes
+            for phase, seconds in phases.items():
+                self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+    
+    @property
+    def other(self) -> float:
+        """Время вне замеренных фаз: кэш, ожидание между повторами, код клиента."""
+        return max(0.0, self.total - sum(self.phases.values()))
+    
+    @property
+    def compression_ratio(self) -> float:
+        """Во сколько раз тело ответа больше переданного по сети (1.0 — без сжатия)."""
+        return self.response_bytes / self.transfer_bytes if self.transfer_bytes else 1.0
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами в духе Prometheus."""
+    
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float) -> None:
+        """Учитывает одно наблюдение."""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля: верхняя граница корзины, в которую он попадает."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+_current_call: ContextVar[Optional[CallTiming]] = ContextVar("ragflow_current_call", default=None)
+_current_exchange: ContextVar[Optional[dict]] = ContextVar("ragflow_current_exchange", default=None)
+_captured: ContextVar[Optional[list]] = ContextVar("ragflow_captured_calls", default=None)
+
+
+def endpoint_label(path: str) -> str:
+    """
+    Метка эндпоинта для метрик: путь без префикса /api/v1 с ID, заменёнными на {id}.
+    
+    Например, /api/v1/datasets/abc/knowledge_graph -> datasets/{id}/knowledge_graph.
+    """
+    segments = path.split("?", 1)[0].strip("/").split("/")
+    if segments[:2] == ["api", "v1"]:
+        segments = segments[2:]
+    label = []
+    for i, segment in enumerate(segments):
+        label.append("{id}" if i and segments[i - 1] in _ID_PARENTS else segment)
+    return "/".join(label)
+
+
+def current_call() -> Optional[CallTiming]:
+    """Замер вызова, выполняющегося в текущем контексте, если он есть."""
+    return _current_call.get()
+
+
+def tag_datasets(dataset_ids: Iterable[str]) -> None:
+    """Привязывает текущий вызов к датасетам для гистограмм по датасетам."""
+    call = _current_call.get()
+    if call is not None and not call.datasets:
+        call.datasets = list(dataset_ids)
+
+
+def record_connect(seconds: float) -> None:
+    """Учитывает время установки соединения в текущем HTTP-обмене."""
+    exchange = _current_exchange.get()
+    if exchange is not None:
+        exchange["connect"] = exchange.get("connect", 0.0) + seconds
+
+
+@contextmanager
+def track_exchange() -> Iterator[dict]:
+    """Собирает время соединения, установленного внутри блока, в словарь фаз обмена."""
+    exchange = {}
+    token = _current_exchange.set(exchange)
+    try:
+        yield exchange
+    finally:
+        _current_exchange.reset(token)
+
+
+class timed_phase:
+    """
+    Контекстный менеджер, добавляющий время блока к фазе текущего вызова.
+    
+    Вне замеряемого вызова почти ничего не стоит.
+    """
+    
+    __slots__ = ("phase", "call", "started")
+    
+    def __init__(self, phase: str):
+        self.phase = phase
+    
+    def __enter__(self) -> None:
+        self.call = _current_call.get()
+        if self.call is not None:
+            self.started = time.perf_counter()
+    
+    def __exit__(self, *exc_info) -> None:
+        if self.call is not None:
+            self.call.add(self.phase, time.perf_counter() - self.started)
+
+
+@contextmanager
+def capture_calls() -> Iterator[list[CallTiming]]:
+    """
+    Собирает CallTiming вызовов клиента, завершившихся внутри блока в текущем потоке.
+    
+    Работает и для клиента без ClientMetrics, поэтому подходит для
+    диагностики отдельного запроса, например последнего поиска в UI.
+    """
+    calls = []
+    token = _captured.set(calls)
+    try:
+        yield calls
+    finally:
+        _captured.reset(token)
+
+
+def _begin(method: str) -> tuple[CallTiming, object]:
+    timing = CallTiming(method=method, started_at=time.time())
+    return timing, _current_call.set(timing)
+
+
+def _finish(client, timing: CallTiming, token, started: float) -> None:
+    timing.total = time.perf_counter() - started
+    _current_call.reset(token)
+    if client.metrics is not None:
+        client.metrics.record_call(timing)
+    captured = _captured.get()
+    if captured is not None:
+        captured.append(timing)
+
+
+def instrumented(method: Callable) -> Callable:
+    """
+    Декоратор публичных методов клиента: замеряет вызов целиком и по фазам.
+    
+    Вложенные вызовы (search -> retrieve_chunks) учитываются в замере
+    внешнего. Если у клиента нет metrics и никто не собирает замеры через
+    capture_calls, метод вызывается без накладных расходов на замер.
+    """
+    name = method.__name__
+    
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            if _current_call.get() is not None or (self.metrics is None and _captured.get() is None):
+                return await method(self, *args, **kwargs)
+            started = time.perf_counter()
+            timing, token = _begin(name)
+            try:
+                return await method(self, *args, **kwargs)
+            except BaseException as e:
+                timing.error = type(e).__name__
+                raise
+            finally:
+                _finish(self, timing, token, started)
+        return async_wrapper
+    
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _current_call.get() is not None or (self.metrics is None and _captured.get() is None):
+            return method(self, *args, **kwargs)
+        started = time.perf_counter()
+        timing, token = _begin(name)
+        try:
+            return method(self, *args, **kwargs)
+        except BaseException as e:
+            timing.error = type(e).__name__
+            raise
+        finally:
+            _finish(self, timing, token, started)
+    return wrapper
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+class ClientMetrics:
+    """
+    Метрики клиента RAGFlow.
+    
+    Хранит гистограммы длительности по эндпоинтам и фазам HTTP-обмена,
+    по методам клиента и по датасетам, а также счётчики байтов и ошибок.
+    Если метрики переданы AdmissionController, в них же попадают время
+    ожидания в очереди допуска, отказы и глубина очередей.
+    Экспортирует их в текстовом формате Prometheus и/или передаёт каждый
+    CallTiming в callback. Один объект можно разделить между клиентами.
+    """
+    
+    def __init__(
+        self,
+        callback: Optional[Callable[[CallTiming], None]] = None,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        prefix: str = "ragflow_client"
+    ):
+        """
+        Args:
+            callback: Вызывается с CallTiming после каждого вызова метода клиента
+            buckets: Границы корзин гистограмм в секундах
+            prefix: Префикс имён метрик при экспорте
+        """
+        self.callback = callback
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.request_durations: dict[tuple[str, str], Histogram] = {}
+        self.call_durations: dict[tuple[str, str], Histogram] = {}
+        self.dataset_durations: dict[str, Histogram] = {}
+        self.response_bytes: dict[str, int] = {}
+        self.transfer_bytes: dict[str, int] = {}
+        self.errors: dict[tuple[str, str], int] = {}
+        self.admission_waits: dict[tuple[str, str], Histogram] = {}
+        self.admission_rejections: dict[tuple[str, str, str], int] = {}
+        self.queue_depth: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+    
+    def _observe(self, histograms: dict, key, value: float) -> None:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+    
+    def record_request(
+        self,
+        endpoint: str,
+        phases: dict[str, float],
+        response_bytes: int,
+        error: Optional[str],
+        transfer_bytes: Optional[int] = None
+    ) -> None:
+        """
+        Учитывает один HTTP-обмен (одну попытку запроса).
+        
+        response_bytes — размер тела после распаковки, transfer_bytes — сколько
+        байт тела пришло по сети (None — столько же, сжатия не было).
+        """
+        if transfer_bytes is None:
+            transfer_bytes = response_bytes
+        with self._lock:
+            for phase, seconds in phases.items():
+                self._observe(self.request_durations, (endpoint, phase), seconds)
+            self._observe(self.request_durations, (endpoint, "total"), sum(phases.values()))
+            self.response_bytes[endpoint] = self.response_bytes.get(endpoint, 0) + response_bytes
+            self.transfer_bytes[endpoint] = self.transfer_bytes.get(endpoint, 0) + transfer_bytes
+            if error:
+                self.errors[(endpoint, error)] = self.errors.get((endpoint, error), 0) + 1
+    
+    def record_admission(self, endpoint_class: str, priority: str, waited: float, rejected: Optional[str]) -> None:
+        """Учитывает допуск запроса к серверу: время в очереди или причину отказа."""
+        with self._lock:
+            if rejected:
+                key = (endpoint_class, priority, rejected)
+                self.admission_rejections[key] = self.admission_rejections.get(key, 0) + 1
+            else:
+                self._observe(self.admission_waits, (endpoint_class, priority), waited)
+    
+    def record_queue_depth(self, endpoint_class: str, priority: str, depth: int) -> None:
+        """Запоминает текущую глубину очереди допуска."""
+        with self._lock:
+            self.queue_depth[(endpoint_class, priority)] = depth
+    
+    def record_call(self, timing: CallTiming) -> None:
+        """Учитывает завершённый вызов метода клиента и передаёт его в callback."""
+        with self._lock:
+            for phase, seconds in timing.phases.items():
+                self._observe(self.call_durations, (timing.method, phase), seconds)
+            self._observe(self.call_durations, (timing.method, "total"), timing.total)
+            for dataset_id in timing.datasets:
+                self._observe(self.dataset_durations, dataset_id, timing.total)
+        if self.callback is not None:
+            self.callback(timing)
+    
+    def reset(self) -> None:
+        """Сбрасывает накопленные метрики."""
+        with self._lock:
+            self.request_durations.clear()
+            self.call_durations.clear()
+            self.dataset_durations.clear()
+            self.response_bytes.clear()
+            self.transfer_bytes.clear()
+            self.errors.clear()
+            self.admission_waits.clear()
+            self.admission_rejections.clear()
+            # Depths are reported again on the next change of each queue
+            self.queue_depth.clear()
+    
+    def _histogram_lines(self, name: str, help_text: str, histograms: dict, label_names: tuple[str, ...]) -> list[str]:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for key in sorted(histograms):
+            values = key if isinstance(key, tuple) else (key,)
+            labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(label_names, values))
+            histogram = histograms[key]
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{_format_bound(bound)}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return lines
+    
+    def to_prometheus(self) -> str:
+        """Экспорт всех метрик в текстовом формате Prometheus (exposition format 0.0.4)."""
+        p = self.prefix
+        with self._lock:
+            lines = self._histogram_lines(
+                f"{p}_request_duration_seconds", "HTTP exchange duration by endpoint and phase.",
+                self.request_durations, ("endpoint", "phase")
+            )
+            lines += self._histogram_lines(
+                f"{p}_call_duration_seconds", "Client method call duration by phase.",
+                self.call_durations, ("method", "phase")
+            )
+            lines += self._histogram_lines(
+                f"{p}_dataset_call_duration_seconds", "Client method call duration by dataset.",
+                self.dataset_durations, ("dataset",)
+            )
+            lines += [f"# HELP {p}_response_bytes_total Response body bytes by endpoint.",
+                      f"# TYPE {p}_response_bytes_total counter"]
+            lines += [f'{p}_response_bytes_total{{endpoint="{_escape(e)}"}} {n}' for e, n in sorted(self.response_bytes.items())]
+            lines += [f"# HELP {p}_transfer_bytes_total Response body bytes received on the wire, before decompression, by endpoint.",
+                      f"# TYPE {p}_transfer_bytes_total counter"]
+            lines += [f'{p}_transfer_bytes_total{{endpoint="{_escape(e)}"}} {n}' for e, n in sorted(self.transfer_bytes.items())]
+            lines += [f"# HELP {p}_errors_total Failed HTTP exchanges by endpoint and error.",
+                      f"# TYPE {p}_errors_total counter"]
+            lines += [
+                f'{p}_errors_total{{endpoint="{_escape(e)}",error="{_escape(err)}"}} {n}'
+                for (e, err), n in sorted(self.errors.items())
+            ]
+            lines += self._histogram_lines(
+                f"{p}_admission_wait_seconds", "Time requests waited for client-side admission.",
+                self.admission_waits, ("endpoint_class", "priority")
+            )
+            lines += [f"# HELP {p}_admission_rejected_total Requests rejected by client-side admission control.",
+                      f"# TYPE {p}_admission_rejected_total counter"]
+            lines += [
+                f'{p}_admission_rejected_total{{endpoint_class="{_escape(c)}",priority="{_escape(pr)}",'
+                f'reason="{_escape(r)}"}} {n}'
+                for (c, pr, r), n in sorted(self.admission_rejections.items())
+            ]
+            lines += [f"# HELP {p}_admission_queue_depth Requests waiting for client-side admission.",
+                      f"# TYPE {p}_admission_queue_depth gauge"]
+            lines += [
+                f'{p}_admission_queue_depth{{endpoint_class="{_escape(c)}",priority="{_escape(pr)}"}} {n}'
+                for (c, pr), n in sorted(self.queue_depth.items())
+            ]
+        return "\n".join(lines) + "\n"
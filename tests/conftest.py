@@ -0,0 +1,17 @@
+"""Общие фикстуры тестов: mock-сервер RAGFlow из benchmarks."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_server import MockConfig, MockRAGFlowServer  # noqa: E402
+
+
+@pytest.fixture
+def mock_server():
+    """Mock-сервер с небольшими ответами; конфигурацию можно менять через server.config."""
+    with MockRAGFlowServer(MockConfig(chunks=5, content_size=50, datasets=3)) as server:
+        yield server
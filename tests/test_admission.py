@@ -0,0 +1,144 @@
+"""Контроль допуска: порядок полос, вытеснение, проверка лимитов и полосы параллельных запросов."""
+
+import threading
+import time
+
+import pytest
+
+from benchmarks.mock_server import MockConfig, make_chunks
+from ragflow_client import (
+    AdmissionController,
+    AdmissionLimit,
+    AdmissionRejectedError,
+    CircuitBreaker,
+    Priority,
+    RAGFlowClient,
+    _request_priority,
+    request_priority,
+)
+from ragflow_metrics import ClientMetrics
+
+RETRIEVAL = "/api/v1/retrieval"
+
+
+def wait_for_queue(controller: AdmissionController, depth: int) -> None:
+    deadline = time.monotonic() + 2
+    while controller.stats()["retrieval"]["queue_depth"] != depth:
+        assert time.monotonic() < deadline, "waiter never queued"
+        time.sleep(0.005)
+
+
+def queue_request(controller: AdmissionController, priority: Priority, outcomes: list) -> threading.Thread:
+    """Ставит запрос в очередь из отдельного потока; исход дописывается в outcomes."""
+    def run():
+        try:
+            with request_priority(priority):
+                with controller.slot(RETRIEVAL):
+                    outcomes.append(priority)
+        except AdmissionRejectedError as e:
+            outcomes.append(str(e))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize("limit", [
+    AdmissionLimit(rate=0),
+    AdmissionLimit(rate=-1.0),
+    AdmissionLimit(burst=0),
+    AdmissionLimit(concurrency=0),
+    AdmissionLimit(max_queue=0),
+])
+def test_invalid_limits_rejected(limit):
+    with pytest.raises(ValueError):
+        AdmissionController({"retrieval": limit})
+
+
+def test_lanes_served_by_priority():
+    controller = AdmissionController({"retrieval": AdmissionLimit(concurrency=1)})
+    outcomes = []
+    threads = []
+    with controller.slot(RETRIEVAL):
+        for depth, priority in enumerate((Priority.BACKGROUND, Priority.BATCH, Priority.INTERACTIVE), 1):
+            threads.append(queue_request(controller, priority, outcomes))
+            wait_for_queue(controller, depth)
+    for thread in threads:
+        thread.join()
+    assert outcomes == [Priority.INTERACTIVE, Priority.BATCH, Priority.BACKGROUND]
+
+
+def test_full_queue_evicts_lower_priority():
+    controller = AdmissionController({"retrieval": AdmissionLimit(concurrency=1, max_queue=1)})
+    background, interactive = [], []
+    with controller.slot(RETRIEVAL):
+        first = queue_request(controller, Priority.BACKGROUND, background)
+        wait_for_queue(controller, 1)
+        second = queue_request(controller, Priority.INTERACTIVE, interactive)
+        first.join()
+        assert "evicted" in background[0]
+        wait_for_queue(controller, 1)
+        # Nothing lower-priority is left to drop, so a same-priority request is turned away
+        with pytest.raises(AdmissionRejectedError, match="queue_full"):
+            with controller.slot(RETRIEVAL):
+                pass
+    second.join()
+    assert interactive == [Priority.INTERACTIVE]
+    assert controller.stats()["retrieval"]["rejected"] == 2
+
+
+def test_deadline_rejects_before_queueing():
+    controller = AdmissionController(
+        {"retrieval": AdmissionLimit(rate=0.01, burst=1)}, max_wait={Priority.INTERACTIVE: 0.01}
+    )
+    with controller.slot(RETRIEVAL):
+        pass
+    with pytest.raises(AdmissionRejectedError, match="deadline"):
+        with controller.slot(RETRIEVAL):
+            pass
+
+
+def test_rejection_while_recovering_keeps_probe(mock_server):
+    controller = AdmissionController(
+        {"retrieval": AdmissionLimit(rate=0.01, burst=1)}, max_wait={Priority.INTERACTIVE: 0.01}
+    )
+    with RAGFlowClient(
+        mock_server.url, "key", max_retries=0, failure_threshold=1, recovery_timeout=0.05, admission=controller
+    ) as client:
+        client.search("q", ["dataset-0"])
+        client.circuit_breaker.record_failure()
+        time.sleep(0.06)
+        with pytest.raises(AdmissionRejectedError):
+            client.search("q", ["dataset-0"])
+        assert client.circuit_breaker.state != CircuitBreaker.HALF_OPEN
+        # The probe is still available to the next request
+        assert client.test_connection()
+        assert client.circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_fan_out_keeps_priority_lane(mock_server):
+    metrics = ClientMetrics()
+    controller = AdmissionController(metrics=metrics)
+    with RAGFlowClient(mock_server.url, "key", admission=controller) as client:
+        with request_priority(Priority.BATCH):
+            client.search("q", ["dataset-0", "dataset-1", "dataset-2"], fan_out=True)
+    lanes = {key for key, histogram in metrics.admission_waits.items() if histogram.count}
+    assert lanes == {("retrieval", "batch")}
+    assert metrics.admission_waits[("retrieval", "batch")].count == 3
+
+
+def test_prefetch_keeps_priority_lane(mock_server, monkeypatch):
+    with RAGFlowClient(mock_server.url, "key") as client:
+        lanes = []
+
+        def retrieve_chunks(question, dataset_ids, page, page_size, **kwargs):
+            lanes.append((page, _request_priority.get()[0]))
+            chunks = make_chunks(MockConfig(chunks=page_size), dataset_ids, page_size, 0.3)
+            for chunk in chunks:
+                chunk["similarity"] = 1.0
+            return {"code": 0, "data": {"chunks": chunks, "total": 3 * page_size}}
+
+        monkeypatch.setattr(client, "retrieve_chunks", retrieve_chunks)
+        with request_priority(Priority.BACKGROUND):
+            chunks = list(client.iter_chunks("q", ["dataset-0"], page_size=2))
+    assert len(chunks) == 6
+    assert sorted(lanes) == [(1, Priority.BACKGROUND), (2, Priority.BACKGROUND), (3, Priority.BACKGROUND)]
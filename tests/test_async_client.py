@@ -0,0 +1,105 @@
+"""AsyncRAGFlowClient: предохранитель при отмене запросов и проверка подключения."""
+
+import asyncio
+import time
+
+import pytest
+
+from benchmarks.mock_server import MockRAGFlowHandler
+from ragflow_async_client import AsyncRAGFlowClient
+from ragflow_client import CircuitBreaker, CircuitOpenError, RAGFlowClient
+
+
+def recovering_client(url: str, **kwargs) -> AsyncRAGFlowClient:
+    """Клиент, у которого следующий запрос станет пробным."""
+    client = AsyncRAGFlowClient(url, "key", max_retries=0, failure_threshold=1, recovery_timeout=0.05, **kwargs)
+    client.circuit_breaker.record_failure()
+    time.sleep(0.06)
+    return client
+
+
+def test_cancelled_probe_is_released(mock_server):
+    mock_server.config.latency = 1.0
+
+    async def run():
+        async with recovering_client(mock_server.url) as client:
+            task = asyncio.ensure_future(client.search("q", ["dataset-0"]))
+            await asyncio.sleep(0.1)
+            assert client.circuit_breaker.state == CircuitBreaker.HALF_OPEN
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert client.circuit_breaker.state == CircuitBreaker.OPEN
+            mock_server.config.latency = 0.0
+            assert await client.search("q", ["dataset-0"])
+            assert client.circuit_breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(run())
+
+
+def test_request_waiting_for_slot_holds_no_probe(mock_server):
+    async def run():
+        async with recovering_client(mock_server.url, max_concurrency=1) as client:
+            async with client._semaphore:
+                task = asyncio.ensure_future(client.search("q", ["dataset-0"]))
+                await asyncio.sleep(0.05)
+                assert client.circuit_breaker.state == CircuitBreaker.OPEN
+                task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert await client.search("q", ["dataset-0"])
+            assert client.circuit_breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(run())
+
+
+def test_fan_out_budget_does_not_wedge_breaker(mock_server):
+    mock_server.config.latency = 1.0
+
+    async def run():
+        async with recovering_client(mock_server.url) as client:
+            result = await client.fan_out_search("q", ["dataset-0", "dataset-1"], latency_budget=0.1)
+            assert result.timed_out
+            assert client.circuit_breaker.state != CircuitBreaker.HALF_OPEN
+            mock_server.config.latency = 0.0
+            assert await client.search("q", ["dataset-0"])
+
+    asyncio.run(run())
+
+
+def test_open_breaker_rejects(mock_server):
+    async def run():
+        async with AsyncRAGFlowClient(mock_server.url, "key", failure_threshold=1, recovery_timeout=60) as client:
+            client.circuit_breaker.record_failure()
+            with pytest.raises(CircuitOpenError):
+                await client.search("q", ["dataset-0"])
+
+    asyncio.run(run())
+
+
+def test_connection_checks_status_only(mock_server, monkeypatch):
+    def html_health(handler):
+        body = b"<html>ok</html>"
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/html")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    monkeypatch.setattr(MockRAGFlowHandler, "do_GET", html_health)
+
+    async def run():
+        async with AsyncRAGFlowClient(mock_server.url, "key") as client:
+            return await client.test_connection()
+
+    with RAGFlowClient(mock_server.url, "key") as client:
+        assert client.test_connection()
+    assert asyncio.run(run())
+
+
+def test_connection_fails_on_error_status(mock_server):
+    async def run():
+        async with AsyncRAGFlowClient(mock_server.url + "/missing", "key", max_retries=0) as client:
+            return await client.test_connection()
+
+    assert not asyncio.run(run())
@@ -0,0 +1,89 @@
+"""ChunkExporter: разделы выгрузки и замена выдачи запроса только после полной записи."""
+
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import pyarrow.compute as pc  # noqa: E402
+
+from chunk_export import ChunkExporter, open_export  # noqa: E402
+from ragflow_client import Chunk  # noqa: E402
+
+
+def make_chunk(i: int, dataset_id="d1", content="text") -> Chunk:
+    return Chunk(
+        content=f"{content} {i}", similarity=1.0 - i / 100, vector_similarity=0.5, term_similarity=0.5,
+        document_id="doc", document_name="doc.txt", chunk_id=f"c{i}", dataset_id=dataset_id
+    )
+
+
+def contents(root: str, query_id: str) -> list[str]:
+    table = open_export(root).to_table(filter=pc.field("query_id") == query_id)
+    return sorted(table.column("content").to_pylist())
+
+
+def test_partitions_by_query_and_dataset(tmp_path):
+    exporter = ChunkExporter(str(tmp_path), batch_size=2)
+    chunks = [make_chunk(0, "d1"), make_chunk(1, "d2"), make_chunk(2, None), make_chunk(3, "d1")]
+    assert exporter.write("q/1", "question", chunks) == 4
+    table = open_export(str(tmp_path)).to_table()
+    assert table.num_rows == 4
+    assert sorted(table.column("rank").to_pylist()) == [0, 1, 2, 3]
+    assert set(table.column("query_id").to_pylist()) == {"q/1"}
+    dataset_ids = table.column("dataset_id").to_pylist()
+    assert dataset_ids.count(None) == 1
+    assert sorted(d for d in dataset_ids if d is not None) == ["d1", "d1", "d2"]
+    assert sorted(os.listdir(tmp_path / "query_id=q%2F1")) == [
+        "dataset_id=__HIVE_DEFAULT_PARTITION__", "dataset_id=d1", "dataset_id=d2"
+    ]
+
+
+def test_rewrite_replaces_previous_export(tmp_path):
+    exporter = ChunkExporter(str(tmp_path))
+    exporter.write("q", "question", [make_chunk(i, content="old") for i in range(3)])
+    exporter.write("q", "question", [make_chunk(i, content="new") for i in range(2)])
+    assert contents(str(tmp_path), "q") == ["new 0", "new 1"]
+    assert exporter.queries_written == 2 and exporter.rows_written == 5
+
+
+def test_interrupted_rewrite_keeps_previous_export(tmp_path):
+    exporter = ChunkExporter(str(tmp_path), batch_size=1)
+    exporter.write("q", "question", [make_chunk(0, content="old")])
+
+    def failing():
+        yield make_chunk(0, content="new")
+        yield make_chunk(1, "d2", content="new")
+        raise RuntimeError("search failed")
+
+    with pytest.raises(RuntimeError):
+        exporter.write("q", "question", failing())
+    assert contents(str(tmp_path), "q") == ["old 0"]
+    # The staging directory is gone, so only the live partition is left
+    assert os.listdir(tmp_path) == ["query_id=q"]
+
+
+def test_failed_swap_keeps_previous_export(tmp_path, monkeypatch):
+    exporter = ChunkExporter(str(tmp_path))
+    exporter.write("q", "question", [make_chunk(0, content="old")])
+    real_replace = os.replace
+
+    def replace(src, dst):
+        if os.path.basename(src).startswith(".query_id=q.") and not os.path.basename(src).startswith(".query_id=q.old."):
+            raise OSError("disk full")
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", replace)
+    with pytest.raises(OSError):
+        exporter.write("q", "question", [make_chunk(0, content="new")])
+    monkeypatch.undo()
+    assert contents(str(tmp_path), "q") == ["old 0"]
+    assert os.listdir(tmp_path) == ["query_id=q"]
+
+
+def test_empty_rewrite_clears_previous_export(tmp_path):
+    exporter = ChunkExporter(str(tmp_path))
+    exporter.write("q", "question", [make_chunk(0)])
+    assert exporter.write("q", "question", []) == 0
+    assert open_export(str(tmp_path)).to_table().num_rows == 0
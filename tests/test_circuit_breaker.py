@@ -0,0 +1,133 @@
+"""Переходы состояний предохранителя и его учёт в RAGFlowClient._request."""
+
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from ragflow_client import CircuitBreaker, CircuitOpenError, RAGFlowClient
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    """Размыкает цепь и ждёт, пока следующий запрос станет пробным."""
+    for _ in range(max(breaker.failure_threshold, 1)):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(breaker.recovery_timeout + 0.01)
+
+
+def test_opens_after_threshold_and_rejects():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_single_probe_after_recovery_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+    open_breaker(breaker)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_probe_outcome_closes_or_reopens():
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=0.05)
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+def test_released_probe_goes_to_next_request():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_release_outside_half_open_is_noop():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=60)
+    breaker.release()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+
+def test_lost_probe_replaced_after_probe_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05, probe_timeout=0.1)
+    open_breaker(breaker)
+    assert breaker.allow()
+    assert not breaker.allow()
+    time.sleep(0.11)
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_disabled_breaker_always_allows():
+    breaker = CircuitBreaker(failure_threshold=0)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.allow()
+
+
+@pytest.fixture
+def client(mock_server):
+    with RAGFlowClient(mock_server.url, "key", max_retries=0, failure_threshold=1, recovery_timeout=0.05) as client:
+        yield client
+
+
+def test_client_rejects_while_open(client):
+    client.circuit_breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        client.list_datasets()
+
+
+def test_client_probe_success_closes(client):
+    open_breaker(client.circuit_breaker)
+    assert client.test_connection()
+    assert client.circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ChunkedEncodingError("broken body"),
+    requests.exceptions.ContentDecodingError("bad gzip"),
+    requests.exceptions.InvalidHeader("bad header"),
+])
+def test_other_transport_errors_settle_probe(client, error):
+    open_breaker(client.circuit_breaker)
+    with mock.patch.object(client.session, "request", side_effect=error):
+        assert not client.test_connection()
+    assert client.circuit_breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert client.test_connection()
+    assert client.circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_interrupted_probe_is_released(client):
+    open_breaker(client.circuit_breaker)
+    with mock.patch.object(client.session, "request", side_effect=KeyboardInterrupt):
+        with pytest.raises(KeyboardInterrupt):
+            client.list_datasets()
+    assert client.circuit_breaker.state == CircuitBreaker.OPEN
+    assert client.test_connection()
+    assert client.circuit_breaker.state == CircuitBreaker.CLOSED
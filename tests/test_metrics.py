@@ -0,0 +1,35 @@
+"""Замеры вызовов через capture_calls и сброс ClientMetrics."""
+
+from ragflow_client import RAGFlowClient
+from ragflow_metrics import ClientMetrics, capture_calls
+
+DATASETS = ["dataset-0", "dataset-1", "dataset-2"]
+
+
+def test_fan_out_requests_counted_in_call(mock_server):
+    with RAGFlowClient(mock_server.url, "key") as client:
+        with capture_calls() as calls:
+            client.search("q", DATASETS, fan_out=True)
+    assert [call.method for call in calls] == ["search"]
+    assert calls[0].requests == len(DATASETS)
+    assert calls[0].response_bytes > 0
+    assert calls[0].datasets == DATASETS
+
+
+def test_client_metrics_see_fan_out_requests(mock_server):
+    metrics = ClientMetrics()
+    with RAGFlowClient(mock_server.url, "key", metrics=metrics) as client:
+        client.fan_out_search("q", DATASETS)
+    assert metrics.request_durations[("retrieval", "total")].count == len(DATASETS)
+    assert metrics.call_durations[("fan_out_search", "total")].count == 1
+
+
+def test_reset_clears_queue_depth():
+    metrics = ClientMetrics()
+    metrics.record_queue_depth("retrieval", "interactive", 3)
+    metrics.record_admission("retrieval", "interactive", 0.1, None)
+    sample = 'admission_queue_depth{endpoint_class="retrieval",priority="interactive"}'
+    assert sample in metrics.to_prometheus()
+    metrics.reset()
+    assert metrics.queue_depth == {}
+    assert sample not in metrics.to_prometheus()
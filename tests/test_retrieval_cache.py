@@ -0,0 +1,82 @@
+"""RetrievalCache: ключи, изоляция по серверу и ключу API, TTL, LRU и хранение в SQLite."""
+
+import asyncio
+import time
+
+from ragflow_async_client import AsyncRAGFlowClient
+from ragflow_client import RAGFlowClient, RetrievalCache
+
+PAYLOAD = {"question": "What  is RAG?", "dataset_ids": ["b", "a"], "top_k": 5}
+
+
+def test_key_ignores_case_spacing_and_dataset_order():
+    other = {"question": "what is rag?", "dataset_ids": ["a", "b"], "top_k": 5}
+    assert RetrievalCache.make_key(PAYLOAD) == RetrievalCache.make_key(other)
+    assert RetrievalCache.make_key(PAYLOAD) != RetrievalCache.make_key({**other, "top_k": 6})
+
+
+def test_key_scoped_by_namespace():
+    assert RetrievalCache.make_key(PAYLOAD, "server-1 key-a") != RetrievalCache.make_key(PAYLOAD, "server-1 key-b")
+    assert RetrievalCache.make_key(PAYLOAD, "server-1 key-a") == RetrievalCache.make_key(PAYLOAD, "server-1 key-a")
+
+
+def test_clients_with_different_keys_do_not_share_entries(mock_server):
+    cache = RetrievalCache()
+    with RAGFlowClient(mock_server.url, "key-a", cache=cache) as first, \
+            RAGFlowClient(mock_server.url, "key-b", cache=cache) as second, \
+            RAGFlowClient(mock_server.url + "/", "key-a", cache=cache) as same:
+        first.search("q", ["dataset-0"])
+        assert (cache.stats.hits, cache.stats.misses) == (0, 1)
+        second.search("q", ["dataset-0"])
+        assert (cache.stats.hits, cache.stats.misses) == (0, 2)
+        same.search("q", ["dataset-0"])
+        assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+    assert len(cache) == 2
+
+
+def test_async_client_shares_entries_of_same_credentials(mock_server):
+    cache = RetrievalCache()
+    with RAGFlowClient(mock_server.url, "key-a", cache=cache) as client:
+        client.search("q", ["dataset-0"])
+
+    async def run(api_key):
+        async with AsyncRAGFlowClient(mock_server.url, api_key, cache=cache) as client:
+            await client.search("q", ["dataset-0"])
+
+    asyncio.run(run("key-a"))
+    assert cache.stats.hits == 1
+    asyncio.run(run("key-b"))
+    assert cache.stats.hits == 1
+
+
+def test_ttl_and_lru():
+    cache = RetrievalCache(max_entries=2, ttl=0.05)
+    cache.put("a", ["d1"], {"v": 1})
+    cache.put("b", ["d1"], {"v": 2})
+    assert cache.get("a") == {"v": 1}
+    cache.put("c", ["d2"], {"v": 3})
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert cache.stats.evictions == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+
+
+def test_invalidate_dataset():
+    cache = RetrievalCache()
+    cache.put("a", ["d1", "d2"], {"v": 1})
+    cache.put("b", ["d3"], {"v": 2})
+    assert cache.invalidate_dataset("d2") == 1
+    assert cache.get("a") is None and cache.get("b") == {"v": 2}
+
+
+def test_sqlite_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = RetrievalCache(path=path)
+    cache.put("a", ["d1"], {"v": 1})
+    cache.close()
+    reopened = RetrievalCache(path=path)
+    assert reopened.get("a") == {"v": 1}
+    reopened.invalidate_dataset("d1")
+    reopened.close()
+    assert RetrievalCache(path=path).get("a") is None
@@ -0,0 +1,43 @@
+"""Потоковое ИИ-резюме: накопление ответа и ошибки разбора событий SSE."""
+
+import pytest
+
+from benchmarks.mock_server import MockRAGFlowHandler
+from ragflow_client import RAGFlowClient, RAGFlowError
+
+
+def serve_events(monkeypatch, *events: str) -> None:
+    """Подменяет SSE-поток mock-сервера заданными событиями (без заголовка charset)."""
+    def stream_answer(handler):
+        handler.send_response(200)
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        for event in events:
+            handler.wfile.write(f"data:{event}\n\n".encode("utf-8"))
+        handler.close_connection = True
+
+    monkeypatch.setattr(MockRAGFlowHandler, "_stream_answer", stream_answer)
+
+
+def collect(mock_server) -> list:
+    with RAGFlowClient(mock_server.url, "key") as client:
+        return list(client.stream_ai_summary("assistant", "q"))
+
+
+def test_stream_accumulates_answer(mock_server):
+    mock_server.config.stream_tokens = 3
+    deltas = collect(mock_server)
+    assert "".join(delta.text for delta in deltas) == "token0 token1 token2 "
+    assert deltas[-1].answer == "token0 token1 token2 "
+
+
+def test_stream_decodes_utf8_without_charset(mock_server, monkeypatch):
+    serve_events(monkeypatch, '{"code": 0, "data": {"answer": "привет"}}', '{"code": 0, "data": true}')
+    assert [delta.answer for delta in collect(mock_server)][0] == "привет"
+
+
+@pytest.mark.parametrize("event", ['{"code": 0, "data": {"ans', "[1]"])
+def test_malformed_event_raises_ragflow_error(mock_server, monkeypatch, event):
+    serve_events(monkeypatch, '{"code": 0, "data": {"answer": "a"}}', event)
+    with pytest.raises(RAGFlowError, match="Invalid summary stream event"):
+        collect(mock_server)